@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Remote changes agent.
+#  Created by LulzLoL231 at 16/10/2026
+#
+#  Script is copied to remote host with watcher.py and hashing.py (all of
+#  them use only standard library) and started on persistent exec channel.
+#  It watches remote folder, hashes changed files only and writes events
+#  as JSON lines to stdout:
+#      {"event": "file", "path": <relative path>, "hash": <hex>, "size": <int>, "mtime": <str>}
+#      {"event": "deleted", "path": <relative path>}
+#      {"event": "ready"}  (after initial snapshot)
+#      {"event": "ping"}  (when there are no changes for ping interval)
+#  Agent exits when its stdin is closed.
+#
+#  In tree mode (--tree <state file>) agent keeps Merkle tree of root
+#  instead of writing events: tree is built once on start (hashes of
+#  previous run are kept in state file, so only changed files are
+#  rehashed) and then updated from watcher events, so client can skip
+#  unchanged subtrees without listing them. Agent answers requests read
+#  from stdin as JSON lines:
+#      {"update": [<relative path>, ...], "hash": [<relative dir>, ...], "list": [<relative dir>, ...]}
+#  ("update" lists paths written by client, they are rehashed before
+#  answer even if watcher hasn't reported them yet) with
+#      {"event": "tree", "hash": {<dir>: <hex> | null},
+#       "list": {<dir>: {<name>: {"dir": <hex>} | {"hash": <digest>, "size": <int>, "mtime": <str>}} | null}}
+#  where null is written for missing directory and file digests are
+#  "<algorithm>:<hex>" as in client manifest. "ready" event with number
+#  of files is written before first answer.
+#
+#  Usage on remote host:
+#      python3 agent.py [--algorithm md5] [--exclude .meta] [--ping 10] <root>
+#      python3 agent.py --tree <state file> [--algorithm md5] [--exclude .meta] <root>
+#
+import os
+import sys
+import json
+import socket
+import logging
+import argparse
+import threading
+from typing import Callable, Iterator, Optional, Tuple, Union
+
+from hashing import FingerprintCache, formatDigest, formatMTime, hashFile
+from merkle import MerkleTree, Node
+from watcher import ChangeQueue, createWatcher
+
+
+# Temp files of transfers, not reported.
+TEMP_MARKERS = ('sunc_temp_', '.delta-')
+
+
+class Agent:
+    '''Keeps hashes of files in root and writes change events.
+    '''
+    def __init__(self, root: str, algorithm: str = 'md5', exclude: Tuple[str, ...] = (),
+                 ping_interval: float = 10, out=None):
+        self.root = os.path.abspath(root)
+        self.algorithm = algorithm
+        self.exclude = tuple(os.path.join(self.root, path) for path in exclude)
+        self.ping_interval = ping_interval
+        self.out = out or sys.stdout
+        self.sent = {}
+        self.tree = None
+        self.fingerprints = FingerprintCache()
+
+    def isIgnored(self, path: str) -> bool:
+        '''Check that path is excluded or temporary file.
+        '''
+        name = os.path.basename(path)
+        if name.startswith('.') and name.endswith('.new'):
+            return True
+        if any(marker in name for marker in TEMP_MARKERS):
+            return True
+        return any(path == excluded or path.startswith(excluded + os.path.sep) for excluded in self.exclude)
+
+    def emit(self, event: dict) -> None:
+        self.out.write(json.dumps(event) + '\n')
+        self.out.flush()
+
+    def walk(self) -> Iterator[str]:
+        '''Yields all not ignored files in root.
+        '''
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [name for name in dirnames if (not self.isIgnored(os.path.join(dirpath, name)))]
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if (not self.isIgnored(path)):
+                    yield path
+
+    def getRelativePath(self, path: str) -> str:
+        return os.path.relpath(path, self.root).replace(os.path.sep, '/')
+
+    def getEntry(self, path: str) -> dict:
+        '''Returns hash, size and mtime of file, hashing it only if it's changed.
+
+        Args:
+            path (str): absolute path.
+
+        Raises:
+            OSError: file can't be read.
+
+        Returns:
+            dict: {"hash": <hex>, "size", "mtime"}.
+        '''
+        st = os.stat(path)
+        digest = self.fingerprints.get(path, self.algorithm, st)
+        if digest is None:
+            digest = hashFile(path, self.algorithm)
+            self.fingerprints.set(path, self.algorithm, digest, st)
+        return {'hash': digest, 'size': st.st_size, 'mtime': formatMTime(st)}
+
+    def update(self, path: str) -> None:
+        '''Hash file if it's changed and report it if its hash differs from sent one.
+
+        Args:
+            path (str): absolute path.
+        '''
+        relpath = self.getRelativePath(path)
+        if os.path.isdir(path):
+            return
+        try:
+            entry = self.getEntry(path)
+        except OSError:
+            self.fingerprints.invalidate(path)
+            if self.sent.pop(relpath, None) is not None:
+                self.report(relpath, None)
+            for known in [known for known in self.sent if known.startswith(relpath + '/')]:
+                del self.sent[known]
+                self.report(known, None)
+            return
+        if self.sent.get(relpath) != entry:
+            self.sent[relpath] = entry
+            self.report(relpath, entry)
+
+    def report(self, relpath: str, entry: Optional[dict]) -> None:
+        '''Emit change event, or apply change to tree in tree mode.
+
+        Args:
+            relpath (str): relative path.
+            entry (Optional[dict]): file entry, None if file is removed.
+        '''
+        if self.tree is not None:
+            if entry is None:
+                self.tree.remove(relpath)
+            else:
+                self.tree.set(relpath, formatDigest(self.algorithm, entry['hash']))
+        elif entry is None:
+            self.emit({'event': 'deleted', 'path': relpath})
+        else:
+            self.emit(dict(event='file', path=relpath, **entry))
+
+    def applyChanges(self, changed: set, full_scan: bool = False) -> None:
+        '''Update changed paths, all files if watcher lost events.
+
+        Args:
+            changed (set): absolute paths.
+            full_scan (bool): watcher lost events.
+        '''
+        if full_scan:
+            # Watcher lost events, deleted files are found by sent paths.
+            changed = changed | set(self.walk()) | {os.path.join(self.root, relpath) for relpath in self.sent}
+        for path in sorted(changed):
+            if (not self.isIgnored(path)):
+                self.update(path)
+
+    def run(self, backend: str = 'auto', poll_interval: float = 1, debounce: float = 0.2) -> None:
+        '''Send snapshot, then changes until stdin is closed.
+        '''
+        queue = ChangeQueue()
+        watcher = createWatcher(backend, [self.root], queue, poll_interval)
+        watcher.start()
+        for path in self.walk():
+            self.update(path)
+        self.emit({'event': 'ready'})
+        while True:
+            changed = queue.wait(self.ping_interval, debounce)
+            full_scan = queue.takeFullScan()
+            if (not changed) and (not full_scan):
+                self.emit({'event': 'ping'})
+                continue
+            self.applyChanges(changed, full_scan)
+
+    def listTree(self, path: str) -> Optional[Union[dict, None]]:
+        '''Returns subdirectory hashes and file entries of directory in tree.
+
+        Args:
+            path (str): relative directory path.
+
+        Returns:
+            Optional[Union[dict, None]]: {name: {"dir": <hex>} or file entry} or None.
+        '''
+        tree = self.tree
+        node = tree.getNode(path)
+        if node is None:
+            return None
+        prefix = f'{path}/' if path else ''
+        listing = {}
+        for name, child in node.children.items():
+            if isinstance(child, Node):
+                listing[name] = {'dir': tree.getHash(child)}
+            else:
+                listing[name] = dict(self.sent[prefix + name], hash=child)
+        return listing
+
+    def loadState(self, state_path: str) -> dict:
+        '''Load file hashes saved by previous run of tree mode.
+
+        Args:
+            state_path (str): state file path.
+
+        Returns:
+            dict: loaded entries, see FingerprintCache.export.
+        '''
+        try:
+            with open(state_path) as f:
+                saved = json.load(f)
+            self.fingerprints.load(saved)
+        except (OSError, ValueError, AttributeError):
+            return {}
+        return saved
+
+    def saveState(self, state_path: str, saved: dict) -> dict:
+        '''Save file hashes if they differ from saved ones.
+
+        Args:
+            state_path (str): state file path.
+            saved (dict): entries saved before.
+
+        Returns:
+            dict: saved entries.
+        '''
+        state = {}
+        for relpath in self.sent:
+            path = os.path.join(self.root, relpath)
+            entry = self.fingerprints.export(path)
+            if entry is not None:
+                state[path] = entry
+        if state != saved:
+            temp_path = f'{state_path}.new'
+            with open(temp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(temp_path, state_path)
+        return state
+
+    def serveTree(self, state_path: str, src=None, backend: str = 'auto', poll_interval: float = 1) -> None:
+        '''Build Merkle tree of root and answer requests until stdin is closed.
+
+        Tree is built once, then changes reported by watcher are applied
+        before every answer, so answer costs O(changes), not O(tree).
+
+        Args:
+            state_path (str): state file path.
+            src: requests stream, stdin by default.
+            backend (str): watcher backend.
+            poll_interval (float): polling watcher interval.
+        '''
+        saved = self.loadState(state_path)
+        self.tree = MerkleTree()
+        queue = ChangeQueue()
+        # Watcher is started before walk, so changes made during walk are not lost.
+        watcher = createWatcher(backend, [self.root], queue, poll_interval)
+        watcher.start()
+        for path in self.walk():
+            self.update(path)
+        saved = self.saveState(state_path, saved)
+        self.emit({'event': 'ready', 'files': self.tree.size})
+        for line in (src or sys.stdin):
+            request = json.loads(line)
+            changed = queue.wait(0) | {os.path.join(self.root, *path.split('/')) for path in request.get('update', ())}
+            self.applyChanges(changed, queue.takeFullScan())
+            hashes = {}
+            for path in request.get('hash', ()):
+                node = self.tree.getNode(path)
+                hashes[path] = self.tree.getHash(node) if node is not None else None
+            self.emit({
+                'event': 'tree',
+                'hash': hashes,
+                'list': {path: self.listTree(path) for path in request.get('list', ())}
+            })
+        watcher.stop()
+        self.saveState(state_path, saved)
+
+
+class AgentClient(threading.Thread):
+    '''Runs agent on remote host and passes its events to handler.
+
+    Agent is restarted after reconnect, it sends full snapshot again.
+    Handler gets {"event": "disconnected"} when channel is lost.
+    '''
+    def __init__(self, open_channel: Callable, command: str, handler: Callable[[dict], None],
+                 ping_interval: float = 10, reconnect_interval: float = 5):
+        super().__init__(name='AgentClient', daemon=True)
+        self.NAME = self.__class__.__name__
+        self.log = logging.getLogger(self.NAME)
+        self.open_channel = open_channel
+        self.command = command
+        self.handler = handler
+        self.ping_interval = ping_interval
+        self.reconnect_interval = reconnect_interval
+        self._chan = None
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            chan = self.open_channel()
+            if chan is not None:
+                self._chan = chan
+                try:
+                    self.readEvents(chan)
+                except (OSError, EOFError, ValueError, socket.timeout) as e:
+                    self.log.warning(f'"run": Agent channel is lost: {str(e)}')
+                finally:
+                    chan.close()
+                    self._chan = None
+                self.handler({'event': 'disconnected'})
+            self._stop_event.wait(self.reconnect_interval)
+
+    def readEvents(self, chan) -> None:
+        '''Start agent on channel and read its events until channel is closed.
+        '''
+        chan.settimeout(self.ping_interval * 3)
+        chan.exec_command(self.command)
+        for line in chan.makefile('rb'):
+            self.handler(json.loads(line))
+        if (not self._stop_event.is_set()):
+            stderr = chan.makefile_stderr('rb').read().decode(errors='replace')
+            self.log.warning(f'"readEvents": Agent exited with status {chan.recv_exit_status()}: {stderr}')
+
+    def stop(self) -> None:
+        '''Stop agent.
+        '''
+        self._stop_event.set()
+        chan = self._chan
+        if chan is not None:
+            chan.close()
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description='FileSync remote changes agent.')
+    parser.add_argument('root')
+    parser.add_argument('--algorithm', default='md5')
+    parser.add_argument('--exclude', action='append', default=[])
+    parser.add_argument('--ping', type=float, default=10)
+    parser.add_argument('--tree', help='state file, answer Merkle tree requests instead of watching')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    agent = Agent(args.root, args.algorithm, tuple(args.exclude), args.ping)
+    if args.tree:
+        try:
+            agent.serveTree(args.tree)
+        except BrokenPipeError:
+            pass
+        return 0
+
+    def waitStdin():
+        while sys.stdin.buffer.read(65536):
+            pass
+        os._exit(0)
+
+    threading.Thread(target=waitStdin, daemon=True).start()
+    try:
+        agent.run()
+    except BrokenPipeError:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
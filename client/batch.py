@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Batch transfer of small files.
+#  Created by LulzLoL231 at 16/10/2026
+#
+#  Script is copied to remote host with hashing.py (both of them use only
+#  standard library). Many small files are sent as one tar stream on one
+#  exec channel instead of SCP session per file, files are hashed while
+#  they are streamed, so they are not read again for verification.
+#
+#  Usage on remote host:
+#      python3 batch.py extract [--algorithm md5] [--temp <dir>] <root>  < tar  > JSON lines
+#      python3 batch.py create [--algorithm md5] <root>  < relative paths  > tar
+#
+#  "extract" replaces every file atomically and prints
+#  {"path": <relative path>, "hash": <hex>, "size": <int>, "mtime": <str>} for it.
+#  "create" sends files and then MANIFEST_NAME member with
+#  {<relative path>: {"hash", "size", "mtime"}} of all sent files.
+#
+import io
+import os
+import sys
+import json
+import tarfile
+import argparse
+from typing import BinaryIO, Iterable, Optional, Tuple, Union
+
+from hashing import formatMTime, newHasher
+
+
+MANIFEST_NAME = '.filesync-batch.json'
+READ_SIZE = 256 * 1024
+
+
+class HashingReader:
+    '''File wrapper, passes all read data to hashers.
+    '''
+    def __init__(self, f: BinaryIO, hashers: Iterable):
+        self.f = f
+        self.hashers = tuple(hashers)
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        for h in self.hashers:
+            h.update(data)
+        return data
+
+
+def isSafeName(name: str) -> bool:
+    '''Check that tar member name is relative path without "..".
+    '''
+    parts = name.split('/')
+    return bool(name) and (not name.startswith('/')) and '..' not in parts and '' not in parts
+
+
+def addFile(tar: tarfile.TarFile, path: str, arcname: str,
+            algorithms: Iterable[str]) -> Optional[Union[Tuple[dict, os.stat_result], None]]:
+    '''Add file to tar stream, hashing sent data.
+
+    Args:
+        tar (tarfile.TarFile): tar opened for writing.
+        path (str): file path.
+        arcname (str): member name.
+        algorithms (Iterable[str]): hash algorithms.
+
+    Returns:
+        Optional[Union[Tuple[dict, os.stat_result], None]]: {algorithm: hex digest} and stat, None if file can't be opened.
+    '''
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+    with f:
+        st = os.fstat(f.fileno())
+        info = tarfile.TarInfo(arcname)
+        info.size = st.st_size
+        info.mtime = st.st_mtime
+        info.mode = st.st_mode & 0o777
+        hashers = {algorithm: newHasher(algorithm) for algorithm in algorithms}
+        tar.addfile(info, HashingReader(f, hashers.values()))
+    return {algorithm: h.hexdigest() for algorithm, h in hashers.items()}, st
+
+
+def extractFile(tar: tarfile.TarFile, member: tarfile.TarInfo, path: str, algorithms: Iterable[str]) -> dict:
+    '''Write tar member to path, hashing received data.
+
+    Args:
+        tar (tarfile.TarFile): tar opened for reading.
+        member (tarfile.TarInfo): regular file member.
+        path (str): file path.
+        algorithms (Iterable[str]): hash algorithms.
+
+    Returns:
+        dict: {algorithm: hex digest}.
+    '''
+    hashers = {algorithm: newHasher(algorithm) for algorithm in algorithms}
+    src = tar.extractfile(member)
+    with open(path, 'wb') as f:
+        for data in iter(lambda: src.read(READ_SIZE), b''):
+            for h in hashers.values():
+                h.update(data)
+            f.write(data)
+    return {algorithm: h.hexdigest() for algorithm, h in hashers.items()}
+
+
+def extract(root: str, algorithm: str, temp_dir: str, src: BinaryIO, out) -> None:
+    '''Extract files from tar stream into root.
+
+    Raises:
+        ValueError: member is not regular file or its name is unsafe.
+    '''
+    with tarfile.open(fileobj=src, mode='r|') as tar:
+        for member in tar:
+            if (not member.isfile()) or (not isSafeName(member.name)):
+                raise ValueError(f'unexpected member: {member.name}')
+            path = os.path.join(root, member.name)
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            temp_path = os.path.join(temp_dir or directory, f'.{os.path.basename(path)}.{os.getpid()}.new')
+            digest = extractFile(tar, member, temp_path, (algorithm,))[algorithm]
+            os.replace(temp_path, path)
+            st = os.stat(path)
+            out.write(json.dumps(
+                {'path': member.name, 'hash': digest, 'size': st.st_size, 'mtime': formatMTime(st)}) + '\n')
+            out.flush()
+
+
+def create(root: str, algorithm: str, names: Iterable[str], out: BinaryIO) -> None:
+    '''Write files from root and manifest of them as tar stream.
+
+    Missing files are skipped, they are not in manifest.
+    '''
+    entries = {}
+    with tarfile.open(fileobj=out, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+        for name in names:
+            if (not isSafeName(name)):
+                continue
+            res = addFile(tar, os.path.join(root, name), name, (algorithm,))
+            if res is None:
+                continue
+            digests, st = res
+            entries[name] = {'hash': digests[algorithm], 'size': st.st_size, 'mtime': formatMTime(st)}
+        data = json.dumps(entries).encode()
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description='FileSync batch transfer.')
+    parser.add_argument('command', choices=('extract', 'create'))
+    parser.add_argument('root')
+    parser.add_argument('--algorithm', default='md5')
+    parser.add_argument('--temp', default='')
+    args = parser.parse_args(argv)
+    try:
+        if args.command == 'extract':
+            if args.temp:
+                os.makedirs(args.temp, exist_ok=True)
+            extract(args.root, args.algorithm, args.temp, sys.stdin.buffer, sys.stdout)
+        else:
+            create(args.root, args.algorithm, sys.stdin.read().splitlines(), sys.stdout.buffer)
+    except (OSError, ValueError, tarfile.TarError) as e:
+        sys.stderr.write(f'batch.py: {str(e)}\n')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,681 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Benchmark suite.
+#  Created by LulzLoL231 at 16/10/2026
+#
+'''Benchmark FileSync against local in-process SSH server.
+
+Usage:
+    python bench.py [--scale 1] [--workload NAME] [--option KEY=VALUE]
+                    [--latency 0] [--output FILE] [--compare BASELINE] [--threshold 0.1]
+
+Server supports exec requests (run by "sh -c" in temp remote folder),
+SCP sink/source and SFTP subsystem, so it needs the same GNU tools as
+real remote host.
+Results are printed (or saved) as JSON, "--compare" checks them against
+previous results and exits with code 1 on regression.
+'''
+import os
+import sys
+import json
+import time
+import shlex
+import queue
+import random
+import socket
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import statistics
+import subprocess
+from typing import Optional
+
+import paramiko
+
+import main
+
+
+BENCH_USERNAME = 'bench'
+BENCH_PASSWORD = 'bench'
+BUFFER_SIZE = 64 * 1024
+WORKLOADS = ('small_files', 'huge_files', 'small_edits', 'idle', 'operations')
+
+
+class CountingSocket:
+    '''Socket wrapper counting bytes sent and received by server.
+
+    With latency data sent by server is delivered after that delay by
+    background thread, emulating link with round trip time of latency.
+    '''
+    def __init__(self, sock: socket.socket, counters: dict, lock: threading.Lock, latency: float = 0):
+        self._sock = sock
+        self._counters = counters
+        self._lock = lock
+        self._latency = latency
+        self._queue = None
+        if latency:
+            self._queue = queue.Queue()
+            threading.Thread(target=self._deliver, daemon=True).start()
+
+    def _deliver(self) -> None:
+        while True:
+            due, data = self._queue.get()
+            time.sleep(max(0.0, due - time.monotonic()))
+            try:
+                self._sock.sendall(data)
+            except OSError:
+                return
+
+    def recv(self, size: int) -> bytes:
+        data = self._sock.recv(size)
+        with self._lock:
+            self._counters['received'] += len(data)
+        return data
+
+    def send(self, data: bytes) -> int:
+        if self._queue is not None:
+            self._queue.put((time.monotonic() + self._latency, bytes(data)))
+            sent = len(data)
+        else:
+            sent = self._sock.send(data)
+        with self._lock:
+            self._counters['sent'] += sent
+        return sent
+
+    def __getattr__(self, name: str):
+        return getattr(self._sock, name)
+
+
+class ChannelReader:
+    '''Buffered exact reads from channel, used by SCP protocol.
+    '''
+    def __init__(self, chan: paramiko.Channel):
+        self.chan = chan
+        self.buffer = b''
+
+    def read(self, size: int) -> bytes:
+        while len(self.buffer) < size:
+            data = self.chan.recv(max(BUFFER_SIZE, size - len(self.buffer)))
+            if not data:
+                break
+            self.buffer += data
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self) -> bytes:
+        while b'\n' not in self.buffer:
+            data = self.chan.recv(BUFFER_SIZE)
+            if not data:
+                data, self.buffer = self.buffer, b''
+                return data
+            self.buffer += data
+        line, _, self.buffer = self.buffer.partition(b'\n')
+        return line
+
+
+class BenchServerInterface(paramiko.ServerInterface):
+    '''Accepts bench credentials and exec requests.
+    '''
+    def __init__(self, server: 'BenchServer'):
+        self.server = server
+
+    def get_allowed_auths(self, username: str) -> str:
+        return 'password'
+
+    def check_auth_password(self, username: str, password: str) -> int:
+        if username == BENCH_USERNAME and password == BENCH_PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind: str, chanid: int) -> int:
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel: paramiko.Channel, command: bytes) -> bool:
+        threading.Thread(
+            target=self.server.execute,
+            args=(channel, command.decode(errors='replace')),
+            daemon=True
+        ).start()
+        return True
+
+
+class BenchSFTPHandle(paramiko.SFTPHandle):
+    '''Open file of SFTP session.
+    '''
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+
+class BenchSFTPServer(paramiko.SFTPServerInterface):
+    '''SFTP on local files, paths are relative to root.
+    '''
+    def __init__(self, server: paramiko.ServerInterface, root: str):
+        super().__init__(server)
+        self.root = root
+
+    def getPath(self, path: str) -> str:
+        return os.path.join(self.root, os.path.normpath('/' + path).lstrip('/'))
+
+    def open(self, path, flags, attr):
+        mode = {os.O_RDONLY: 'rb', os.O_WRONLY: 'wb', os.O_RDWR: 'r+b'}[flags & 3]
+        if flags & os.O_APPEND:
+            mode = 'ab'
+        try:
+            fd = os.open(self.getPath(path), flags, 0o644)
+            f = os.fdopen(fd, mode)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        handle = BenchSFTPHandle(flags)
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.getPath(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def list_folder(self, path):
+        try:
+            path = self.getPath(path)
+            return [
+                paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)), name)
+                for name in os.listdir(path)
+            ]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def remove(self, path):
+        return self.call(os.remove, self.getPath(path))
+
+    def rename(self, oldpath, newpath):
+        return self.call(os.rename, self.getPath(oldpath), self.getPath(newpath))
+
+    def posix_rename(self, oldpath, newpath):
+        return self.call(os.replace, self.getPath(oldpath), self.getPath(newpath))
+
+    def mkdir(self, path, attr):
+        return self.call(os.mkdir, self.getPath(path))
+
+    def rmdir(self, path):
+        return self.call(os.rmdir, self.getPath(path))
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+
+    def call(self, func, *args) -> int:
+        try:
+            func(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+class BenchServer:
+    '''SSH server on 127.0.0.1 with random port, serving files from root.
+    '''
+    def __init__(self, root: str, latency: float = 0):
+        self.NAME = self.__class__.__name__
+        self.log = logging.getLogger(self.NAME)
+        self.root = root
+        self.latency = latency
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.port = None
+        self.counters = {'connections': 0, 'commands': 0, 'sent': 0, 'received': 0}
+        self._lock = threading.Lock()
+        self._sock = None
+        self._transports = []
+
+    @property
+    def stats(self) -> dict:
+        '''Returns copy of server counters.
+
+        Returns:
+            dict: connections, commands, bytes sent and received.
+        '''
+        with self._lock:
+            return self.counters.copy()
+
+    def start(self) -> None:
+        '''Start listening in background thread.
+        '''
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(16)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept, name='BenchServer', daemon=True).start()
+
+    def writeKnownHosts(self, path: str) -> None:
+        '''Write host key of server to known_hosts file.
+
+        Args:
+            path (str): known_hosts file path.
+        '''
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(f'[127.0.0.1]:{self.port} {self.host_key.get_name()} {self.host_key.get_base64()}\n')
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.counters['connections'] += 1
+            transport = paramiko.Transport(CountingSocket(sock, self.counters, self._lock, self.latency))
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, BenchSFTPServer, self.root)
+            transport.start_server(server=BenchServerInterface(self))
+            self._transports.append(transport)
+
+    def execute(self, chan: paramiko.Channel, command: str) -> None:
+        '''Run exec request.
+
+        Args:
+            chan (paramiko.Channel): session channel.
+            command (str): command line.
+        '''
+        with self._lock:
+            self.counters['commands'] += 1
+        args = shlex.split(command) if command.startswith('scp ') else []
+        try:
+            if '-t' in args:
+                status = self.scpSink(chan, args[-1])
+            elif '-f' in args:
+                status = self.scpSource(chan, args[-1])
+            else:
+                status = self.shell(chan, command)
+        except Exception as e:
+            self.log.debug(f'"execute": Command ({command}) failed: {str(e)}')
+            status = 1
+        try:
+            chan.send_exit_status(status)
+        finally:
+            chan.close()
+
+    def shell(self, chan: paramiko.Channel, command: str) -> int:
+        '''Run command by "sh -c" in root, streaming stdin, stdout and stderr.
+        '''
+        proc = subprocess.Popen(
+            ['sh', '-c', command], cwd=self.root,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+        def pumpStdin():
+            try:
+                for data in iter(lambda: chan.recv(BUFFER_SIZE), b''):
+                    proc.stdin.write(data)
+                    proc.stdin.flush()
+            except (OSError, ValueError):
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+
+        def pumpStderr():
+            for data in iter(lambda: proc.stderr.read1(BUFFER_SIZE), b''):
+                chan.sendall_stderr(data)
+
+        threads = [
+            threading.Thread(target=pumpStdin, daemon=True),
+            threading.Thread(target=pumpStderr, daemon=True)
+        ]
+        for thread in threads:
+            thread.start()
+        for data in iter(lambda: proc.stdout.read1(BUFFER_SIZE), b''):
+            chan.sendall(data)
+        threads[1].join()
+        return proc.wait()
+
+    def scpSink(self, chan: paramiko.Channel, target: str) -> int:
+        '''Receive files sent by "scp -t".
+        '''
+        reader = ChannelReader(chan)
+        path = os.path.join(self.root, target)
+        chan.sendall(b'\x00')
+        while True:
+            line = reader.readline()
+            if (not line):
+                return 0
+            if line[:1] == b'T':
+                chan.sendall(b'\x00')
+                continue
+            if line[:1] != b'C':
+                chan.sendall(b'\x01scp: unsupported command\n')
+                return 1
+            mode, size, name = line[1:].decode().split(' ', 2)
+            filepath = os.path.join(path, name) if os.path.isdir(path) else path
+            chan.sendall(b'\x00')
+            remaining = int(size)
+            with open(filepath, 'wb') as f:
+                while remaining:
+                    data = reader.read(min(BUFFER_SIZE, remaining))
+                    if (not data):
+                        return 1
+                    f.write(data)
+                    remaining -= len(data)
+            os.chmod(filepath, int(mode, 8))
+            if reader.read(1) != b'\x00':
+                return 1
+            chan.sendall(b'\x00')
+
+    def scpSource(self, chan: paramiko.Channel, target: str) -> int:
+        '''Send file requested by "scp -f".
+        '''
+        reader = ChannelReader(chan)
+        path = os.path.join(self.root, target)
+        if reader.read(1) != b'\x00':
+            return 1
+        if (not os.path.isfile(path)):
+            chan.sendall(f'\x01scp: {target}: No such file or directory\n'.encode())
+            return 1
+        st = os.stat(path)
+        chan.sendall(f'C{st.st_mode & 0o7777:04o} {st.st_size} {os.path.basename(path)}\n'.encode())
+        if reader.read(1) != b'\x00':
+            return 1
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(BUFFER_SIZE), b''):
+                chan.sendall(data)
+        chan.sendall(b'\x00')
+        reader.read(1)
+        return 0
+
+    def close(self) -> None:
+        '''Stop server.
+        '''
+        self._sock.close()
+        for transport in self._transports:
+            transport.close()
+
+
+class Bench:
+    '''Runs workloads, each one with fresh local and remote folders.
+    '''
+    def __init__(self, scale: float = 1, options: Optional[dict] = None, seed: int = 0, latency: float = 0):
+        self.NAME = self.__class__.__name__
+        self.log = logging.getLogger(self.NAME)
+        self.scale = scale
+        self.options = options or {}
+        self.random = random.Random(seed)
+        self.workdir = tempfile.mkdtemp(prefix='filesync-bench-')
+        self.server = BenchServer(self.workdir, latency)
+        self.server.start()
+        os.environ['HOME'] = self.workdir
+        self.server.writeKnownHosts(os.path.join(self.workdir, '.ssh', 'known_hosts'))
+        self.fs = None
+
+    def count(self, number: int) -> int:
+        return max(1, int(number * self.scale))
+
+    def writeFile(self, path: str, size: int) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            while size > 0:
+                chunk = min(size, 1024 * 1024)
+                f.write(self.random.randbytes(chunk))
+                size -= chunk
+
+    def setUp(self, name: str, local_files: list):
+        '''Create FileSync for workload.
+
+        Args:
+            name (str): workload name.
+            local_files (list): tracked paths relative to local folder.
+
+        Returns:
+            FileSync: connected FileSync with initialized remote folder.
+        '''
+        local = os.path.join(self.workdir, name, 'local')
+        self.server.root = os.path.join(self.workdir, name, 'remote')
+        os.makedirs(local, exist_ok=True)
+        os.makedirs(self.server.root, exist_ok=True)
+        os.chdir(local)
+        config = {
+            'hostname': '127.0.0.1',
+            'port': self.server.port,
+            'username': BENCH_USERNAME,
+            'password': BENCH_PASSWORD,
+            'watch_backend': 'none',
+            'local_files': [os.path.join(local, path) for path in local_files]
+        }
+        config.update(self.options)
+        with open('config.json', 'w') as f:
+            json.dump(config, f)
+        self.fs = main.FileSync()
+        self.fs.initRemote()
+        return self.fs
+
+    def tearDown(self) -> None:
+        self.fs.state.close()
+        self.fs.engine.shutdown()
+        self.fs.connection.close()
+        self.fs = None
+        os.chdir(self.workdir)
+
+    def measure(self, func, repeat: int = 1, size: int = 0) -> dict:
+        '''Run func repeat times and returns counters difference.
+
+        Args:
+            func (Callable): measured function.
+            repeat (int): number of runs.
+            size (int): bytes transferred by one run, for functions not counted by engine stats.
+
+        Returns:
+            dict: latencies, transferred bytes, throughput, connection and wire counters.
+        '''
+        connection = self.fs.connection.stats
+        engine = self.fs.engine.stats
+        server = self.server.stats
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - started)
+        elapsed = sum(latencies)
+        connection_after = self.fs.connection.stats
+        server_after = self.server.stats
+        transferred = self.fs.engine.stats['bytes'] - engine['bytes'] or size * repeat
+        return {
+            'runs': repeat,
+            'latency': {
+                'min': min(latencies),
+                'median': statistics.median(latencies),
+                'max': max(latencies)
+            },
+            'seconds': elapsed,
+            'files': self.fs.engine.stats['files'] - engine['files'],
+            'bytes': transferred,
+            'throughput': transferred / elapsed if elapsed > 0 else 0.0,
+            'handshakes': connection_after['handshakes'] - connection['handshakes'],
+            'channels': connection_after['channels'] - connection['channels'],
+            'commands': server_after['commands'] - server['commands'],
+            'wire_sent': server_after['received'] - server['received'],
+            'wire_received': server_after['sent'] - server['sent']
+        }
+
+    def small_files(self) -> dict:
+        '''First sync of many small files in tracked directory.
+        '''
+        for i in range(self.count(500)):
+            self.writeFile(os.path.join(self.workdir, 'small_files', 'local', 'tree', f'd{i % 20}', f'f{i}'), 4096)
+        fs = self.setUp('small_files', ['tree/'])
+        return self.measure(fs.syncCycle)
+
+    def huge_files(self) -> dict:
+        '''First sync of a few huge files.
+        '''
+        names = [f'huge{i}.bin' for i in range(2)]
+        for name in names:
+            self.writeFile(os.path.join(self.workdir, 'huge_files', 'local', name), self.count(64) * 1024 * 1024)
+        fs = self.setUp('huge_files', names)
+        return self.measure(fs.syncCycle)
+
+    def small_edits(self) -> dict:
+        '''Sync of small edits in synced huge files.
+        '''
+        names = [f'huge{i}.bin' for i in range(2)]
+        for name in names:
+            self.writeFile(os.path.join(self.workdir, 'small_edits', 'local', name), self.count(64) * 1024 * 1024)
+        fs = self.setUp('small_edits', names)
+        fs.syncCycle()
+        for path in fs.config['local_files']:
+            with open(path, 'r+b') as f:
+                f.seek(self.random.randrange(os.path.getsize(path) - 4096))
+                f.write(self.random.randbytes(4096))
+        return self.measure(fs.syncCycle)
+
+    def idle(self) -> dict:
+        '''Sync cycles without any changes.
+        '''
+        local = os.path.join(self.workdir, 'idle', 'local')
+        for i in range(self.count(200)):
+            self.writeFile(os.path.join(local, 'tree', f'f{i}'), 4096)
+        self.writeFile(os.path.join(local, 'huge.bin'), self.count(16) * 1024 * 1024)
+        fs = self.setUp('idle', ['tree/', 'huge.bin'])
+        fs.syncCycle()
+        return self.measure(fs.syncCycle, 5)
+
+    def operations(self) -> dict:
+        '''Single file operations: hashing, upload, download and remote hash check.
+        '''
+        self.writeFile(os.path.join(self.workdir, 'operations', 'local', 'file.bin'), self.count(8) * 1024 * 1024)
+        fs = self.setUp('operations', ['file.bin'])
+        path = fs.config['local_files'][0]
+        size = os.path.getsize(path)
+        results = {
+            'getMD5': self.measure(lambda: fs.getMD5(path), 3),
+            'upload': self.measure(lambda: fs.upload(path), 3, size)
+        }
+        fs.updateRemoteHash(path)
+        results['checkRemoteFile'] = self.measure(lambda: fs.checkRemoteFile(path), 3)
+        results['download'] = self.measure(lambda: fs.download(path), 3, size)
+        return results
+
+    def run(self, workloads: list) -> dict:
+        '''Run workloads.
+
+        Args:
+            workloads (list): workload names.
+
+        Returns:
+            dict: results.
+        '''
+        results = {
+            'scale': self.scale,
+            'options': self.options,
+            'python': sys.version.split()[0],
+            'workloads': {}
+        }
+        try:
+            for name in workloads:
+                self.log.info(f'"run": Running {name}...')
+                try:
+                    results['workloads'][name] = getattr(self, name)()
+                finally:
+                    if self.fs is not None:
+                        self.tearDown()
+        finally:
+            self.server.close()
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        # Peak of whole bench process (with in-process server) over all workloads,
+        # not comparable between runs of different workload sets.
+        results['process_peak_rss_kib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return results
+
+
+def iterMetrics(results: dict, prefix: str = ''):
+    '''Yields (name, value) for comparable metrics of results.
+    '''
+    for key, value in results.items():
+        if isinstance(value, dict) and 'latency' in value:
+            yield f'{prefix}{key}.latency', value['latency']['median']
+            for metric in ('handshakes', 'channels', 'commands', 'wire_sent', 'wire_received'):
+                yield f'{prefix}{key}.{metric}', value[metric]
+            if value['bytes']:
+                yield f'{prefix}{key}.throughput', value['throughput']
+        elif isinstance(value, dict):
+            yield from iterMetrics(value, f'{prefix}{key}.')
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.1) -> list:
+    '''Returns regressions of results against baseline.
+
+    Throughput is regressed when it's lower than baseline, other metrics
+    when they are higher, both by more than threshold part.
+
+    Args:
+        results (dict): new results.
+        baseline (dict): old results.
+        threshold (float): allowed relative difference.
+
+    Returns:
+        list: regression descriptions.
+    '''
+    old = dict(iterMetrics(baseline['workloads']))
+    regressions = []
+    for name, value in iterMetrics(results['workloads']):
+        if name not in old:
+            continue
+        if name.endswith('.throughput'):
+            regressed = value < old[name] * (1 - threshold)
+        else:
+            # Small counters may differ by one request between runs.
+            regressed = value > old[name] * (1 + threshold) and (isinstance(value, float) or value - old[name] > 1)
+        if regressed:
+            regressions.append(f'{name}: {old[name]:.6g} -> {value:.6g}')
+    return regressions
+
+
+def parseOption(option: str) -> tuple:
+    '''Returns (key, value) from "key=value", value is parsed as JSON if possible.
+    '''
+    key, _, value = option.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FileSync benchmark.')
+    parser.add_argument('--scale', type=float, default=1, help='workload size multiplier')
+    parser.add_argument('--workload', action='append', choices=WORKLOADS, help='workload to run, all by default')
+    parser.add_argument('--option', action='append', default=[], help='FileSync config option, KEY=VALUE')
+    parser.add_argument('--seed', type=int, default=0, help='random data seed')
+    parser.add_argument('--latency', type=float, default=0, help='emulated round trip time, milliseconds')
+    parser.add_argument('--output', help='save results to file')
+    parser.add_argument('--compare', help='baseline results file')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed regression, part of baseline')
+    parser.add_argument('--verbose', action='store_true', help='show FileSync logs')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.DEBUG if 'FILESYNC_DEBUG' in os.environ else (
+        logging.INFO if args.verbose else logging.CRITICAL))
+    bench = Bench(args.scale, dict(parseOption(option) for option in args.option), args.seed, args.latency / 1000)
+    results = bench.run(args.workload or list(WORKLOADS))
+    data = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data)
+    else:
+        print(data)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Content-addressed chunk store.
+#  Created by LulzLoL231 at 16/10/2026
+#
+#  Module uses only standard library: it is copied to remote host and
+#  started there as script for storing and sending chunks.
+#
+#  Files are split into content-defined chunks (boundary is found by
+#  content of last bytes), so an insertion shifts only nearby boundaries.
+#  Every distinct file content is stored once, as objects/<sha256 hex of
+#  content>, and remote file is a reflink clone of its object (blocks are
+#  shared until one of them is written) or, where filesystem can't clone,
+#  a hard link to it. So duplicate files and repeated versions take disk
+#  space once, while remote files still hold their content for transfers
+#  not using chunk store. Note that with hard links a program editing
+#  such file in place changes all files with the same content.
+#  Manifests of uploaded files are kept as manifests/<sha256 hex of file path>:
+#      {"filesync_cas": 1, "path": <str>, "size": <int>, "avg_size": <int>, "mtime_ns": <int>,
+#       "object": <hex>, "chunks": [[<hex>, <size>], ...]}
+#  index.sqlite maps chunk digest to object and offset, it's updated by
+#  put and sweep, so queries don't read manifests. Chunk read from object
+#  is checked by its digest; if it's gone, put exits with MISSING_STATUS
+#  and prints missing digests, client sends them as literals and retries.
+#  Chunks received by put are spilled to incoming/ until file is assembled.
+#  Manifests of deleted or changed files and objects no manifest uses are
+#  removed by sweep.
+#
+#  Usage on remote host:
+#      python3 cas.py missing <store>  < hashes  > missing hashes
+#      python3 cas.py put <store> <path>  < frames + manifest  (> missing hashes, exit 3)
+#      python3 cas.py get <store> <path> <avg_size>  < hashes of chunks client has  > header + frames
+#      python3 cas.py sweep <store> [min_age]  > {"removed": <int>, "freed": <int>, "manifests": <int>}
+#
+import os
+import sys
+import json
+import struct
+import shutil
+import sqlite3
+import hashlib
+import time
+from contextlib import closing
+from typing import BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+READ_SIZE = 1024 * 1024
+# Incoming files younger than this are not swept: they may belong to
+# running upload.
+SWEEP_MIN_AGE = 3600
+# Exit status of put when chunks are gone from store.
+MISSING_STATUS = 3
+# Linux ioctl cloning whole file (btrfs, xfs and others).
+FICLONE = 0x40049409
+# Max variables in one SQLite query.
+QUERY_SIZE = 500
+# Frame: raw SHA-256 digest and data length, zero digest ends frames.
+FRAME_HEADER = struct.Struct('>32sI')
+END_DIGEST = bytes(32)
+# Every byte value is mapped to "0" or "1" (half of values each), table must
+# be the same everywhere for deduplication between hosts.
+_RANKED = sorted(range(256), key=lambda value: hashlib.sha256(bytes([value])).digest())
+MARKS = bytes.maketrans(bytes(_RANKED), b'1' * 128 + b'0' * 128)
+
+
+def getChunkLimits(avg_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[int, int, int]:
+    '''Returns min, average (power of 2) and max chunk size.
+
+    Args:
+        avg_size (int): wanted average chunk size.
+
+    Returns:
+        Tuple[int, int, int]: min, avg and max size.
+    '''
+    avg_size = 1 << max(12, avg_size.bit_length() - 1)
+    return avg_size // 4, avg_size, avg_size * 4
+
+
+def iterChunks(f: BinaryIO, avg_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    '''Yields content-defined chunks of file.
+
+    Chunk ends after run of log2(avg_size) - 1 bytes which are all
+    marked "1" in MARKS table (such run starts on average once per
+    avg_size bytes of random data), so boundary depends only on these bytes and an
+    insertion moves only nearby boundaries. Search is done by
+    bytes.translate and bytes.find, not by Python loop over bytes.
+
+    Args:
+        f (BinaryIO): file opened for reading.
+        avg_size (int): average chunk size.
+
+    Yields:
+        Iterator[bytes]: chunks.
+    '''
+    min_size, avg_size, max_size = getChunkLimits(avg_size)
+    run = b'1' * (avg_size.bit_length() - 2)
+    buffer = bytearray()
+    marks = bytearray()
+    eof = False
+    while True:
+        while len(buffer) < max_size and (not eof):
+            data = f.read(READ_SIZE)
+            if data:
+                buffer += data
+                marks += data.translate(MARKS)
+            else:
+                eof = True
+        if (not buffer):
+            return
+        end = min(len(buffer), max_size)
+        found = marks.find(run, min_size - len(run), end)
+        cut = end if found < 0 else found + len(run)
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+        del marks[:cut]
+
+
+def chunkFile(filepath: str, avg_size: int = DEFAULT_CHUNK_SIZE) -> List[Tuple[str, int, int]]:
+    '''Returns chunks of file.
+
+    Args:
+        filepath (str): file path.
+        avg_size (int): average chunk size.
+
+    Returns:
+        List[Tuple[str, int, int]]: SHA-256 hex, offset and size of every chunk.
+    '''
+    chunks = []
+    offset = 0
+    with open(filepath, 'rb') as f:
+        for chunk in iterChunks(f, avg_size):
+            chunks.append((hashlib.sha256(chunk).hexdigest(), offset, len(chunk)))
+            offset += len(chunk)
+    return chunks
+
+
+def makeManifest(chunks: List[Tuple[str, int, int]], avg_size: int = DEFAULT_CHUNK_SIZE) -> bytes:
+    '''Returns manifest of file from its chunks.
+
+    Args:
+        chunks (List[Tuple[str, int, int]]): chunks from chunkFile.
+        avg_size (int): average chunk size used by chunkFile.
+
+    Returns:
+        bytes: JSON manifest.
+    '''
+    size = sum(chunk_size for _, _, chunk_size in chunks)
+    manifest = {
+        'filesync_cas': 1,
+        'size': size,
+        'avg_size': avg_size,
+        'chunks': [[digest, chunk_size] for digest, _, chunk_size in chunks]
+    }
+    return json.dumps(manifest, separators=(',', ':')).encode()
+
+
+def getManifestPath(store: str, path: str) -> str:
+    return os.path.join(store, 'manifests', hashlib.sha256(path.encode()).hexdigest())
+
+
+def loadManifest(store: str, path: str) -> Optional[dict]:
+    '''Returns manifest of file if file wasn't changed after it's written.
+
+    Args:
+        store (str): store folder.
+        path (str): file path.
+
+    Returns:
+        Optional[dict]: manifest or None if it's missing or stale.
+    '''
+    try:
+        with open(getManifestPath(store, path), 'rb') as f:
+            manifest = json.load(f)
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('path') != path or (manifest['size'], manifest['mtime_ns']) != (st.st_size, st.st_mtime_ns):
+        return None
+    return manifest
+
+
+def writeFrame(out: BinaryIO, digest: str, data: bytes) -> None:
+    out.write(FRAME_HEADER.pack(bytes.fromhex(digest), len(data)))
+    out.write(data)
+
+
+def writeEnd(out: BinaryIO) -> None:
+    out.write(FRAME_HEADER.pack(END_DIGEST, 0))
+
+
+def readExact(src: BinaryIO, size: int) -> bytes:
+    data = src.read(size)
+    if len(data) != size:
+        raise EOFError('unexpected end of stream')
+    return data
+
+
+def iterFrames(src: BinaryIO) -> Iterator[Tuple[str, bytes]]:
+    '''Yields (hex digest, data) from frames stream until end frame.
+    '''
+    while True:
+        digest, size = FRAME_HEADER.unpack(readExact(src, FRAME_HEADER.size))
+        if digest == END_DIGEST:
+            return
+        yield digest.hex(), readExact(src, size)
+
+
+def writeAtomic(path: str, data: bytes, temp_dir: str = '') -> None:
+    '''Write file through temp file and rename.
+
+    Args:
+        path (str): file path.
+        data (bytes): file data.
+        temp_dir (str): folder for temp file on the same filesystem, folder of path by default.
+    '''
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    temp_dir = temp_dir or directory
+    os.makedirs(temp_dir, exist_ok=True)
+    temp_path = os.path.join(temp_dir, f'.{os.path.basename(path)}.{os.getpid()}.new')
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class MissingChunks(ValueError):
+    '''Chunks of manifest are neither received nor readable from store.
+    '''
+    def __init__(self, digests: List[str]):
+        super().__init__(f'{len(digests)} chunks are missing')
+        self.digests = digests
+
+
+def openIndex(store: str) -> sqlite3.Connection:
+    '''Returns connection to chunk index of store, creating it if needed.
+    '''
+    os.makedirs(store, exist_ok=True)
+    db = sqlite3.connect(os.path.join(store, 'index.sqlite'), timeout=60)
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS chunks '
+        '(digest TEXT PRIMARY KEY, object TEXT NOT NULL, offset INTEGER NOT NULL, size INTEGER NOT NULL)')
+    db.execute('CREATE INDEX IF NOT EXISTS chunks_object ON chunks (object)')
+    return db
+
+
+def lookup(db: sqlite3.Connection, digests: List[str]) -> Dict[str, Tuple[str, int, int]]:
+    '''Returns index entries of chunks.
+
+    Returns:
+        Dict[str, Tuple[str, int, int]]: {hex digest: (object hex, offset, size)}.
+    '''
+    found = {}
+    digests = list(digests)
+    for start in range(0, len(digests), QUERY_SIZE):
+        part = digests[start:start + QUERY_SIZE]
+        rows = db.execute(
+            f'SELECT digest, object, offset, size FROM chunks WHERE digest IN ({",".join("?" * len(part))})', part)
+        for digest, object_hex, offset, size in rows:
+            found[digest] = (object_hex, offset, size)
+    return found
+
+
+def getObjectPath(store: str, object_hex: str) -> str:
+    return os.path.join(store, 'objects', object_hex[:2], object_hex)
+
+
+def readChunk(path: str, offset: int, size: int, digest: str) -> bytes:
+    '''Returns chunk from file, checked by its digest.
+
+    Raises:
+        ValueError: file is changed and has no such chunk anymore.
+    '''
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(size)
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f'chunk {digest} is changed in {path}')
+    return data
+
+
+def hashPath(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(READ_SIZE), b''):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def cloneFile(src: str, dst: str) -> None:
+    '''Create dst sharing blocks with src (reflink).
+
+    Raises:
+        OSError: filesystem or platform can't clone files.
+    '''
+    import fcntl
+
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.unlink(dst)
+            raise
+
+
+def linkObject(object_path: str, path: str, temp_dir: str) -> None:
+    '''Replace path with clone of object, hard link or copy if clone isn't supported.
+    '''
+    temp_path = os.path.join(temp_dir, f'.{os.path.basename(path)}.{os.getpid()}.link')
+    try:
+        cloneFile(object_path, temp_path)
+    except (OSError, ImportError):
+        try:
+            os.link(object_path, temp_path)
+        except OSError:
+            shutil.copyfile(object_path, temp_path)
+    os.replace(temp_path, path)
+
+
+def missing(store: str, digests: List[str]) -> List[str]:
+    '''Returns digests of chunks which are not in store index.
+    '''
+    with closing(openIndex(store)) as db:
+        found = lookup(db, digests)
+    return [digest for digest in digests if digest not in found]
+
+
+def put(store: str, path: str, src: BinaryIO) -> None:
+    '''Assemble file from received frames and chunks of stored objects,
+    store its content as object and write its manifest.
+
+    Every chunk is checked by its digest. Received chunks are spilled to
+    incoming file in store, which is removed when file is assembled.
+    Content already stored as object is not stored again.
+
+    Raises:
+        MissingChunks: chunks are neither received nor readable from store.
+        ValueError: chunk is corrupted.
+    '''
+    incoming = os.path.join(store, 'incoming')
+    os.makedirs(incoming, exist_ok=True)
+    # Temp files are kept in store, so they're never seen in synced folders.
+    spill_path = os.path.join(incoming, f'.{os.path.basename(path)}.{os.getpid()}.chunks')
+    temp_path = os.path.join(incoming, f'.{os.path.basename(path)}.{os.getpid()}.new')
+    with closing(openIndex(store)) as db:
+        try:
+            received = {}
+            with open(spill_path, 'w+b') as spill:
+                for digest, data in iterFrames(src):
+                    if hashlib.sha256(data).hexdigest() != digest:
+                        raise ValueError(f'chunk {digest} is corrupted')
+                    if digest not in received:
+                        received[digest] = (spill.tell(), len(data))
+                        spill.write(data)
+                manifest = json.loads(src.read())
+                stored = lookup(db, [digest for digest, _ in manifest['chunks'] if digest not in received])
+                hasher = hashlib.sha256()
+                absent = []
+                with open(temp_path, 'wb') as f:
+                    for digest, _ in manifest['chunks']:
+                        try:
+                            if digest in received:
+                                offset, size = received[digest]
+                                spill.seek(offset)
+                                data = spill.read(size)
+                            else:
+                                object_hex, offset, size = stored[digest]
+                                data = readChunk(getObjectPath(store, object_hex), offset, size, digest)
+                        except (KeyError, OSError, ValueError):
+                            absent.append(digest)
+                            continue
+                        hasher.update(data)
+                        f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            if absent:
+                with db:
+                    db.executemany('DELETE FROM chunks WHERE digest = ?', [(digest,) for digest in absent])
+                raise MissingChunks(list(dict.fromkeys(absent)))
+            object_hex = hasher.hexdigest()
+            object_path = getObjectPath(store, object_hex)
+            if os.path.exists(object_path) and hashPath(object_path) == object_hex:
+                os.unlink(temp_path)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.replace(temp_path, object_path)
+            linkObject(object_path, path, incoming)
+        finally:
+            for leftover in (spill_path, temp_path):
+                if os.path.exists(leftover):
+                    os.unlink(leftover)
+        rows = []
+        offset = 0
+        for digest, size in manifest['chunks']:
+            rows.append((digest, object_hex, offset, size))
+            offset += size
+        with db:
+            db.executemany('INSERT OR IGNORE INTO chunks VALUES (?, ?, ?, ?)', rows)
+    st = os.stat(path)
+    manifest.update(path=path, mtime_ns=st.st_mtime_ns, object=object_hex)
+    writeAtomic(getManifestPath(store, path), json.dumps(manifest, separators=(',', ':')).encode(), incoming)
+
+
+def get(store: str, path: str, avg_size: int, have: Set[str], out: BinaryIO) -> None:
+    '''Send file: header line with manifest, then frames of chunks client
+    hasn't.
+
+    Manifest is taken from store if file wasn't changed after upload,
+    otherwise file is chunked now. Chunks are read from file itself.
+    '''
+    manifest = loadManifest(store, path)
+    if manifest is None or manifest.get('avg_size') != avg_size:
+        manifest = json.loads(makeManifest(chunkFile(path, avg_size), avg_size))
+    out.write(json.dumps({'manifest': manifest}).encode() + b'\n')
+    sent = set()
+    offset = 0
+    with open(path, 'rb') as f:
+        for digest, size in manifest['chunks']:
+            if digest not in have and digest not in sent:
+                f.seek(offset)
+                writeFrame(out, digest, f.read(size))
+                sent.add(digest)
+            offset += size
+    writeEnd(out)
+
+
+def sweep(store: str, min_age: float = SWEEP_MIN_AGE) -> dict:
+    '''Remove manifests of deleted or changed files, objects no manifest
+    uses (with their index entries) and leftovers of interrupted uploads.
+
+    Chunk files of older store layout (chunks/ folder) are removed too.
+
+    Args:
+        store (str): store folder.
+        min_age (float): incoming files modified less than this seconds ago are kept.
+
+    Returns:
+        dict: removed files, freed bytes and number of kept manifests.
+    '''
+    manifests = 0
+    used = {}
+    manifests_dir = os.path.join(store, 'manifests')
+    for name in (os.listdir(manifests_dir) if os.path.isdir(manifests_dir) else []):
+        if name.startswith('.'):
+            continue
+        manifest_path = os.path.join(manifests_dir, name)
+        try:
+            with open(manifest_path, 'rb') as f:
+                path = json.load(f).get('path', '')
+        except (OSError, ValueError):
+            path = ''
+        manifest = loadManifest(store, path) if path else None
+        if manifest is not None:
+            manifests += 1
+            used[manifest.get('object')] = manifest
+        else:
+            os.unlink(manifest_path)
+    removed = freed = 0
+    unused = []
+    for dirpath, _, filenames in os.walk(os.path.join(store, 'objects')):
+        for name in filenames:
+            if name in used:
+                continue
+            object_path = os.path.join(dirpath, name)
+            st = os.stat(object_path)
+            os.unlink(object_path)
+            unused.append((name,))
+            removed += 1
+            # Hard linked content is still used by other file.
+            if st.st_nlink == 1:
+                freed += st.st_size
+    if unused:
+        # Chunks of removed objects may be in used ones too.
+        rows = []
+        for object_hex, manifest in used.items():
+            if (not object_hex):
+                continue
+            offset = 0
+            for digest, size in manifest['chunks']:
+                rows.append((digest, object_hex, offset, size))
+                offset += size
+        with closing(openIndex(store)) as db, db:
+            db.executemany('DELETE FROM chunks WHERE object = ?', unused)
+            db.executemany('INSERT OR IGNORE INTO chunks VALUES (?, ?, ?, ?)', rows)
+    deadline = time.time() - min_age
+    for folder, keep_recent in (('incoming', True), ('chunks', False)):
+        for dirpath, _, filenames in os.walk(os.path.join(store, folder), topdown=False):
+            for name in filenames:
+                file_path = os.path.join(dirpath, name)
+                st = os.stat(file_path)
+                if keep_recent and st.st_mtime > deadline:
+                    continue
+                os.unlink(file_path)
+                removed += 1
+                freed += st.st_size
+            if (not keep_recent) and (not os.listdir(dirpath)):
+                os.rmdir(dirpath)
+    return {'removed': removed, 'freed': freed, 'manifests': manifests}
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) < 3 or argv[1] not in ('missing', 'put', 'get', 'sweep'):
+        sys.stderr.write(__doc__ or 'Usage: cas.py missing|put|get|sweep <store> [path] [avg_size]\n')
+        return 2
+    command, store = argv[1], argv[2]
+    try:
+        if command == 'missing':
+            digests = sys.stdin.read().split()
+            sys.stdout.write(''.join(f'{digest}\n' for digest in missing(store, digests)))
+        elif command == 'put':
+            try:
+                put(store, argv[3], sys.stdin.buffer)
+            except MissingChunks as e:
+                sys.stdout.write(''.join(f'{digest}\n' for digest in e.digests))
+                return MISSING_STATUS
+        elif command == 'get':
+            get(store, argv[3], int(argv[4]), set(sys.stdin.read().split()), sys.stdout.buffer)
+        else:
+            result = sweep(store, float(argv[3]) if len(argv) > 3 else SWEEP_MIN_AGE)
+            sys.stdout.write(json.dumps(result) + '\n')
+    except (OSError, ValueError, EOFError, KeyError, sqlite3.Error) as e:
+        sys.stderr.write(f'cas.py: {str(e)}\n')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
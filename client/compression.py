@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Transfer compression.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import os
+import zlib
+import lzma
+import threading
+from typing import Optional, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+SAMPLE_SIZE = 64 * 1024
+# Compressed sample must be smaller than this part of original sample.
+COMPRESSIBLE_RATIO = 0.9
+# Already compressed formats, not worth compressing again.
+COMPRESSED_EXTENSIONS = frozenset((
+    '.gz', '.tgz', '.bz2', '.xz', '.txz', '.zst', '.lz4', '.lzma', '.zip',
+    '.7z', '.rar', '.jar', '.apk', '.docx', '.xlsx', '.pptx', '.odt',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.mp3', '.aac',
+    '.ogg', '.opus', '.flac', '.mp4', '.mkv', '.avi', '.mov', '.webm',
+    '.pdf', '.woff', '.woff2'
+))
+
+
+class Codec:
+    '''Streaming codec with matching commands on remote host.
+    '''
+    def __init__(self, name: str, compress_command: str, decompress_command: str):
+        self.name = name
+        self.compress_command = compress_command
+        self.decompress_command = decompress_command
+
+    def compressor(self):
+        '''Returns object with compress and flush methods.
+        '''
+        if self.name == 'gzip':
+            return zlib.compressobj(6, zlib.DEFLATED, 31)
+        elif self.name == 'xz':
+            return lzma.LZMACompressor(lzma.FORMAT_XZ, preset=1)
+        return zstandard.ZstdCompressor(level=3).compressobj()
+
+    def decompressor(self):
+        '''Returns object with decompress method.
+        '''
+        if self.name == 'gzip':
+            return zlib.decompressobj(31)
+        elif self.name == 'xz':
+            return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+        return zstandard.ZstdDecompressor().decompressobj()
+
+
+CODECS = {
+    'gzip': Codec('gzip', 'gzip -c', 'gzip -dc'),
+    'xz': Codec('xz', 'xz -c -1', 'xz -dc'),
+    'zstd': Codec('zstd', 'zstd -c -q', 'zstd -dc -q')
+}
+
+
+def getCodec(name: str) -> Optional[Union[Codec, None]]:
+    '''Returns codec by name if it's available on this host.
+
+    Args:
+        name (str): "gzip", "xz" or "zstd".
+
+    Returns:
+        Optional[Union[Codec, None]]: codec or None.
+    '''
+    if name == 'zstd' and zstandard is None:
+        return None
+    return CODECS.get(name)
+
+
+def isCompressible(filepath: str) -> bool:
+    '''Check that file is worth compressing.
+
+    Files with known compressed formats are skipped, others are checked
+    by compressing sample from file start with fast zlib level.
+
+    Args:
+        filepath (str): path to file.
+
+    Returns:
+        bool: True or False.
+    '''
+    if os.path.splitext(filepath)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    try:
+        with open(filepath, 'rb') as f:
+            sample = f.read(SAMPLE_SIZE)
+    except OSError:
+        return True
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * COMPRESSIBLE_RATIO
+
+
+class CompressionStats:
+    '''Per-file compression counters: raw bytes, bytes on wire and CPU time.
+    '''
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def record(self, filepath: str, raw: int, wire: int, cpu: float) -> None:
+        '''Add transfer to file counters.
+
+        Args:
+            filepath (str): local file path.
+            raw (int): uncompressed bytes.
+            wire (int): compressed bytes.
+            cpu (float): CPU seconds spent in codec.
+        '''
+        with self._lock:
+            stats = self._files.setdefault(filepath, {'raw': 0, 'wire': 0, 'cpu': 0.0, 'transfers': 0})
+            stats['raw'] += raw
+            stats['wire'] += wire
+            stats['cpu'] += cpu
+            stats['transfers'] += 1
+
+    def get(self, filepath: str) -> dict:
+        '''Returns counters for file.
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            dict: raw, wire, cpu and transfers.
+        '''
+        with self._lock:
+            return dict(self._files.get(filepath, {'raw': 0, 'wire': 0, 'cpu': 0.0, 'transfers': 0}))
+
+    def totals(self) -> dict:
+        '''Returns counters summed over all files.
+
+        Returns:
+            dict: raw, wire, cpu and transfers.
+        '''
+        with self._lock:
+            totals = {'raw': 0, 'wire': 0, 'cpu': 0.0, 'transfers': 0}
+            for stats in self._files.values():
+                for key in totals:
+                    totals[key] += stats[key]
+            return totals
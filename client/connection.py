@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Connection manager.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import sys
+import time
+import socket
+import inspect
+import logging
+import threading
+from typing import TYPE_CHECKING, Optional, Union, Tuple
+
+from transfer import getCipherPreference
+
+# paramiko and scp are imported on first connect: their import takes
+# most of startup time, it's done in connection warm-up thread.
+if TYPE_CHECKING:
+    from paramiko import SSHClient, Transport, Channel
+    from scp import SCPClient
+
+
+class ConnectionManager:
+    '''Keeps one authenticated SSH transport and opens channels on it.
+    '''
+    def __init__(self, hostname: str, port: int, username: str, password: str,
+                 keepalive: int = 30, timeout: Optional[float] = None, compress: bool = False,
+                 rate_limiter=None, window_size: int = 0, max_packet_size: int = 0, ciphers: tuple = (),
+                 command_timeout: Optional[float] = None):
+        self.NAME = self.__class__.__name__
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.compress = compress
+        # Object with acquire() method (see scheduler.TokenBucket), limits remote round trips.
+        self.rate_limiter = rate_limiter
+        # Transport defaults for all channels, paramiko defaults if 0.
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.ciphers = tuple(ciphers)
+        # Max seconds without data from remote command, waits forever if None.
+        self.command_timeout = command_timeout
+        self.log = logging.getLogger(self.NAME)
+        self._client = None
+        self._lock = threading.RLock()
+        self._stats = {
+            'handshakes': 0,
+            'reconnects': 0,
+            'channels': 0,
+            'reused': 0,
+            'connect_seconds': 0.0,
+            'commands': 0,
+            'command_seconds': 0.0
+        }
+
+    @property
+    def stats(self) -> dict:
+        '''Returns copy of connection counters.
+
+        Returns:
+            dict: handshakes, reconnects, opened channels, reused transport count,
+                seconds spent in handshakes, executed commands and seconds spent in them.
+        '''
+        with self._lock:
+            return self._stats.copy()
+
+    def isAlive(self) -> bool:
+        '''Check that transport is still active.
+
+        Returns:
+            bool: True or False.
+        '''
+        if self._client is None:
+            return False
+        transport = self._client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def connect(self) -> 'SSHClient':
+        '''Open new SSH connection, closing the old one.
+
+        Raises same exceptions as SSHClient.connect.
+
+        Returns:
+            SSHClient: connected SSHClient.
+        '''
+        from paramiko import SSHClient
+
+        with self._lock:
+            if self._client is not None:
+                self._stats['reconnects'] += 1
+                self._client.close()
+                self._client = None
+            started = time.perf_counter()
+            cli = SSHClient()
+            cli.load_system_host_keys()
+            kwargs = {}
+            if 'transport_factory' in inspect.signature(cli.connect).parameters:
+                kwargs['transport_factory'] = self.createTransport
+            cli.connect(
+                self.hostname,
+                self.port,
+                self.username,
+                self.password,
+                timeout=self.timeout,
+                compress=self.compress,
+                **kwargs
+            )
+            if self.keepalive:
+                cli.get_transport().set_keepalive(self.keepalive)
+            self._stats['handshakes'] += 1
+            self._stats['connect_seconds'] += time.perf_counter() - started
+            self._client = cli
+            self.log.debug(f'"connect": Connected to {self.hostname}:{self.port}.')
+            return cli
+
+    def ensureConnected(self) -> 'SSHClient':
+        '''Connect if shared connection is not alive.
+
+        Raises same exceptions as SSHClient.connect.
+
+        Returns:
+            SSHClient: connected SSHClient.
+        '''
+        with self._lock:
+            if self.isAlive():
+                return self._client
+            return self.connect()
+
+    def createTransport(self, sock, **kwargs) -> 'Transport':
+        '''Returns Transport with cipher preference and channel defaults.
+
+        Used as SSHClient.connect transport_factory (paramiko 3.2+), with
+        older paramiko connection uses its defaults.
+
+        Args:
+            sock (socket.socket): connected socket.
+
+        Returns:
+            Transport: not started transport.
+        '''
+        from paramiko import Transport
+
+        transport = Transport(sock, **kwargs)
+        options = transport.get_security_options()
+        options.ciphers = getCipherPreference(self.ciphers, tuple(options.ciphers))
+        if self.window_size:
+            transport.default_window_size = self.window_size
+        if self.max_packet_size:
+            transport.default_max_packet_size = self.max_packet_size
+        return transport
+
+    def setWindowSize(self, window_size: int) -> None:
+        '''Set window size of channels opened after this call.
+
+        Window limits data in flight of download channel, it must be
+        at least bandwidth * round trip time for full link speed.
+
+        Args:
+            window_size (int): window size, paramiko default if 0.
+        '''
+        from paramiko.common import DEFAULT_WINDOW_SIZE
+
+        with self._lock:
+            self.window_size = window_size
+            if self.isAlive():
+                self._client.get_transport().default_window_size = window_size or DEFAULT_WINDOW_SIZE
+
+    def getSSHClient(self) -> Optional[Union['SSHClient', None]]:
+        '''Returns shared SSHClient, reconnect if transport is dropped.
+
+        Returns:
+            Optional[Union[SSHClient, None]]: SSHClient or None.
+        '''
+        with self._lock:
+            if self.isAlive():
+                self._stats['reused'] += 1
+                return self._client
+            if self._client is not None:
+                self.log.warning('"getSSHClient": Connection lost. Reconnecting...')
+            try:
+                return self.connect()
+            except Exception:
+                exc_type, exc_obj, _ = sys.exc_info()
+                self.log.error(
+                    f'"getSSHClient": Can\'t connect to remote host: {exc_type.__name__}: {str(exc_obj)}')
+                return None
+
+    def getTransport(self) -> Optional[Union['Transport', None]]:
+        '''Returns shared Transport.
+
+        Returns:
+            Optional[Union[Transport, None]]: Transport or None.
+        '''
+        cli = self.getSSHClient()
+        if cli:
+            return cli.get_transport()
+        return None
+
+    def openChannel(self) -> Optional[Union['Channel', None]]:
+        '''Open session channel on shared transport, reconnect once on failure.
+
+        Returns:
+            Optional[Union[Channel, None]]: Channel or None.
+        '''
+        from paramiko import ssh_exception
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        for attempt in range(2):
+            transport = self.getTransport()
+            if transport is None:
+                return None
+            try:
+                chan = transport.open_session(timeout=self.timeout)
+            except (ssh_exception.SSHException, EOFError, socket.error) as e:
+                self.log.warning(f'"openChannel": Can\'t open channel: {str(e)}')
+                with self._lock:
+                    if self._client is not None and self._client.get_transport() is transport:
+                        self._client.close()
+            else:
+                with self._lock:
+                    self._stats['channels'] += 1
+                return chan
+        return None
+
+    def getSCPClient(self) -> Optional[Union['SCPClient', None]]:
+        '''Returns SCPClient working on shared transport.
+
+        Returns:
+            Optional[Union[SCPClient, None]]: SCPClient or None.
+        '''
+        from scp import SCPClient
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        transport = self.getTransport()
+        if transport:
+            with self._lock:
+                self._stats['channels'] += 1
+            return SCPClient(transport)
+        return None
+
+    def execCommand(self, command: str, stdin: Optional[bytes] = None) -> Optional[Union[Tuple[bytes, bytes, int], None]]:
+        '''Execute command on remote host.
+
+        Args:
+            command (str): shell command.
+            stdin (Optional[bytes]): data for command stdin.
+
+        Returns:
+            Optional[Union[Tuple[bytes, bytes, int], None]]: stdout, stderr and exit status or None.
+        '''
+        from paramiko import ssh_exception
+
+        started = time.perf_counter()
+        chan = self.openChannel()
+        if chan is None:
+            return None
+        stderr = []
+        reader = None
+        try:
+            chan.settimeout(self.command_timeout)
+            chan.exec_command(command)
+            # stderr is read by own thread: when its data isn't read, remote
+            # command blocks on stderr write as soon as channel window is full.
+            reader = threading.Thread(target=self.readStderr, args=(chan, stderr), daemon=True)
+            reader.start()
+            if stdin:
+                chan.sendall(stdin)
+            chan.shutdown_write()
+            stdout = chan.makefile('rb', -1).read()
+            reader.join()
+            if (not stderr):
+                raise EOFError('stderr is not received')
+            stderr = stderr[0]
+            status = chan.recv_exit_status()
+        except (ssh_exception.SSHException, EOFError, socket.error) as e:
+            self.log.error(f'"execCommand": Command failed: {type(e).__name__}: {str(e)}')
+            return None
+        finally:
+            chan.close()
+            if reader is not None:
+                reader.join()
+            with self._lock:
+                self._stats['commands'] += 1
+                self._stats['command_seconds'] += time.perf_counter() - started
+        return stdout, stderr, status
+
+    @staticmethod
+    def readStderr(chan: 'Channel', out: list) -> None:
+        '''Read stderr of channel to EOF into out list, nothing is added on error.
+        '''
+        try:
+            out.append(chan.makefile_stderr('rb', -1).read())
+        except (EOFError, OSError):
+            pass
+
+    def close(self) -> None:
+        '''Close shared connection.
+        '''
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
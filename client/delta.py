@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - rsync-style delta transfer.
+#  Created by LulzLoL231 at 16/10/2026
+#
+#  Module uses only standard library: it is copied to remote host and
+#  started there as script for computing signatures and applying deltas.
+#
+#  Usage on remote host:
+#      python3 delta.py signature <path> <block_size>  > signature
+#      python3 delta.py delta <path> [max_literal]  < signature  > delta
+#      (exits with status 3 if literal data exceeds max_literal part of file, see iterDelta)
+#      python3 delta.py patch <path>  < delta  (prints MD5 of new file)
+#
+import os
+import sys
+import mmap
+import struct
+import hashlib
+import tempfile
+import zlib
+from typing import BinaryIO, Iterator, List, Tuple
+
+
+# Weak checksum is Adler-32 (computed by zlib), rolled byte by byte.
+MOD = 65521
+STRONG_SIZE = 16
+SIGNATURE_HEADER = struct.Struct('>4sIQI')
+BLOCK_SIGNATURE = struct.Struct(f'>I{STRONG_SIZE}s')
+OP_COPY = b'C'
+OP_LITERAL = b'L'
+OP_END = b'E'
+COPY_OP = struct.Struct('>II')
+LITERAL_OP = struct.Struct('>I')
+MAGIC = b'FSD2'
+MAX_LITERAL = 1024 * 1024
+# Literal part of delta is checked after this many scanned bytes at least,
+# so changed file start doesn't stop delta of mostly unchanged file.
+LITERAL_CHECK_SIZE = 1024 * 1024
+
+
+class DeltaTooLarge(ValueError):
+    '''Literal data of delta exceeds limit, whole file transfer is cheaper.
+    '''
+
+
+def getBlockSize(size: int) -> int:
+    '''Returns block size for file, about square root of file size.
+
+    Args:
+        size (int): file size.
+
+    Returns:
+        int: block size between 2 KiB and 128 KiB.
+    '''
+    block_size = 2048
+    while block_size * block_size < size and block_size < 128 * 1024:
+        block_size *= 2
+    return block_size
+
+
+def weakChecksum(data: bytes) -> Tuple[int, int]:
+    '''Returns weak checksum parts of block.
+
+    Args:
+        data (bytes): block.
+
+    Returns:
+        Tuple[int, int]: a and b parts of Adler-32.
+    '''
+    checksum = zlib.adler32(data)
+    return checksum & 0xffff, checksum >> 16
+
+
+def strongChecksum(data: bytes) -> bytes:
+    '''Returns strong checksum of block.
+
+    Args:
+        data (bytes): block.
+
+    Returns:
+        bytes: digest.
+    '''
+    return hashlib.blake2b(data, digest_size=STRONG_SIZE).digest()
+
+
+def writeSignature(src: BinaryIO, out: BinaryIO, block_size: int) -> None:
+    '''Write block signatures of file.
+
+    Args:
+        src (BinaryIO): base file.
+        out (BinaryIO): signature output.
+        block_size (int): block size.
+    '''
+    blocks = []
+    base_size = 0
+    while True:
+        block = src.read(block_size)
+        if not block:
+            break
+        base_size += len(block)
+        a, b = weakChecksum(block)
+        blocks.append(BLOCK_SIGNATURE.pack((b << 16) | a, strongChecksum(block)))
+    out.write(SIGNATURE_HEADER.pack(MAGIC, block_size, base_size, len(blocks)))
+    out.write(b''.join(blocks))
+
+
+def readSignature(src: BinaryIO) -> Tuple[int, int, List[Tuple[int, bytes]]]:
+    '''Read block signatures.
+
+    Args:
+        src (BinaryIO): signature input.
+
+    Raises:
+        ValueError: bad signature.
+
+    Returns:
+        Tuple[int, int, List[Tuple[int, bytes]]]: block size, base file size and (weak, strong) pairs.
+    '''
+    header = src.read(SIGNATURE_HEADER.size)
+    if len(header) != SIGNATURE_HEADER.size:
+        raise ValueError('Truncated signature header')
+    magic, block_size, base_size, count = SIGNATURE_HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError('Bad signature magic')
+    data = src.read(count * BLOCK_SIGNATURE.size)
+    if len(data) != count * BLOCK_SIGNATURE.size:
+        raise ValueError('Truncated signature')
+    return block_size, base_size, list(BLOCK_SIGNATURE.iter_unpack(data))
+
+
+def iterDelta(data: bytes, block_size: int, blocks: List[Tuple[int, bytes]], base_size: int,
+              max_literal: float = 0) -> Iterator[bytes]:
+    '''Yields delta operations turning base file into data.
+
+    Literal data is found by rolling checksum byte by byte, which is
+    slow, so with max_literal scanning stops when literal bytes exceed
+    this part of scanned data (checked once per block, after
+    LITERAL_CHECK_SIZE bytes).
+
+    Args:
+        data (bytes): new file content, bytes or mmap.
+        block_size (int): block size of signature.
+        blocks (List[Tuple[int, bytes]]): base file signature.
+        base_size (int): base file size.
+        max_literal (float): max literal part of data, not limited if 0.
+
+    Raises:
+        DeltaTooLarge: literal data exceeds max_literal.
+
+    Yields:
+        Iterator[bytes]: encoded operations.
+    '''
+    index = {}
+    for number, (weak, strong) in enumerate(blocks):
+        index.setdefault(weak, {}).setdefault(strong, number)
+    size = len(data)
+    copy = [0, 0]
+    literal_total = [0]
+
+    def literal(start: int, end: int) -> Iterator[bytes]:
+        literal_total[0] += max(end - start, 0)
+        if start < end and copy[1]:
+            yield OP_COPY + COPY_OP.pack(*copy)
+            copy[1] = 0
+        for offset in range(start, end, MAX_LITERAL):
+            chunk = data[offset:min(offset + MAX_LITERAL, end)]
+            yield OP_LITERAL + LITERAL_OP.pack(len(chunk)) + chunk
+
+    def match(number: int) -> Iterator[bytes]:
+        if copy[1] and copy[0] + copy[1] == number:
+            copy[1] += 1
+            return
+        if copy[1]:
+            yield OP_COPY + COPY_OP.pack(*copy)
+        copy[0], copy[1] = number, 1
+
+    literal_start = pos = 0
+    next_check = max(LITERAL_CHECK_SIZE, block_size) if max_literal else size
+    a = b = 0
+    rolling = False
+    while pos + block_size <= size:
+        end = pos + block_size
+        if not rolling:
+            a, b = weakChecksum(data[pos:end])
+            rolling = True
+        candidates = index.get((b << 16) | a)
+        number = candidates.get(strongChecksum(data[pos:end])) if candidates else None
+        if number is not None:
+            yield from literal(literal_start, pos)
+            yield from match(number)
+            pos = literal_start = end
+            rolling = False
+            continue
+        if end == size:
+            break
+        if pos >= next_check:
+            if literal_total[0] + pos - literal_start > pos * max_literal:
+                raise DeltaTooLarge(f'literal data exceeds {max_literal:.0%} of {pos} scanned bytes')
+            next_check = pos + block_size
+        # Roll weak checksum one byte forward.
+        out_byte = data[pos]
+        a = (a - out_byte + data[end]) % MOD
+        b = (b - block_size * out_byte + a - 1) % MOD
+        pos += 1
+    # Last block of base file may be shorter than block size.
+    tail = base_size % block_size
+    if blocks and tail and size - literal_start >= tail:
+        weak, strong = blocks[-1]
+        a, b = weakChecksum(data[size - tail:size])
+        if ((b << 16) | a) == weak and strongChecksum(data[size - tail:size]) == strong:
+            yield from literal(literal_start, size - tail)
+            yield from match(len(blocks) - 1)
+            literal_start = size
+    yield from literal(literal_start, size)
+    if copy[1]:
+        yield OP_COPY + COPY_OP.pack(*copy)
+    yield OP_END
+
+
+def writeDelta(src: BinaryIO, signature: BinaryIO, out: BinaryIO, max_literal: float = 0) -> int:
+    '''Write delta of src file against signature.
+
+    Args:
+        src (BinaryIO): new file, opened in binary mode.
+        signature (BinaryIO): base file signature.
+        out (BinaryIO): delta output.
+        max_literal (float): max literal part of file, not limited if 0, see iterDelta.
+
+    Raises:
+        DeltaTooLarge: literal data exceeds max_literal, delta output is incomplete.
+
+    Returns:
+        int: delta size in bytes.
+    '''
+    block_size, base_size, blocks = readSignature(signature)
+    out.write(LITERAL_OP.pack(block_size))
+    written = LITERAL_OP.size
+    if os.fstat(src.fileno()).st_size == 0:
+        data = b''
+    else:
+        data = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for op in iterDelta(data, block_size, blocks, base_size, max_literal):
+            out.write(op)
+            written += len(op)
+    finally:
+        if not isinstance(data, bytes):
+            data.close()
+    return written
+
+
+def applyDelta(base: BinaryIO, delta: BinaryIO, out: BinaryIO) -> str:
+    '''Rebuild file from base file and delta.
+
+    Args:
+        base (BinaryIO): base file.
+        delta (BinaryIO): delta input.
+        out (BinaryIO): new file output.
+
+    Raises:
+        ValueError: bad or truncated delta.
+
+    Returns:
+        str: MD5 hex digest of new file.
+    '''
+    block_size, = LITERAL_OP.unpack(delta.read(LITERAL_OP.size))
+    h = hashlib.md5()
+    while True:
+        op = delta.read(1)
+        if op == OP_END:
+            return h.hexdigest()
+        elif op == OP_COPY:
+            start, count = COPY_OP.unpack(delta.read(COPY_OP.size))
+            base.seek(start * block_size)
+            left = count * block_size
+            while left > 0:
+                chunk = base.read(min(left, MAX_LITERAL))
+                if not chunk:
+                    break
+                h.update(chunk)
+                out.write(chunk)
+                left -= len(chunk)
+        elif op == OP_LITERAL:
+            length, = LITERAL_OP.unpack(delta.read(LITERAL_OP.size))
+            chunk = delta.read(length)
+            if len(chunk) != length:
+                raise ValueError('Truncated literal')
+            h.update(chunk)
+            out.write(chunk)
+        else:
+            raise ValueError('Truncated or bad delta')
+
+
+def rebuildFile(path: str, delta: BinaryIO) -> Tuple[str, str]:
+    '''Rebuild file from delta into temporary file in the same folder.
+
+    Args:
+        path (str): base file path.
+        delta (BinaryIO): delta input.
+
+    Returns:
+        Tuple[str, str]: temporary file path and MD5 hex digest of new file.
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.delta-', dir=directory)
+    try:
+        os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        with open(path, 'rb') as base, os.fdopen(fd, 'wb') as out:
+            digest = applyDelta(base, delta, out)
+            out.flush()
+            os.fsync(out.fileno())
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return temp_path, digest
+
+
+def patchFile(path: str, delta: BinaryIO) -> str:
+    '''Rebuild file in place from delta, atomically.
+
+    New file is written to temporary file in the same folder
+    and renamed over old file.
+
+    Args:
+        path (str): base file path.
+        delta (BinaryIO): delta input.
+
+    Returns:
+        str: MD5 hex digest of new file.
+    '''
+    temp_path, digest = rebuildFile(path, delta)
+    try:
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return digest
+
+
+def main(argv: List[str]) -> int:
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    if len(argv) == 4 and argv[1] == 'signature':
+        with open(argv[2], 'rb') as f:
+            writeSignature(f, stdout, int(argv[3]))
+    elif len(argv) in (3, 4) and argv[1] == 'delta':
+        with open(argv[2], 'rb') as f:
+            try:
+                writeDelta(f, stdin, stdout, float(argv[3]) if len(argv) == 4 else 0)
+            except DeltaTooLarge as e:
+                stdout.flush()
+                sys.stderr.write(f'{str(e)}\n')
+                return 3
+    elif len(argv) == 3 and argv[1] == 'patch':
+        stdout.write(patchFile(argv[2], stdin).encode())
+    else:
+        sys.stderr.write(__doc__ or 'Bad arguments\n')
+        return 2
+    stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
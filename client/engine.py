@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Concurrent sync engine.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import sys
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List
+
+
+class SyncEngine:
+    '''Runs per-file sync jobs on bounded thread pool.
+
+    Jobs for the same path never run at the same time.
+    '''
+    def __init__(self, workers: int = 4):
+        self.NAME = self.__class__.__name__
+        self.log = logging.getLogger(self.NAME)
+        self.workers = max(1, workers)
+        self._executor = None
+        if self.workers > 1:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='FileSyncWorker')
+        self._busy = set()
+        self._lock = threading.Lock()
+        self._stats = {
+            'files': 0,
+            'bytes': 0,
+            'seconds': 0.0
+        }
+
+    @contextmanager
+    def acquire(self, path: str) -> Iterator[bool]:
+        '''Lock path without waiting.
+
+        Args:
+            path (str): file path.
+
+        Yields:
+            Iterator[bool]: True if lock is taken, False if path is busy.
+        '''
+        with self._lock:
+            locked = path not in self._busy
+            if locked:
+                self._busy.add(path)
+        try:
+            yield locked
+        finally:
+            if locked:
+                with self._lock:
+                    self._busy.discard(path)
+
+    def record(self, size: int, seconds: float) -> None:
+        '''Record finished transfer.
+
+        Args:
+            size (int): transferred file size.
+            seconds (float): transfer time.
+        '''
+        with self._lock:
+            self._stats['files'] += 1
+            self._stats['bytes'] += size
+            self._stats['seconds'] += seconds
+
+    @property
+    def stats(self) -> dict:
+        '''Returns copy of transfer counters.
+
+        Returns:
+            dict: transferred files, bytes and seconds spent in transfers.
+        '''
+        with self._lock:
+            return self._stats.copy()
+
+    def run(self, job: Callable[[str], bool], paths: Iterable[str]) -> List[bool]:
+        '''Run job for every path and wait for all of them.
+
+        Exceptions in jobs are logged and counted as False results.
+
+        Args:
+            job (Callable[[str], bool]): job function.
+            paths (Iterable[str]): file paths.
+
+        Returns:
+            List[bool]: job results in paths order.
+        '''
+        paths = list(paths)
+        if self._executor is None:
+            return [self._call(job, path) for path in paths]
+        futures = [self._executor.submit(self._call, job, path) for path in paths]
+        return [future.result() for future in futures]
+
+    def _call(self, job: Callable[[str], bool], path: str) -> bool:
+        try:
+            return job(path)
+        except Exception:
+            exc_type, exc_obj, _ = sys.exc_info()
+            self.log.error(f'"run": Job for ({path}) failed: {exc_type.__name__}: {str(exc_obj)}')
+            return False
+
+    def shutdown(self) -> None:
+        '''Stop worker threads.
+        '''
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+def formatRate(size: int, seconds: float) -> str:
+    '''Returns human readable transfer rate.
+
+    Args:
+        size (int): bytes.
+        seconds (float): seconds.
+
+    Returns:
+        str: rate, like "1.5 MiB/s".
+    '''
+    rate = size / seconds if seconds > 0 else 0.0
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if rate < 1024 or unit == 'GiB':
+            return f'{rate:.1f} {unit}/s'
+        rate /= 1024
+    return f'{rate:.1f} GiB/s'
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Sync with several remote hosts.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import os
+import re
+import time
+import logging
+import threading
+import contextlib
+from typing import Optional
+
+from hashing import newHasher
+from metrics import MetricsGroup
+from watcher import ChangeQueue, createWatcher
+
+
+# Options of main config which are not inherited by other remotes.
+LOCAL_OPTIONS = ('remotes', 'state_file', 'local_hashes', 'remote_hashes', 'metrics_port', 'metrics_file')
+
+
+class FanOut:
+    '''Syncs the same local files with several remote hosts.
+
+    Main config describes the first remote, "remotes" option lists other
+    ones: every entry overrides options of main config ("hostname",
+    "port", "username", "password" or any other option), "name" is used
+    in logs and in default state file name "state.<name>.json".
+
+    Every remote has its own connection, remote state (remote hashes,
+    resumable transfers, probe) and sync loop thread, so slow or
+    unreachable host doesn't stall others. Local side is shared: one
+    watcher feeds one loop (see syncLocal), which updates local trees,
+    hashes changed files into shared fingerprint cache once and reads
+    every changed file once, sending it to upload channels of all remotes
+    at the same time. Local hashes and fingerprints are kept in state of
+    primary only. Remotes which track other local files (their
+    "local_files" is overridden) get watcher changes in their own loops.
+    Metrics of all remotes are served by metrics server of primary, with
+    "remote" label.
+    '''
+    def __init__(self, primary):
+        self.NAME = self.__class__.__name__
+        self.log = logging.getLogger(self.NAME)
+        self.primary = primary
+        self.remotes = [primary]
+        self.ready = set()
+        self.changes = ChangeQueue()
+        primary.fanout = self
+        primary.metrics.labels.setdefault(
+            'remote', f'{primary.config.get("hostname")}:{primary.config.get("port", 22)}')
+        self.metrics = MetricsGroup([primary.metrics])
+        self.watcher = None
+        self._remotes_lock = threading.Lock()
+
+    def getRemoteConfigs(self) -> list:
+        '''Returns names and configs of remotes from "remotes" option.
+
+        Returns:
+            list: (name, config) tuples.
+        '''
+        configs = []
+        for index, remote in enumerate(self.primary.getOption('remotes'), 1):
+            config = {key: value for key, value in self.primary.config.items() if key not in LOCAL_OPTIONS}
+            config.update(remote)
+            name = config.pop('name', '') or f'{config.get("hostname")}:{config.get("port", 22)}'
+            if (not remote.get('state_file')):
+                config['state_file'] = 'state.{}.json'.format(re.sub(r'[^\w.-]', '_', name))
+            configs.append((name, config))
+        return configs
+
+    def createRemote(self, name: str, config: dict):
+        '''Returns FileSync for remote, sharing local components with primary.
+
+        Args:
+            name (str): remote name.
+            config (dict): remote config.
+
+        Returns:
+            FileSync: remote FileSync.
+        '''
+        fs = self.primary.__class__(config, name, self.primary)
+        if fs.local_shared:
+            fs.fanout = self
+        with self._remotes_lock:
+            self.remotes.append(fs)
+        self.metrics.add(fs.metrics)
+        return fs
+
+    def runRemote(self, fs) -> None:
+        '''Sync loop of one remote.
+
+        Remote folder init is retried every "sync_interval" seconds until
+        host is reachable, errors of sync loop are logged and loop is
+        started again. Only sync loop is restarted, metrics server and
+        signal handlers are started once by sync. Fatal errors (SystemExit
+        from bad config) stop sync of this remote only.
+
+        Args:
+            fs (FileSync): remote FileSync.
+        '''
+        interval = fs.getOption('sync_interval')
+        while True:
+            if (not fs.initRemote()):
+                fs.log.warning(f'"runRemote": Remote init failed. Retry in {interval}s.')
+                time.sleep(interval)
+                continue
+            with self._remotes_lock:
+                self.ready.add(fs)
+            try:
+                fs.syncLoop(self.watcher)
+            except SystemExit:
+                fs.log.critical('"runRemote": Sync of remote is stopped by fatal error, see log above.')
+                self.stopRemote(fs)
+                return
+            except Exception as e:
+                fs.log.error(f'"runRemote": Sync stopped: {type(e).__name__}: {str(e)}')
+                self.stopRemote(fs)
+                time.sleep(interval)
+
+    def stopRemote(self, fs) -> None:
+        '''Stop remote agent and tree channel of remote which sync loop is stopped.
+
+        Args:
+            fs (FileSync): remote FileSync.
+        '''
+        with self._remotes_lock:
+            self.ready.discard(fs)
+        if fs.agent is not None:
+            fs.agent.stop()
+            fs.agent = None
+        fs.closeRemoteTree()
+
+    def startRemote(self, name: str, config: dict) -> None:
+        '''Create remote FileSync and run its sync loop, in current thread.
+        '''
+        try:
+            fs = self.createRemote(name, config)
+        except SystemExit:
+            # FileSync exits on bad config, only this remote is not started.
+            self.log.error(f'"startRemote": Can\'t start remote ({name}): bad config, see log above.')
+            return
+        except Exception as e:
+            self.log.error(f'"startRemote": Can\'t start remote ({name}): {type(e).__name__}: {str(e)}')
+            return
+        self.runRemote(fs)
+
+    def syncLocal(self, changed: Optional[set] = None) -> None:
+        '''Sync local changes with all remotes sharing local side.
+
+        Changes are detected and hashed once for all remotes: shared local
+        trees are updated from watcher paths (or rescanned if changed is
+        None) and changed files are hashed into shared fingerprint cache.
+        Changed files are uploaded by uploadFile to remotes which upload
+        them as they are (see FileSync.isPlainUpload). Other files (files
+        removed locally, files of other upload modes, failed uploads) are
+        queued to sync loops of remotes.
+
+        Args:
+            changed (Optional[set]): absolute paths from watcher, None for full scan.
+        '''
+        with self._remotes_lock:
+            remotes = [fs for fs in self.remotes if fs.fanout is self and fs in self.ready]
+        if changed is None:
+            for root in self.primary.directories:
+                self.primary.scanLocalTree(root)
+        else:
+            for path in changed:
+                if self.primary.getDirectoryRoot(path):
+                    self.primary.updateLocalTreeFile(path)
+        targets = {}
+        for fs in remotes:
+            files = (fs.files + fs.getChangedDirectoryFiles()) if changed is None else fs.getChangedTrackedFiles(changed)
+            for file in files:
+                targets.setdefault(file, []).append(fs)
+        self.primary.prehashLocalFiles([file for file in targets if os.path.exists(file)])
+        for file, fss in targets.items():
+            pushes, queued = [], []
+            for fs in fss:
+                try:
+                    if (not os.path.exists(file)):
+                        queued.append(fs)
+                    elif fs.getStoredLocalHash(file) and fs.checkLocalFile(file) and (not fs.isRemoteMissing(file)):
+                        continue
+                    elif (fs.getStoredLocalHash(file) or fs.isRemoteMissing(file)) and fs.isPlainUpload(file):
+                        pushes.append(fs)
+                    else:
+                        queued.append(fs)
+                except OSError:
+                    queued.append(fs)
+            with contextlib.ExitStack() as stack:
+                locked = [fs for fs in pushes if stack.enter_context(fs.engine.acquire(file))]
+                uploaded = self.uploadFile(file, locked) if locked else []
+            queued.extend(fs for fs in pushes if fs not in uploaded)
+            for fs in queued:
+                fs.changes.push(os.path.abspath(file))
+
+    def uploadFile(self, file: str, remotes: list) -> list:
+        '''Upload file to several remotes, reading and hashing it once.
+
+        Every piece of file is sent to upload channels of all remotes (see
+        FileSync.openUploadStream), remote which channel fails is dropped
+        while others go on. Hashes are saved as by FileSync.uploadStream.
+
+        Args:
+            file (str): local file path.
+            remotes (list): FileSync of remotes.
+
+        Returns:
+            list: FileSync of remotes which file is uploaded to.
+        '''
+        started = time.monotonic()
+        channels = {}
+        hashers = {}
+        try:
+            with open(file, 'rb') as f:
+                st = os.fstat(f.fileno())
+                for fs in remotes:
+                    verify = fs.getOption('storage') != 'cas' and fs.isStreamVerify()
+                    if (not fs.ensureRemoteDir(fs.getRemotePath(file))):
+                        continue
+                    try:
+                        chan = fs.openUploadStream(file, st.st_size, verify)
+                    except Exception as e:
+                        fs.log.error(f'"uploadFile": Upload of file ({file}) failed: {str(e)}')
+                        continue
+                    if chan is None:
+                        continue
+                    algorithms = (fs.getOption('hash_algorithm'), fs.getRemoteHashAlgorithm()) if verify else ()
+                    for algorithm in algorithms:
+                        hashers.setdefault(algorithm, newHasher(algorithm))
+                    channels[fs] = (chan, algorithms)
+                self.log.info(f'"uploadFile": Uploading file ({file}) to {len(channels)} remote hosts...')
+                left = st.st_size
+                while left > 0 and channels:
+                    data = f.read(min(left, 256 * 1024))
+                    if not data:
+                        break
+                    for hasher in hashers.values():
+                        hasher.update(data)
+                    for fs, (chan, _) in list(channels.items()):
+                        try:
+                            chan.sendall(data)
+                        except Exception as e:
+                            fs.log.error(f'"uploadFile": Upload of file ({file}) failed: {str(e)}')
+                            chan.close()
+                            del channels[fs]
+                    left -= len(data)
+        except OSError as e:
+            self.log.error(f'"uploadFile": Can\'t read file ({file}): {str(e)}')
+            for chan, _ in channels.values():
+                chan.close()
+            return []
+        uploaded = []
+        for fs, (chan, algorithms) in channels.items():
+            try:
+                done = fs.finishUploadStream(file, chan, {algorithm: hashers[algorithm] for algorithm in algorithms}, st)
+            except Exception as e:
+                fs.log.error(f'"uploadFile": Upload of file ({file}) failed: {str(e)}')
+                done = False
+            finally:
+                chan.close()
+            if done:
+                fs.engine.record(st.st_size, time.monotonic() - started)
+                fs.metrics.inc('uploads_fanout')
+                uploaded.append(fs)
+            else:
+                fs.metrics.inc('upload_errors')
+        return uploaded
+
+    def syncLocalLoop(self, threads: list) -> None:
+        '''Wait for local changes and sync them with all remotes, see syncLocal.
+
+        Local files are rescanned every "full_scan_interval" seconds (every
+        "sync_interval" seconds without watcher) and when watcher loses
+        events. Returns when sync loops of all remotes are stopped.
+
+        Args:
+            threads (list): started threads of remote sync loops.
+        '''
+        interval = self.primary.getOption('full_scan_interval' if self.watcher else 'sync_interval')
+        next_full_scan = time.monotonic() + interval
+        while any(thread.is_alive() for thread in threads):
+            changed = self.changes.wait(next_full_scan - time.monotonic(), self.primary.getOption('watch_debounce'))
+            lost = self.changes.takeFullScan()
+            with self._remotes_lock:
+                others = [fs for fs in self.remotes if fs.fanout is not self]
+            for fs in others:
+                for path in changed:
+                    fs.changes.push(path)
+                if lost:
+                    fs.changes.requestFullScan()
+            full = lost or time.monotonic() >= next_full_scan
+            if lost:
+                self.log.warning('"syncLocalLoop": Local changes are lost by watcher. Rescanning local files...')
+            try:
+                if full or changed:
+                    self.syncLocal(None if full else changed)
+            except Exception as e:
+                self.log.error(f'"syncLocalLoop": Sync of local changes failed: {type(e).__name__}: {str(e)}')
+            if full:
+                next_full_scan = time.monotonic() + interval
+
+    def close(self) -> None:
+        '''Save state of all remotes except primary.
+        '''
+        with self._remotes_lock:
+            remotes = self.remotes[1:]
+        for fs in remotes:
+            fs.state.close()
+
+    def sync(self) -> None:
+        '''Sync all remotes, each in its own thread, local changes in calling thread.
+
+        Must be called in main thread: metrics server (serving metrics of
+        all remotes) and SIGUSR1 handler of primary are started here.
+        '''
+        self.primary.startMetrics(self.metrics)
+        self.watcher = createWatcher(
+            self.primary.getOption('watch_backend'),
+            self.primary.config['local_files'],
+            self.changes,
+            self.primary.getOption('watch_poll_interval')
+        )
+        if self.watcher:
+            self.watcher.start()
+            self.log.info(f'"sync": Watching local changes with {self.watcher.NAME}.')
+        threads = [threading.Thread(target=self.runRemote, args=(self.primary,), daemon=True)]
+        for name, config in self.getRemoteConfigs():
+            threads.append(threading.Thread(target=self.startRemote, args=(name, config), daemon=True))
+        self.log.info(f'"sync": Syncing with {len(threads)} remote hosts.')
+        try:
+            for thread in threads:
+                thread.start()
+            self.syncLocalLoop(threads)
+        finally:
+            self.close()
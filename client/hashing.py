@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - File hashing.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import os
+import mmap
+import zlib
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Union, Tuple
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+DEFAULT_ALGORITHM = 'md5'
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Files modified less than this seconds ago are not cached: mtime may not
+# change on next write within timestamp granularity of filesystem.
+RACY_INTERVAL = 2
+# Shell commands for hashing files on remote host, output format of md5sum.
+REMOTE_HASH_COMMANDS = {
+    'md5': 'md5sum',
+    'sha1': 'sha1sum',
+    'sha256': 'sha256sum',
+    'blake2b': 'b2sum'
+}
+# Tree algorithms hash file by leaves of TREE_LEAF_SIZE bytes, digest is
+# hash of concatenated leaf digests. Leaf size is part of digest, it must
+# not be changed.
+TREE_ALGORITHMS = ('sha256-tree', 'blake2b-tree')
+TREE_LEAF_SIZE = 4 * 1024 * 1024
+
+
+class CRC32:
+    '''hashlib-like wrapper for zlib.crc32, fast non-crypto checksum.
+    '''
+    name = 'crc32'
+
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data: bytes) -> None:
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self) -> str:
+        return f'{self.value:08x}'
+
+
+class TreeHasher:
+    '''hashlib-like tree hash, digest is the same as of parallel hashing
+    of leaves (see HashPool).
+    '''
+    def __init__(self, algorithm: str, leaf_size: int = TREE_LEAF_SIZE):
+        self.name = f'{algorithm}-tree'
+        self.algorithm = algorithm
+        self.leaf_size = leaf_size
+        self.leaves = []
+        self.leaf = hashlib.new(algorithm)
+        self.filled = 0
+
+    def update(self, data: bytes) -> None:
+        view = memoryview(data)
+        while len(view):
+            size = min(len(view), self.leaf_size - self.filled)
+            self.leaf.update(view[:size])
+            self.filled += size
+            view = view[size:]
+            if self.filled == self.leaf_size:
+                self.leaves.append(self.leaf.digest())
+                self.leaf = hashlib.new(self.algorithm)
+                self.filled = 0
+
+    def hexdigest(self) -> str:
+        leaves = self.leaves + ([self.leaf.digest()] if self.filled else [])
+        return combineLeaves(self.algorithm, leaves)
+
+
+def combineLeaves(algorithm: str, leaves: List[bytes]) -> str:
+    '''Returns tree hash hex digest from leaf digests.
+
+    Args:
+        algorithm (str): leaf algorithm name, like "blake2b".
+        leaves (List[bytes]): digests of leaves in file order.
+
+    Returns:
+        str: hex digest.
+    '''
+    return hashlib.new(algorithm, b''.join(leaves)).hexdigest()
+
+
+def getAlgorithms() -> Tuple[str, ...]:
+    '''Returns names of hash algorithms available on this host.
+
+    Returns:
+        Tuple[str, ...]: algorithm names.
+    '''
+    algorithms = ('md5', 'sha1', 'sha256', 'blake2b', 'crc32') + TREE_ALGORITHMS
+    if xxhash:
+        algorithms += ('xxh64', 'xxh3')
+    return algorithms
+
+
+def newHasher(algorithm: str):
+    '''Returns new hash object for algorithm.
+
+    Args:
+        algorithm (str): algorithm name.
+
+    Raises:
+        ValueError: unknown or unavailable algorithm.
+
+    Returns:
+        Any: object with update and hexdigest methods.
+    '''
+    if algorithm in ('md5', 'sha1', 'sha256', 'blake2b'):
+        return hashlib.new(algorithm)
+    elif algorithm == 'crc32':
+        return CRC32()
+    elif algorithm in TREE_ALGORITHMS:
+        return TreeHasher(algorithm[:-len('-tree')])
+    elif algorithm == 'xxh64' and xxhash:
+        return xxhash.xxh64()
+    elif algorithm == 'xxh3' and xxhash:
+        return xxhash.xxh3_64()
+    raise ValueError(f'Unsupported hash algorithm: {algorithm}')
+
+
+def hashFile(filepath: str, algorithm: str = DEFAULT_ALGORITHM,
+             chunk_size: int = DEFAULT_CHUNK_SIZE, use_mmap: bool = False) -> str:
+    '''Returns hex digest of file, reading it by chunks.
+
+    Memory usage doesn't depend on file size: file is read with readinto
+    into one reused buffer or mapped into memory with mmap.
+
+    Args:
+        filepath (str): path to file.
+        algorithm (str): algorithm name.
+        chunk_size (int): size of read chunk.
+        use_mmap (bool): hash memory mapped file.
+
+    Returns:
+        str: hex digest.
+    '''
+    h = newHasher(algorithm)
+    with open(filepath, 'rb') as f:
+        if use_mmap and os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                view = memoryview(m)
+                try:
+                    for offset in range(0, len(m), chunk_size):
+                        h.update(view[offset:offset + chunk_size])
+                finally:
+                    view.release()
+        else:
+            buffer = bytearray(chunk_size)
+            view = memoryview(buffer)
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                h.update(view[:size])
+    return h.hexdigest()
+
+
+def hashRange(filepath: str, algorithm: str, offset: int, size: int,
+              chunk_size: int = DEFAULT_CHUNK_SIZE) -> bytes:
+    '''Returns raw digest of file range.
+
+    Args:
+        filepath (str): path to file.
+        algorithm (str): hashlib algorithm name.
+        offset (int): range start.
+        size (int): range size.
+        chunk_size (int): size of read chunk.
+
+    Returns:
+        bytes: digest.
+    '''
+    h = hashlib.new(algorithm)
+    buffer = bytearray(min(chunk_size, size) or 1)
+    view = memoryview(buffer)
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        while size > 0:
+            read = f.readinto(view[:min(size, len(buffer))])
+            if not read:
+                break
+            h.update(view[:read])
+            size -= read
+    return h.digest()
+
+
+class HashPool:
+    '''Hashes files on several threads.
+
+    hashlib releases GIL while hashing big buffers and file reads release
+    it too, so threads use several CPU cores without pickling data to
+    processes. Big files of tree algorithms are split into leaves, which
+    are hashed in parallel.
+    '''
+    def __init__(self, workers: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE, use_mmap: bool = False):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.use_mmap = use_mmap
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='HashPool')
+
+    def _submit(self, filepath: str, algorithm: str, size: int) -> list:
+        '''Start hashing of file, returns futures of its leaves or of whole file.
+        '''
+        if algorithm in TREE_ALGORITHMS and size > TREE_LEAF_SIZE:
+            return [
+                self._executor.submit(
+                    hashRange, filepath, algorithm[:-len('-tree')], offset, TREE_LEAF_SIZE, self.chunk_size)
+                for offset in range(0, size, TREE_LEAF_SIZE)
+            ]
+        return [self._executor.submit(hashFile, filepath, algorithm, self.chunk_size, self.use_mmap)]
+
+    @staticmethod
+    def _result(algorithm: str, futures: list) -> str:
+        if algorithm in TREE_ALGORITHMS and len(futures) > 1:
+            return combineLeaves(algorithm[:-len('-tree')], [future.result() for future in futures])
+        return futures[0].result()
+
+    def hashFile(self, filepath: str, algorithm: str, size: Optional[int] = None) -> str:
+        '''Returns hex digest of file, leaves of big file are hashed in parallel.
+
+        Args:
+            filepath (str): path to file.
+            algorithm (str): algorithm name.
+            size (Optional[int]): file size, taken by os.stat if None.
+
+        Raises:
+            OSError: file can't be read.
+
+        Returns:
+            str: hex digest.
+        '''
+        if size is None:
+            size = os.stat(filepath).st_size
+        if algorithm in TREE_ALGORITHMS and size > TREE_LEAF_SIZE:
+            return self._result(algorithm, self._submit(filepath, algorithm, size))
+        return hashFile(filepath, algorithm, self.chunk_size, self.use_mmap)
+
+    def hashFiles(self, filepaths: Iterable[str], algorithm: str) -> Dict[str, Tuple[str, os.stat_result]]:
+        '''Hash files in parallel.
+
+        Args:
+            filepaths (Iterable[str]): paths to files.
+            algorithm (str): algorithm name.
+
+        Returns:
+            Dict[str, Tuple[str, os.stat_result]]: hex digest and stat taken before hashing, files which can't be read are skipped.
+        '''
+        pending = []
+        for filepath in filepaths:
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                continue
+            pending.append((filepath, st, self._submit(filepath, algorithm, st.st_size)))
+        digests = {}
+        for filepath, st, futures in pending:
+            try:
+                digests[filepath] = (self._result(algorithm, futures), st)
+            except OSError:
+                continue
+        return digests
+
+
+def formatMTime(st: os.stat_result) -> str:
+    '''Returns mtime formatted as "%T@" of GNU find.
+
+    Args:
+        st (os.stat_result): file stat.
+
+    Returns:
+        str: seconds with 10 fractional digits.
+    '''
+    return f'{st.st_mtime_ns // 10 ** 9}.{st.st_mtime_ns % 10 ** 9:09d}0'
+
+
+def parseMTime(value: str) -> int:
+    '''Returns mtime in nanoseconds from "%T@" of GNU find.
+
+    Args:
+        value (str): seconds with fractional digits.
+
+    Raises:
+        ValueError: value is not a number.
+
+    Returns:
+        int: nanoseconds.
+    '''
+    seconds, _, fraction = value.partition('.')
+    return int(seconds) * 10 ** 9 + int((fraction + '0' * 9)[:9])
+
+
+def formatDigest(algorithm: str, digest: str) -> str:
+    '''Returns digest for storing in config.
+
+    MD5 digests are stored as is, for compatibility with old configs,
+    others are prefixed with algorithm name: "blake2b:<hex>".
+
+    Args:
+        algorithm (str): algorithm name.
+        digest (str): hex digest.
+
+    Returns:
+        str: stored digest.
+    '''
+    if algorithm == 'md5':
+        return digest
+    return f'{algorithm}:{digest}'
+
+
+def parseDigest(value: str) -> Tuple[str, str]:
+    '''Returns algorithm and hex digest from stored digest.
+
+    Args:
+        value (str): stored digest.
+
+    Returns:
+        Tuple[str, str]: algorithm name and hex digest.
+    '''
+    if ':' in value:
+        algorithm, digest = value.split(':', 1)
+        return algorithm, digest
+    return 'md5', value
+
+
+class FingerprintCache:
+    '''Cache of file hashes, valid while file metadata is unchanged.
+
+    Fingerprint is (size, mtime_ns, inode, ctime_ns) from os.stat.
+    '''
+    def __init__(self, reverify_interval: float = 0):
+        self.reverify_interval = reverify_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(st: os.stat_result) -> Tuple[int, int, int, int]:
+        '''Returns fingerprint for stat result.
+
+        Args:
+            st (os.stat_result): file stat.
+
+        Returns:
+            Tuple[int, int, int, int]: size, mtime_ns, inode and ctime_ns.
+        '''
+        return (st.st_size, st.st_mtime_ns, st.st_ino, st.st_ctime_ns)
+
+    def get(self, filepath: str, algorithm: str, st: os.stat_result) -> Optional[Union[str, None]]:
+        '''Returns cached hex digest if file isn't changed.
+
+        Args:
+            filepath (str): path to file.
+            algorithm (str): algorithm name.
+            st (os.stat_result): current file stat.
+
+        Returns:
+            Optional[Union[str, None]]: hex digest or None.
+        '''
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry:
+                fingerprint, entry_algorithm, digest, hashed_at = entry
+                fresh = (not self.reverify_interval) or time.monotonic() - hashed_at < self.reverify_interval
+                if fresh and entry_algorithm == algorithm and fingerprint == self.fingerprint(st):
+                    self.hits += 1
+                    return digest
+            self.misses += 1
+            return None
+
+    def set(self, filepath: str, algorithm: str, digest: str, st: os.stat_result) -> bool:
+        '''Save hex digest for file.
+
+        Digest is not saved for recently modified files.
+
+        Args:
+            filepath (str): path to file.
+            algorithm (str): algorithm name.
+            digest (str): hex digest.
+            st (os.stat_result): file stat taken before hashing.
+
+        Returns:
+            bool: True if digest is cached.
+        '''
+        if time.time() - st.st_mtime < RACY_INTERVAL:
+            return False
+        with self._lock:
+            self._entries[filepath] = (self.fingerprint(st), algorithm, digest, time.monotonic())
+        return True
+
+    def export(self, filepath: str) -> Optional[Union[list, None]]:
+        '''Returns cache entry of file for saving in sync state.
+
+        Args:
+            filepath (str): path to file.
+
+        Returns:
+            Optional[Union[list, None]]: [algorithm, hex digest, size, mtime_ns, inode, ctime_ns] or None.
+        '''
+        with self._lock:
+            entry = self._entries.get(filepath)
+        if entry is None:
+            return None
+        fingerprint, algorithm, digest, _ = entry
+        return [algorithm, digest, *fingerprint]
+
+    def load(self, entries: dict) -> int:
+        '''Load entries saved by export, for example by previous run.
+
+        Loaded entries are valid while file stat is unchanged, reverify
+        interval of them starts on load.
+
+        Args:
+            entries (dict): {filepath: entry from export}.
+
+        Returns:
+            int: number of loaded entries.
+        '''
+        now = time.monotonic()
+        loaded = 0
+        with self._lock:
+            for filepath, entry in entries.items():
+                try:
+                    algorithm, digest, *fingerprint = entry
+                    fingerprint = tuple(int(value) for value in fingerprint)
+                except (TypeError, ValueError):
+                    continue
+                if len(fingerprint) == 4:
+                    self._entries[filepath] = (fingerprint, algorithm, digest, now)
+                    loaded += 1
+        return loaded
+
+    def invalidate(self, filepath: str) -> None:
+        '''Remove file from cache.
+
+        Args:
+            filepath (str): path to file.
+        '''
+        with self._lock:
+            self._entries.pop(filepath, None)
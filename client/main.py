@@ -5,16 +5,45 @@
 #
 import os
 import sys
+import io
+import argparse
 import json
+import tarfile
 import time
+import shlex
+import signal
+import tempfile
+import hashlib
 import socket
 import secrets
-import hashlib
 import logging
-from typing import Optional, Union
+import collections
+import threading
+from typing import TYPE_CHECKING, Optional, Union
+
+from connection import ConnectionManager
+from engine import SyncEngine, formatRate
+from state import StateStore
+from transfer import TransferBackend, createBackend, probeThroughput
+from scheduler import CheckScheduler, TokenBucket
+from fanout import FanOut
+from watcher import ChangeQueue, Watcher, createWatcher
+from hashing import (
+    REMOTE_HASH_COMMANDS, FingerprintCache, HashPool, getAlgorithms, hashFile,
+    newHasher, formatDigest, parseDigest, parseMTime
+)
+from metrics import Metrics
+
+# paramiko, scp and modules of optional features (delta, compression,
+# merkle, cas, batch, agent) are imported where they are used, as well as
+# startMetricsServer, so startup doesn't pay for them. Imports below are
+# for type hints only.
+if TYPE_CHECKING:
+    from paramiko import Channel, SSHClient
+    from scp import SCPClient
 
-from paramiko import SSHClient, ssh_exception
-from scp import SCPClient, SCPException
+    from agent import AgentClient
+    from metrics import MetricsGroup
 
 
 if 'FILESYNC_DEBUG' in os.environ:
@@ -50,10 +79,102 @@ def secure_compare(hash1: str, hash2: str) -> bool:
     return hash1 == hash2
 
 
+def parseOptionValue(default, value: str):
+    '''Returns config option value from string, by type of default value.
+
+    Lists and dicts are parsed as JSON, list may also be paths separated
+    by os.pathsep.
+
+    Args:
+        default (Any): default value of option.
+        value (str): string value.
+
+    Raises:
+        ValueError: value can't be parsed.
+
+    Returns:
+        Any: option value.
+    '''
+    if isinstance(default, bool):
+        if value.lower() not in ('1', 'true', 'yes', 'on', '0', 'false', 'no', 'off', ''):
+            raise ValueError(f'not a boolean: {value}')
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    elif isinstance(default, int):
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    elif isinstance(default, float):
+        return float(value)
+    elif isinstance(default, (list, dict)):
+        if value.startswith(('[', '{')):
+            parsed = json.loads(value)
+            if type(parsed) is not type(default):
+                raise ValueError(f'{type(default).__name__} expected')
+            return parsed
+        if isinstance(default, list):
+            return [item for item in value.split(os.pathsep) if item]
+        raise ValueError('JSON object expected')
+    return value
+
+
+def getRemoteNames(paths: list) -> dict:
+    '''Returns names of tracked paths in remote folder.
+
+    Path is named by the shortest tail of its absolute path which doesn't
+    collide with names of other paths: names are not equal and no name
+    is inside another one. So path with unique base name is named by it,
+    while "/a/conf.ini" and "/b/conf.ini" are named "a/conf.ini" and
+    "b/conf.ini". Every round costs O(paths * depth), only colliding
+    paths get longer names in next round.
+
+    Args:
+        paths (list): absolute paths, none of them inside another one.
+
+    Returns:
+        dict: {absolute path: "/" separated name}.
+    '''
+    parts = {path: os.path.splitdrive(path)[1].strip(os.path.sep).split(os.path.sep) for path in paths}
+    depths = dict.fromkeys(parts, 1)
+    while True:
+        names = {path: '/'.join(parts[path][-depths[path]:]) for path in parts}
+        owners = collections.defaultdict(list)
+        for path, name in names.items():
+            owners[name].append(path)
+        colliding = set()
+        for name, paths_of_name in owners.items():
+            if len(paths_of_name) > 1:
+                colliding.update(paths_of_name)
+            parent = name.rpartition('/')[0]
+            while parent:
+                if parent in owners:
+                    colliding.update(paths_of_name)
+                    colliding.update(owners[parent])
+                parent = parent.rpartition('/')[0]
+        longer = [path for path in colliding if depths[path] < len(parts[path])]
+        if (not longer):
+            return names
+        for path in longer:
+            depths[path] += 1
+
+
+# Suffix of local partially downloaded files, see FileSync.downloadResumable.
+PARTIAL_SUFFIX = '.filesync-part'
+
+
 class FileSync:
     '''Main class.
     '''
-    def __init__(self):
+    def __init__(self, config: Optional[dict] = None, name: str = '', shared: Optional['FileSync'] = None,
+                 options: Optional[list] = None, interactive: bool = True):
+        '''
+        Args:
+            config (Optional[dict]): config, loaded from config file (or created) if None.
+            name (str): remote name for logs, see FanOut.
+            shared (Optional[FileSync]): instance which fingerprint cache and hash pool (and local trees, if tracked paths are the same) are reused.
+            options (Optional[list]): "key=value" options overriding loaded config, see getOverrides.
+            interactive (bool): ask for config values if config file doesn't exist.
+        '''
         self.NAME = self.__class__.__name__
         self.VERSION = '0.1'
         self.CONFIG_TEMPLATE = {
@@ -61,23 +182,206 @@ class FileSync:
             'port': 22,
             'username': '',
             'password': '',
+            'keepalive': 30,
+            'command_timeout': 600,
+            'hash_algorithm': 'md5',
+            'hash_chunk_size': 1024 * 1024,
+            'hash_mmap': False,
+            'hash_workers': 0,
+            'fingerprint_cache': True,
+            'fingerprint_persist': 'auto',
+            'reverify_interval': 0,
+            'sync_interval': 10,
+            'watch_backend': 'auto',
+            'watch_debounce': 0.2,
+            'watch_poll_interval': 1,
+            'full_scan_interval': 300,
+            'schedule': 'fixed',
+            'check_interval_min': 2,
+            'check_interval_max': 600,
+            'check_backoff': 2,
+            'check_rate': 0,
+            'remote_rate': 0,
+            'transfer_mode': 'scp',
+            'delta_min_size': 1024 * 1024,
+            'delta_max_size': 256 * 1024 * 1024,
+            'delta_max_literal': 0.5,
+            'workers': 4,
+            'ssh_compression': False,
+            'ssh_window_size': 0,
+            'ssh_max_packet_size': 0,
+            'ssh_ciphers': [],
+            'transfer_backend': 'scp',
+            'sftp_prefetch_requests': 0,
+            'probe_size': 8 * 1024 * 1024,
+            'compression': 'none',
+            'resume_min_size': 64 * 1024 * 1024,
+            'resume_chunk_size': 8 * 1024 * 1024,
+            'resume_retries': 3,
+            'storage': 'plain',
+            'cas_chunk_size': 64 * 1024,
+            'cas_sweep_interval': 3600,
+            'batch_max_size': 0,
+            'batch_min_files': 2,
+            'stream_verify': 'auto',
             'local_files': [],
-            'local_hashes': {},
-            'remote_hashes': {}
+            'remotes': [],
+            'state_file': 'state.json',
+            'state_flush_interval': 1,
+            'remote_agent': False,
+            'agent_ping_interval': 10,
+            'metrics_port': 0,
+            'metrics_file': '',
+            'profile_file': 'profile.prof'
         }
         self.REMOTE_PATH = f'.{self.NAME}'
+        self.META_PATH = f'{self.REMOTE_PATH}/.meta'
+        self.CAS_PATH = f'{self.META_PATH}/cas'
         self.TEMP_PATH = os.environ.get('TEMP')
-        self.log = logging.getLogger(self.NAME)
-        self.config = self.initConfig()
-        if self.checkConnection():
-            self.log.info(f'{self.NAME} v{self.VERSION} Loaded!')
+        self.log = logging.getLogger(f'{self.NAME}:{name}' if name else self.NAME)
+        self.remote_manifest = None
+        self.remote_manifest_algorithm = None
+        self.changes = ChangeQueue()
+        self.remote_helpers = {}
+        self.next_cas_sweep = 0
+        self.remote_commands = {}
+        self.compression_stats = None
+        self.metrics = Metrics({'remote': name} if name else None)
+        self.metrics_server = None
+        self._helpers_lock = threading.Lock()
+        self._config_lock = threading.Lock()
+        self.config = config if config is not None else self.initConfig(self.getOverrides(options or []), interactive)
+        self.state = self.initState()
+        self.files, self.directories = self.splitTrackedPaths()
+        # FanOut remotes with the same tracked paths share local side with primary: local trees
+        # are kept by primary and local hashes are not saved, see getStoredLocalHash.
+        self.local_shared = shared is not None and shared.config['local_files'] == self.config['local_files']
+        self.fanout = None
+        if self.local_shared:
+            # Names depend on tracked paths only.
+            self.remote_names = shared.remote_names
+        else:
+            self.remote_names = getRemoteNames(
+                [path for path in map(os.path.abspath, self.files + self.directories) if self.getDirectoryRoot(path) is None])
+        self.local_trees = shared.local_trees if self.local_shared else {}
+        self.local_base_trees = {}
+        self.remote_trees = {}
+        self.remote_base_trees = {}
+        self.remote_dirs = set()
+        self._trees_lock = shared._trees_lock if self.local_shared else threading.RLock()
+        self.agent = None
+        self.agent_command = None
+        self.agent_algorithm = None
+        self.agent_ready = False
+        self.agent_manifest = {}
+        self.tree_channel = None
+        self.tree_reader = None
+        self.tree_command = None
+        self.remote_written = set()
+        self.watching = False
+        self.batch = None
+        self.backend = None
+        self._backend_lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+        self.stream_verified = set()
+        self._verified_lock = threading.Lock()
+        self.initTrees()
+        if self.getOption('hash_algorithm') not in getAlgorithms():
+            self.log.warning(
+                f'"__init__": Hash algorithm "{self.getOption("hash_algorithm")}" is not available. Using md5.')
+            self.config['hash_algorithm'] = 'md5'
+        if self.getOption('compression') != 'none':
+            from compression import CompressionStats
+
+            self.compression_stats = CompressionStats()
+        if shared is not None:
+            self.fingerprints = shared.fingerprints
+            self.fingerprint_state = shared.fingerprint_state
+            self.hasher = shared.hasher
+        else:
+            self.fingerprints = None
+            self.fingerprint_state = None
+            if self.getOption('fingerprint_cache'):
+                self.fingerprints = FingerprintCache(self.getOption('reverify_interval'))
+                if self.isFingerprintPersisted(interactive):
+                    self.fingerprint_state = self.state
+                    loaded = self.fingerprints.load(self.state.section('fingerprints'))
+                    self.log.debug(f'"__init__": {loaded} file fingerprints are loaded from state.')
+            self.hasher = HashPool(
+                self.getOption('hash_workers'),
+                self.getOption('hash_chunk_size'),
+                self.getOption('hash_mmap')
+            )
+        self.connection = ConnectionManager(
+            self.config['hostname'],
+            self.config['port'],
+            self.config['username'],
+            self.config['password'],
+            keepalive=self.getOption('keepalive'),
+            compress=self.getOption('ssh_compression'),
+            rate_limiter=TokenBucket(self.getOption('remote_rate')) if self.getOption('remote_rate') else None,
+            window_size=self.getOption('ssh_window_size'),
+            max_packet_size=self.getOption('ssh_max_packet_size'),
+            ciphers=tuple(self.getOption('ssh_ciphers')),
+            command_timeout=self.getOption('command_timeout') or None
+        )
+        self.engine = SyncEngine(self.getOption('workers'))
+        self.scheduler = CheckScheduler(
+            self.getOption('check_interval_min'),
+            self.getOption('check_interval_max'),
+            self.getOption('check_backoff')
+        )
+        self.check_budget = TokenBucket(self.getOption('check_rate')) if self.getOption('check_rate') else None
+        self.initMetrics()
+        self.warmup = threading.Thread(target=self.warmUpConnection, name=f'{self.NAME}WarmUp', daemon=True)
+        self.warmup.start()
+
+    def getOverrides(self, options: list) -> dict:
+        '''Returns config options from environment and command line.
+
+        Every option of CONFIG_TEMPLATE can be set by FILESYNC_<OPTION>
+        environment variable (like FILESYNC_HOSTNAME) or by "option=value"
+        string, the latter wins. Values are parsed by parseOptionValue.
+
+        Args:
+            options (list): "option=value" strings.
+
+        Returns:
+            dict: options.
+        '''
+        raw = {}
+        for key in self.CONFIG_TEMPLATE:
+            if f'FILESYNC_{key.upper()}' in os.environ:
+                raw[key] = os.environ[f'FILESYNC_{key.upper()}']
+        for option in options:
+            key, sep, value = option.partition('=')
+            if (not sep) or key not in self.CONFIG_TEMPLATE:
+                self.log.critical(f'"getOverrides": Unknown option: {option}')
+                sys.exit(1)
+            raw[key] = value
+        overrides = {}
+        for key, value in raw.items():
+            try:
+                overrides[key] = parseOptionValue(self.CONFIG_TEMPLATE[key], value)
+            except ValueError as e:
+                self.log.critical(f'"getOverrides": Bad value of option "{key}": {str(e)}')
+                sys.exit(1)
+        return overrides
 
-    def initConfig(self) -> dict:
+    def initConfig(self, overrides: Optional[dict] = None, interactive: bool = True) -> dict:
         '''Returns config or init new and return it.
 
+        Without config file and in non-interactive mode config is made
+        from overrides only, nothing is asked and config file isn't written.
+
+        Args:
+            overrides (Optional[dict]): options overriding config file, see getOverrides.
+            interactive (bool): ask for config values if config file doesn't exist.
+
         Returns:
             dict: config data.
         '''
+        overrides = overrides or {}
         if os.path.exists('config.json'):
             try:
                 with open('config.json', 'r') as f:
@@ -92,7 +396,18 @@ class FileSync:
                     self.log.critical(f'"initConfig": JSON loads error: {str(e)}')
                     sys.exit(1)
                 else:
+                    data.update(overrides)
                     return data
+        elif (not interactive):
+            config = self.CONFIG_TEMPLATE.copy()
+            config['local_files'] = []
+            config.update(overrides)
+            if (not config['hostname']) or (not config['local_files']):
+                self.log.critical(
+                    '"initConfig": Config file not found, FILESYNC_HOSTNAME and FILESYNC_LOCAL_FILES must be set.')
+                sys.exit(1)
+            self.log.info('"initConfig": Config is taken from environment and options.')
+            return config
         else:
             self.log.warning('"initConfig": Config file not found. Creating...')
             config = self.CONFIG_TEMPLATE.copy()
@@ -111,7 +426,7 @@ class FileSync:
             config['password'] = input('Enter password (user/key): ')
             stop_count = 0
             while True:
-                file = input('Enter path to files (type "stop" for stop adding files.): ')
+                file = input('Enter path to files or folders (type "stop" for stop adding files.): ')
                 if file.lower() == 'stop':
                     if len(config['local_files']) < 0:
                         if stop_count > 1:
@@ -123,8 +438,6 @@ class FileSync:
                     break
                 if os.path.exists(file):
                     config['local_files'].append(file)
-            for file in config['local_files']:
-                config['local_hashes'].update({file: self.getMD5(file)})
             try:
                 with open('config.json', 'w') as f:
                     f.write(json.dumps(config))
@@ -133,8 +446,328 @@ class FileSync:
                 sys.exit(1)
             else:
                 self.log.info('"initConfig": Config initiated.')
+                config.update(overrides)
                 return config
 
+    def initState(self) -> StateStore:
+        '''Returns sync state store, moving hashes from old config file into it.
+
+        Returns:
+            StateStore: state store with started flusher.
+        '''
+        state = StateStore(self.getOption('state_file'), self.getOption('state_flush_interval'))
+        if (not state.exists()):
+            for section in ('local_hashes', 'remote_hashes'):
+                for key, value in self.config.get(section, {}).items():
+                    state.set(section, key, value)
+            if state.flush() and (self.config.get('local_hashes') or self.config.get('remote_hashes')):
+                self.log.info('"initState": Hashes are moved from config file to state file.')
+        state.start()
+        return state
+
+    def initMetrics(self) -> None:
+        '''Register stats of sync components as metrics collectors.
+        '''
+        self.metrics.addCollector('connection', lambda: self.connection.stats)
+        self.metrics.addCollector('transfer', lambda: self.engine.stats)
+        if self.compression_stats is not None:
+            self.metrics.addCollector('compression', self.compression_stats.totals)
+        self.metrics.addCollector('state', lambda: {'writes': self.state.writes})
+        if self.fingerprints:
+            self.metrics.addCollector(
+                'fingerprint', lambda: {'hits': self.fingerprints.hits, 'misses': self.fingerprints.misses})
+
+    def getOption(self, key: str):
+        '''Returns config option or default value from config template.
+
+        Args:
+            key (str): option name.
+
+        Returns:
+            Any: option value.
+        '''
+        return self.config.get(key, self.CONFIG_TEMPLATE.get(key))
+
+    def isFingerprintPersisted(self, interactive: bool) -> bool:
+        '''Check "fingerprint_persist" option.
+
+        "auto" turns persistence on in non-interactive mode, so headless
+        restarts don't rehash all unchanged files.
+
+        Args:
+            interactive (bool): FileSync is started in interactive mode.
+
+        Returns:
+            bool: True if fingerprints are saved in state.
+        '''
+        value = self.getOption('fingerprint_persist')
+        if value == 'auto':
+            return (not interactive)
+        if isinstance(value, str):
+            try:
+                return parseOptionValue(False, value)
+            except ValueError as e:
+                self.log.critical(f'"isFingerprintPersisted": Bad value of option "fingerprint_persist": {str(e)}')
+                sys.exit(1)
+        return bool(value)
+
+    def isStreamVerify(self) -> bool:
+        '''Check "stream_verify" option.
+
+        "auto" turns one command transfers on if remote host has hash
+        command, tee and GNU stat and find (their "-c" and "-printf" are
+        used), so hashes are saved without rereading files.
+
+        Returns:
+            bool: True if uploadStream and downloadStream are used.
+        '''
+        value = self.getOption('stream_verify')
+        if value == 'auto':
+            command = REMOTE_HASH_COMMANDS[self.getRemoteHashAlgorithm()]
+            return (
+                self.hasRemoteCommand(command) and self.hasRemoteCommand('tee') and
+                self.probeRemote('gnu_stat_find', 'stat -c %s . && find . -maxdepth 0 -printf \'%T@\\n\'')
+            )
+        if isinstance(value, str):
+            try:
+                return parseOptionValue(False, value)
+            except ValueError as e:
+                self.log.critical(f'"isStreamVerify": Bad value of option "stream_verify": {str(e)}')
+                sys.exit(1)
+        return bool(value)
+
+    def splitTrackedPaths(self) -> tuple:
+        '''Returns tracked files and tracked directories from "local_files".
+
+        Paths which are directories or end with path separator are
+        directories, synced recursively. Remote copies are named by
+        getRemoteNames.
+
+        Returns:
+            tuple: list of file paths and list of absolute directory paths.
+        '''
+        files = []
+        directories = []
+        for path in self.config['local_files']:
+            if os.path.isdir(path) or path.endswith(os.path.sep):
+                directories.append(os.path.abspath(path))
+            else:
+                files.append(path)
+        return files, directories
+
+    def getDirectoryRoot(self, filepath: str) -> Optional[Union[str, None]]:
+        '''Returns tracked directory containing file.
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            Optional[Union[str, None]]: absolute directory path or None.
+        '''
+        path = os.path.abspath(filepath)
+        for root in self.directories:
+            if path.startswith(root + os.path.sep):
+                return root
+        return None
+
+    def getRemoteRoot(self, remote_path: str) -> tuple:
+        '''Returns tracked directory and relative path for remote file.
+
+        Args:
+            remote_path (str): remote file path.
+
+        Returns:
+            tuple: absolute directory path and "/" separated relative path, or (None, None).
+        '''
+        for root in self.directories:
+            prefix = f'{self.getRemoteTrackedPath(root)}/'
+            if remote_path.startswith(prefix):
+                return root, remote_path[len(prefix):]
+        return None, None
+
+    def isTempFile(self, filepath: str) -> bool:
+        '''Check that file is temporary file of FileSync transfer.
+
+        Args:
+            filepath (str): file path.
+
+        Returns:
+            bool: True or False.
+        '''
+        name = os.path.basename(filepath)
+        return 'sunc_temp_' in name or name.startswith('.delta-') or name.endswith(PARTIAL_SUFFIX)
+
+    def initTrees(self) -> None:
+        '''Build Merkle trees of tracked directories from saved hashes.
+        '''
+        if not self.directories:
+            return
+        from merkle import MerkleTree
+
+        for root in self.directories:
+            self.local_trees.setdefault(root, MerkleTree())
+            self.local_base_trees[root] = MerkleTree()
+            self.remote_trees[root] = MerkleTree()
+            self.remote_base_trees[root] = MerkleTree()
+        for filepath, hash in self.state.section('local_hashes').items():
+            if self.local_shared:
+                # Saved by older version, local base is taken from remote hashes now.
+                self.state.delete('local_hashes', filepath)
+                continue
+            root = self.getDirectoryRoot(filepath)
+            if root:
+                self.local_base_trees[root].set(os.path.relpath(filepath, root).replace(os.path.sep, '/'), hash)
+        for remote_path, hash in self.state.section('remote_hashes').items():
+            root, relpath = self.getRemoteRoot(remote_path)
+            if root:
+                self.remote_base_trees[root].set(relpath, hash)
+                if self.local_shared:
+                    self.local_base_trees[root].set(relpath, hash)
+
+    def getStoredLocalHash(self, filepath: str) -> Optional[Union[str, None]]:
+        '''Returns hash of local file saved by last sync.
+
+        FanOut remotes sharing local side don't save local hashes: after
+        sync local file is equal to remote copy, so saved remote hash is
+        used (checkLocalFile hashes local file with its algorithm).
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            Optional[Union[str, None]]: hash or None.
+        '''
+        if self.local_shared:
+            return self.state.get('remote_hashes', self.getRemotePath(filepath))
+        return self.state.get('local_hashes', filepath)
+
+    def setLocalHash(self, filepath: str, hash: str) -> None:
+        '''Save local file hash in state and directory trees.
+
+        With shared local side hash is saved in base tree only, see
+        getStoredLocalHash.
+
+        Args:
+            filepath (str): local file path.
+            hash (str): file hash.
+        '''
+        if (not self.local_shared):
+            self.state.set('local_hashes', filepath, hash)
+        root = self.getDirectoryRoot(filepath)
+        if root:
+            relpath = os.path.relpath(filepath, root).replace(os.path.sep, '/')
+            with self._trees_lock:
+                self.local_base_trees[root].set(relpath, hash)
+                if (not self.local_shared):
+                    self.local_trees[root].set(relpath, hash)
+
+    def setRemoteHash(self, remote_path: str, hash: str) -> None:
+        '''Save remote file hash in state and directory trees.
+
+        Args:
+            remote_path (str): remote file path.
+            hash (str): file hash.
+        '''
+        self.state.set('remote_hashes', remote_path, hash)
+        root, relpath = self.getRemoteRoot(remote_path)
+        if root:
+            with self._trees_lock:
+                self.remote_base_trees[root].set(relpath, hash)
+                self.remote_written.add(remote_path[len(self.REMOTE_PATH) + 1:])
+
+    def setRemoteManifestEntry(self, remote_path: str, entry: Optional[dict]) -> None:
+        '''Update remote manifest entry and remote directory tree.
+
+        Args:
+            remote_path (str): remote file path.
+            entry (Optional[dict]): manifest entry, None if file is removed.
+        '''
+        with self._trees_lock:
+            if self.remote_manifest is not None:
+                if entry is None:
+                    self.remote_manifest.pop(remote_path, None)
+                else:
+                    self.remote_manifest[remote_path] = entry
+            root, relpath = self.getRemoteRoot(remote_path)
+            if root:
+                if entry is None:
+                    self.remote_trees[root].remove(relpath)
+                else:
+                    self.remote_trees[root].set(relpath, entry['hash'] or '')
+
+    def scanLocalTree(self, root: str) -> None:
+        '''Rescan tracked directory and update its local tree.
+
+        Whole directory is walked and every file is stat'ed, so cost grows
+        with tree size. Only files with changed stat are rehashed (see
+        FingerprintCache), they are hashed in parallel. With watcher it's
+        done by full cycles only (on "full_scan_interval" timer or when
+        watcher loses events), paths reported by watcher between them are
+        applied by updateLocalTreeFile.
+
+        Args:
+            root (str): absolute directory path.
+        '''
+        tree = self.local_trees[root]
+        filepaths = []
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                filepath = os.path.join(dirpath, name)
+                if (not self.isTempFile(filepath)):
+                    filepaths.append(filepath)
+        seen = set()
+        for filepath, hash in self.hashLocalFiles(filepaths).items():
+            relpath = os.path.relpath(filepath, root).replace(os.path.sep, '/')
+            tree.set(relpath, hash)
+            seen.add(relpath)
+        for relpath in [relpath for relpath, _ in tree.items() if relpath not in seen]:
+            tree.remove(relpath)
+
+    def updateLocalTreeFile(self, filepath: str) -> None:
+        '''Update one file in local tree of its tracked directory.
+
+        Removed directory path removes all its files from tree, files of
+        existing directories are reported by watcher one by one.
+
+        Args:
+            filepath (str): local file path.
+        '''
+        root = self.getDirectoryRoot(filepath)
+        if root is None or self.isTempFile(filepath) or os.path.isdir(filepath):
+            return
+        relpath = os.path.relpath(filepath, root).replace(os.path.sep, '/')
+        try:
+            hash = self.getHash(filepath)
+        except OSError:
+            hash = None
+        with self._trees_lock:
+            if hash is None:
+                self.local_trees[root].remove(relpath)
+                self.local_trees[root].removeTree(relpath)
+            else:
+                self.local_trees[root].set(relpath, hash)
+
+    def getChangedDirectoryFiles(self) -> list:
+        '''Returns files in tracked directories changed on any side since last sync.
+
+        Local and remote trees are compared with trees built from saved
+        hashes, unchanged subtrees are skipped. Local trees are updated
+        from watcher events (see updateLocalTreeFile), remote trees by
+        refreshRemoteTrees or remote agent events, so cost depends on
+        number of changes. Without watcher every check walks tracked
+        directories (see scanLocalTree).
+
+        Returns:
+            list: local file paths.
+        '''
+        files = []
+        for root in self.directories:
+            with self._trees_lock:
+                relpaths = set(self.local_trees[root].diff(self.local_base_trees[root]))
+                relpaths.update(self.remote_trees[root].diff(self.remote_base_trees[root]))
+            files.extend(os.path.join(root, *relpath.split('/')) for relpath in sorted(relpaths))
+        return files
+
     def getMD5(self, filepath: str) -> str:
         '''Returns MD5 hash for file.
 
@@ -144,10 +777,190 @@ class FileSync:
         Returns:
             str: MD5 hash.
         '''
-        h = hashlib.md5()
-        with open(filepath, 'rb') as f:
-            h.update(f.read())
-        return h.hexdigest()
+        return hashFile(filepath, 'md5', self.getOption('hash_chunk_size'), self.getOption('hash_mmap'))
+
+    def getHash(self, filepath: str, algorithm: Optional[str] = None) -> str:
+        '''Returns hash for file in config format.
+
+        Args:
+            filepath (str): Path to file for hashing.
+            algorithm (Optional[str]): hash algorithm, "hash_algorithm" option by default.
+
+        Returns:
+            str: hash, prefixed with algorithm name if it's not MD5.
+        '''
+        if algorithm is None:
+            algorithm = self.getOption('hash_algorithm')
+        st = os.stat(filepath)
+        if self.fingerprints is None:
+            return formatDigest(algorithm, self.hashFile(filepath, algorithm, st.st_size))
+        digest = self.fingerprints.get(filepath, algorithm, st)
+        if digest is None:
+            digest = self.hashFile(filepath, algorithm, st.st_size)
+            self.cacheHash(filepath, algorithm, digest, st)
+        return formatDigest(algorithm, digest)
+
+    def cacheHash(self, filepath: str, algorithm: str, digest: str, st: os.stat_result) -> None:
+        '''Save hex digest of file in fingerprint cache, if file stat is still st.
+
+        Used for digests taken by hashing and by transfers (see uploadStream).
+
+        Args:
+            filepath (str): path to file.
+            algorithm (str): hash algorithm.
+            digest (str): hex digest.
+            st (os.stat_result): file stat taken before digest.
+        '''
+        if self.fingerprints is None:
+            return
+        try:
+            unchanged = FingerprintCache.fingerprint(os.stat(filepath)) == FingerprintCache.fingerprint(st)
+        except OSError:
+            unchanged = False
+        if unchanged and self.fingerprints.set(filepath, algorithm, digest, st):
+            self.saveFingerprint(filepath)
+
+    def saveFingerprint(self, filepath: str) -> None:
+        '''Save fingerprint cache entry of file in state, if "fingerprint_persist" is on.
+
+        Remotes of FanOut save entries in state of primary, which loads them.
+
+        Args:
+            filepath (str): path to file.
+        '''
+        if self.fingerprint_state is not None:
+            entry = self.fingerprints.export(filepath)
+            if entry is not None:
+                self.fingerprint_state.set('fingerprints', filepath, entry)
+
+    def hashFile(self, filepath: str, algorithm: str, size: int) -> str:
+        '''Returns hex digest of file, counting hashing time and bytes.
+
+        Args:
+            filepath (str): path to file.
+            algorithm (str): hash algorithm.
+            size (int): file size.
+
+        Returns:
+            str: hex digest.
+        '''
+        with self.metrics.timer('hash'):
+            digest = self.hasher.hashFile(filepath, algorithm, size)
+        self.metrics.inc('hash_bytes', size)
+        return digest
+
+    def hashLocalFiles(self, files: list, algorithm: Optional[str] = None) -> dict:
+        '''Returns hashes of many files, hashing them in parallel (see HashPool).
+
+        Cached hashes are used like in getHash.
+
+        Args:
+            files (list): local file paths.
+            algorithm (Optional[str]): hash algorithm, "hash_algorithm" option by default.
+
+        Returns:
+            dict: {file: hash in config format}, files which can't be read are skipped.
+        '''
+        if algorithm is None:
+            algorithm = self.getOption('hash_algorithm')
+        hashes = {}
+        pending = []
+        for filepath in files:
+            if self.fingerprints is not None:
+                try:
+                    st = os.stat(filepath)
+                except OSError:
+                    continue
+                digest = self.fingerprints.get(filepath, algorithm, st)
+                if digest is not None:
+                    hashes[filepath] = formatDigest(algorithm, digest)
+                    continue
+            pending.append(filepath)
+        if (not pending):
+            return hashes
+        with self.metrics.timer('hash_parallel'):
+            results = self.hasher.hashFiles(pending, algorithm)
+        for filepath, (digest, st) in results.items():
+            self.metrics.inc('hash_bytes', st.st_size)
+            self.cacheHash(filepath, algorithm, digest, st)
+            hashes[filepath] = formatDigest(algorithm, digest)
+        return hashes
+
+    def scanLocal(self) -> None:
+        '''Hash tracked files and rescan tracked directories into fingerprint cache.
+
+        Needs no connection, so it's done while connection is warmed up:
+        first sync cycle takes hashes of unchanged files from the cache.
+        '''
+        if self.fingerprints is None:
+            return
+        with self.metrics.timer('startup_scan'):
+            for root in self.directories:
+                self.scanLocalTree(root)
+            self.prehashLocalFiles([file for file in self.files if os.path.exists(file)])
+
+    def prehashLocalFiles(self, files: list) -> None:
+        '''Hash files before checking them one by one.
+
+        Files without local hash get it in state. Files with local hash
+        are hashed only into fingerprint cache (with algorithm of saved
+        hash), so checkLocalFile takes hashes from it.
+
+        Args:
+            files (list): local file paths.
+        '''
+        groups = {}
+        for file in files:
+            stored_hash = self.getStoredLocalHash(file)
+            if stored_hash:
+                if self.fingerprints is not None:
+                    groups.setdefault(parseDigest(stored_hash)[0], []).append(file)
+            else:
+                groups.setdefault(self.getOption('hash_algorithm'), []).append(file)
+        for algorithm, group in groups.items():
+            for file, hash in self.hashLocalFiles(group, algorithm).items():
+                if (not self.getStoredLocalHash(file)):
+                    self.setLocalHash(file, hash)
+
+    def getRemoteHashAlgorithm(self) -> str:
+        '''Returns hash algorithm for remote files.
+
+        Falls back to MD5 if "hash_algorithm" has no command on remote host.
+
+        Returns:
+            str: algorithm name.
+        '''
+        algorithm = self.getOption('hash_algorithm')
+        if algorithm in REMOTE_HASH_COMMANDS:
+            return algorithm
+        return 'md5'
+
+    def getRemoteTrackedPath(self, path: str) -> str:
+        '''Returns remote path of tracked file or directory.
+
+        Args:
+            path (str): tracked local path.
+
+        Returns:
+            str: remote path, named by base name if path isn't tracked.
+        '''
+        path = os.path.abspath(path)
+        return f'{self.REMOTE_PATH}/{self.remote_names.get(path) or os.path.basename(path)}'
+
+    def getRemotePath(self, filepath: str) -> str:
+        '''Returns path of file copy on remote host.
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            str: remote file path.
+        '''
+        root = self.getDirectoryRoot(filepath)
+        if root:
+            relpath = os.path.relpath(os.path.abspath(filepath), root).replace(os.path.sep, '/')
+            return f'{self.getRemoteTrackedPath(root)}/{relpath}'
+        return self.getRemoteTrackedPath(filepath)
 
     def getTempFileName(self) -> str:
         '''Returns random tempfile name.
@@ -155,24 +968,20 @@ class FileSync:
         Returns:
             str: tempfile name.
         '''
-        return f'sunc_temp_{str(secrets.randbits(6))}'
+        return f'sunc_temp_{secrets.token_hex(8)}'
     
     def checkConnection(self) -> bool:
         '''Check connection to server.
 
+        Connection is kept open and shared by all next operations.
+
         Returns:
             bool: True or False.
         '''
-        cli = SSHClient()
-        cli.load_system_host_keys()
+        from paramiko import ssh_exception
+
         try:
-            cli.connect(
-                self.config['hostname'],
-                self.config['port'],
-                self.config['username'],
-                self.config['password']
-            )
-            cli.close()
+            self.connection.ensureConnected()
         except socket.gaierror as e:
             self.log.error(f'"checkConnection": Can\'t connect to remote host: {str(e)}')
             return False
@@ -193,42 +1002,35 @@ class FileSync:
             self.log.error(f'"checkConnection": Unexpected {exc_type.__name__}: {str(exc_obj)}')
             return False
         else:
-            cli.close()
             self.log.debug('"checkConnection": Connection established.')
             return True
 
-    def getSSHClient(self) -> Optional[Union[SSHClient, None]]:
-        '''Returns SSHClient connected to remote host.
+    def warmUpConnection(self) -> None:
+        '''Connect to remote host, runs in background thread started by __init__.
+
+        Connection lock is held while connecting, so remote operations
+        started meanwhile wait for this connection.
+        '''
+        if self.checkConnection():
+            self.log.info(f'{self.NAME} v{self.VERSION} Loaded!')
+
+    def getSSHClient(self) -> Optional[Union['SSHClient', None]]:
+        '''Returns shared SSHClient connected to remote host.
 
         Returns:
             Optional[Union[SSHClient, None]]: SSHClient or None.
         '''
-        cli = SSHClient()
-        cli.load_system_host_keys()
-        try:
-            cli.connect(
-                self.config['hostname'],
-                self.config['port'],
-                self.config['username'],
-                self.config['password']
-            )
-        except Exception as e:
-            exc_type, exc_obj, _ = sys.exc_info()
-            self.log.error(
-                f'"getSSHClient": Can\'t connect to remote host: {exc_type.__name__}: {str(exc_obj)}')
-            return None
-        else:
-            return cli
+        return self.connection.getSSHClient()
 
-    def getSCPClient(self) -> Optional[Union[SCPClient, None]]:
-        '''Returns SCPClient.
+    def getSCPClient(self) -> Optional[Union['SCPClient', None]]:
+        '''Returns SCPClient working on shared connection.
 
         Returns:
             Optional[Union[SCPClient, None]]: SCPClient or None.
         '''
-        cli = self.getSSHClient()
-        if cli:
-            return SCPClient(cli.get_transport())
+        scp = self.connection.getSCPClient()
+        if scp:
+            return scp
         else:
             self.log.error('"getSCPClient": Can\'t take SSHClient.')
             return None
@@ -239,18 +1041,16 @@ class FileSync:
         Returns:
             bool: True or False.
         '''
-        cli = self.getSSHClient()
-        if cli:
-            std = cli.exec_command('mkdir .FileSync')
-            cli.close()
-            stderr = std[2].read().decode()
+        res = self.connection.execCommand('mkdir .FileSync')
+        if res:
+            stderr = res[1].decode()
             if stderr == '':
                 self.log.debug('"initRemote": Successfull created a .FileSync folder on remote host.')
-                return True
+                return self.initRemoteAgent()
             else:
                 if 'File exists' in stderr:
                     self.log.info('"initRemote": .FileSync folder exists on remote host. No actions required.')
-                    return True
+                    return self.initRemoteAgent()
                 else:
                     self.log.error(f'"initRemote": Can\'t create .FileSync folder on remote host: {stderr}')
                     return False
@@ -258,6 +1058,28 @@ class FileSync:
             self.log.error('"initRemote": Can\'t take SSHClient.')
             return False
 
+    def initRemoteAgent(self) -> bool:
+        '''Deploy remote changes agent if "remote_agent" option is set.
+
+        Without agent remote changes are found by polling.
+
+        Returns:
+            bool: True.
+        '''
+        if (not self.getOption('remote_agent')):
+            return True
+        for filename in ('hashing.py', 'watcher.py', 'merkle.py', 'agent.py'):
+            if self.deployRemoteHelper(filename) is None:
+                self.log.warning('"initRemoteAgent": Remote agent is not deployed. Polling remote files.')
+                return True
+        meta = self.META_PATH[len(self.REMOTE_PATH) + 1:]
+        self.agent_command = (
+            f'cd {shlex.quote(self.REMOTE_PATH)} && exec python3 {shlex.quote(meta)}/agent.py '
+            f'--algorithm {self.getRemoteHashAlgorithm()} --exclude {shlex.quote(meta)} '
+            f'--ping {self.getOption("agent_ping_interval")} .'
+        )
+        return True
+
     def initLocal(self) -> bool:
         '''Initialize local folder for syncing.
 
@@ -265,12 +1087,12 @@ class FileSync:
             bool: True or False.
         '''
         path = os.path.join(
-            os.environ.get('HOMEPATH'),
+            os.environ.get('HOMEPATH') or os.path.expanduser('~'),
             'Documents',
             '.FileSync'
         )
         try:
-            os.mkdir(path)
+            os.makedirs(path)
         except FileExistsError:
             self.log.info(f'"initLocal": Folder ({path}) already exists.')
             return True
@@ -281,61 +1103,1448 @@ class FileSync:
             self.log.info(f'"initLocal": Folder {path} is successfull created.')
             return True
 
-    def upload(self, filepath: str) -> bool:
-        '''Upload filepath to remote.
+    def deployRemoteHelper(self, filename: str) -> Optional[Union[str, None]]:
+        '''Copy helper script to remote meta folder if it's missing or outdated.
 
         Args:
-            filepath (str): file path to upload.
-        
+            filename (str): script file name near this file.
+
         Returns:
-            bool: True or False.
+            Optional[Union[str, None]]: remote script path or None.
         '''
-        scp = self.getSCPClient()
-        if scp:
-            remote_path = f'{self.REMOTE_PATH}/{filepath.split(os.path.sep)[::-1][0]}'
-            try:
-                scp.put(filepath, remote_path)
-                scp.close()
-            except SCPException as e:
-                self.log.error(f'"upload": SCPException: {str(e)}')
-                return False
-            else:
-                self.log.info(f'"upload": File ({str(filepath)}) is uploaded.')
-                return True
-        else:
-            self.log.error('"upload": Can\'t take SCPClient.')
-            return False
+        with self._helpers_lock:
+            if filename in self.remote_helpers:
+                return self.remote_helpers[filename]
+            return self._deployRemoteHelper(filename)
 
-    def download(self, filepath: str) -> bool:
-        '''Download file to LOCAL_PATH.
+    def _deployRemoteHelper(self, filename: str) -> Optional[Union[str, None]]:
+        '''deployRemoteHelper without lock.
+        '''
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename), 'rb') as f:
+            source = f.read()
+        remote_path = f'{self.META_PATH}/{filename}'
+        res = self.connection.execCommand(
+            f'mkdir -p {shlex.quote(self.META_PATH)} && '
+            f'command -v python3 >/dev/null && '
+            f'{{ cat > {shlex.quote(remote_path)}.new && mv {shlex.quote(remote_path)}.new {shlex.quote(remote_path)}; }}',
+            source
+        )
+        if res is None or res[2] != 0:
+            self.log.warning(f'"deployRemoteHelper": Can\'t deploy {filename} (python3 is required on remote host).')
+            self.remote_helpers[filename] = None
+            return None
+        self.log.debug(f'"deployRemoteHelper": {filename} is deployed to {remote_path}.')
+        self.remote_helpers[filename] = remote_path
+        return remote_path
+
+    def uploadDelta(self, filepath: str) -> Optional[Union[bool, None]]:
+        '''Upload only changed blocks of file, rsync-style.
 
         Args:
-            filepath (str): file path.
+            filepath (str): file path to upload.
 
         Returns:
-            bool: True or False.
+            Optional[Union[bool, None]]: True or False, None if whole file must be uploaded.
         '''
-        scp = self.getSCPClient()
-        if scp:
-            remote_filepath = f'{self.REMOTE_PATH}/{filepath.split(os.path.sep)[::-1][0]}'
-            try:
-                scp.get(remote_filepath, filepath)
-                scp.close()
-            except Exception as e:
-                self.log.error(f'"download": Can\'t get file ({remote_filepath}): {str(e)}.')
-                return False
+        import delta
+
+        size = os.path.getsize(filepath)
+        remote_path = self.getRemotePath(filepath)
+        entry = (self.remote_manifest or {}).get(remote_path)
+        if (not self.isDeltaSize(size)) or (self.remote_manifest is not None and entry is None):
+            return None
+        helper = self.deployRemoteHelper('delta.py')
+        if helper is None:
+            return None
+        block_size = delta.getBlockSize(entry['size'] if entry else size)
+        res = self.connection.execCommand(
+            f'python3 {shlex.quote(helper)} signature {shlex.quote(remote_path)} {block_size}')
+        if res is None or res[2] != 0:
+            self.log.debug(f'"uploadDelta": No base copy of file ({remote_path}) on remote host.')
+            return None
+        chan = self.connection.openChannel()
+        if chan is None:
+            return None
+        try:
+            chan.exec_command(f'python3 {shlex.quote(helper)} patch {shlex.quote(remote_path)}')
+            out = chan.makefile('wb')
+            with open(filepath, 'rb') as f:
+                sent = delta.writeDelta(f, io.BytesIO(res[0]), out, self.getOption('delta_max_literal'))
+            out.flush()
+            chan.shutdown_write()
+            digest = chan.makefile('rb').read().decode().strip()
+            status = chan.recv_exit_status()
+            stderr = chan.makefile_stderr('rb').read().decode(errors='replace')
+        except delta.DeltaTooLarge as e:
+            # Remote patch gets truncated delta and keeps old file.
+            self.log.info(f'"uploadDelta": File ({filepath}) is mostly changed, {str(e)}. Uploading whole file.')
+            return None
+        except Exception as e:
+            self.log.error(f'"uploadDelta": Delta upload of file ({filepath}) failed: {str(e)}')
+            return False
+        finally:
+            chan.close()
+        if status != 0:
+            self.log.error(f'"uploadDelta": Remote patch failed: {stderr}')
+            return False
+        if (not secure_compare(digest, self.getMD5(filepath))):
+            self.log.error(f'"uploadDelta": File ({filepath}) hash mismatch after patching.')
+            return False
+        self.log.info(f'"uploadDelta": File ({filepath}) is uploaded by delta: {sent} of {size} bytes sent.')
+        return True
+
+    def downloadDelta(self, filepath: str) -> Optional[Union[bool, None]]:
+        '''Download only changed blocks of file, rsync-style.
+
+        File is rebuilt into temp file, which replaces local file only
+        if its hash is equal to hash of remote file from manifest.
+
+        Args:
+            filepath (str): file path.
+
+        Returns:
+            Optional[Union[bool, None]]: True or False, None if whole file must be downloaded.
+        '''
+        import delta
+
+        if (not os.path.isfile(filepath)) or (not self.isDeltaSize(os.path.getsize(filepath))):
+            return None
+        helper = self.deployRemoteHelper('delta.py')
+        if helper is None:
+            return None
+        remote_path = self.getRemotePath(filepath)
+        entry = (self.remote_manifest or {}).get(remote_path)
+        if entry is None or (not entry['hash']):
+            entry = (self.queryRemoteManifest([remote_path]) or {}).get(remote_path)
+        if entry is None or (not entry['hash']):
+            self.log.debug(f'"downloadDelta": No hash of remote file ({remote_path}).')
+            return None
+        if (not self.isDeltaSize(entry['size'])):
+            return None
+        algorithm, expected = parseDigest(entry['hash'])
+        signature = io.BytesIO()
+        with open(filepath, 'rb') as f:
+            delta.writeSignature(f, signature, delta.getBlockSize(os.path.getsize(filepath)))
+        chan = self.connection.openChannel()
+        if chan is None:
+            return None
+        try:
+            chan.exec_command(
+                f'python3 {shlex.quote(helper)} delta {shlex.quote(remote_path)} {float(self.getOption("delta_max_literal"))}')
+            chan.sendall(signature.getvalue())
+            chan.shutdown_write()
+            temp_path, digest = delta.rebuildFile(filepath, chan.makefile('rb'))
+            status = chan.recv_exit_status()
+        except Exception as e:
+            if chan.exit_status_ready() and chan.recv_exit_status() == 3:
+                self.log.info(f'"downloadDelta": File ({filepath}) is mostly changed. Downloading whole file.')
             else:
-                if os.path.exists(filepath):
-                    self.log.info(
-                        f'"download": File ({filepath}) is downloaded!')
-                    return True
-                else:
-                    self.log.error(
-                        f'"download": Can\'t found downloaded file: {filepath}.')
+                self.log.warning(f'"downloadDelta": Delta download of file ({filepath}) failed: {str(e)}')
+            return None
+        finally:
+            chan.close()
+        try:
+            if status != 0:
+                self.log.warning(f'"downloadDelta": Remote delta of file ({remote_path}) failed.')
+                return None
+            if algorithm != 'md5':
+                digest = self.hashFile(temp_path, algorithm, os.path.getsize(temp_path))
+            if (not secure_compare(digest, expected)):
+                self.log.error(f'"downloadDelta": File ({filepath}) hash mismatch after patching.')
+                return None
+            os.replace(temp_path, filepath)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.log.info(f'"downloadDelta": File ({filepath}) is downloaded by delta.')
+        return True
+
+    def isDeltaSize(self, size: int) -> bool:
+        '''Check that file size is between "delta_min_size" and "delta_max_size".
+
+        Delta of bigger file costs more CPU time than sending it.
+
+        Args:
+            size (int): file size.
+
+        Returns:
+            bool: True if delta transfer can be used.
+        '''
+        max_size = self.getOption('delta_max_size')
+        return size >= self.getOption('delta_min_size') and ((not max_size) or size <= max_size)
+
+    def hasRemoteCommand(self, command: str) -> bool:
+        '''Check that command is available on remote host.
+
+        Args:
+            command (str): command name.
+
+        Returns:
+            bool: True or False.
+        '''
+        return self.probeRemote(command, f'command -v {shlex.quote(command)}')
+
+    def probeRemote(self, name: str, command: str) -> bool:
+        '''Check that probe command succeeds on remote host, result is cached by name.
+
+        Args:
+            name (str): probe name.
+            command (str): shell command.
+
+        Returns:
+            bool: True or False.
+        '''
+        if name not in self.remote_commands:
+            res = self.connection.execCommand(command)
+            if res is None:
+                return False
+            self.remote_commands[name] = res[2] == 0
+        return self.remote_commands[name]
+
+    def getCompressionCodec(self, filepath: str):
+        '''Returns codec for file transfer if compression is enabled and worth it.
+
+        Args:
+            filepath (str): local file path, used for compressibility check.
+
+        Returns:
+            Optional[Union[Codec, None]]: codec or None.
+        '''
+        from compression import getCodec, isCompressible
+
+        name = self.getOption('compression')
+        if name == 'none':
+            return None
+        codec = None
+        for candidate in (('zstd', 'gzip') if name == 'auto' else (name,)):
+            codec = getCodec(candidate)
+            if codec is not None and self.hasRemoteCommand(codec.decompress_command.split()[0]):
+                break
+            codec = None
+        if codec is None:
+            self.log.debug(f'"getCompressionCodec": Codec "{name}" is not available.')
+            return None
+        if os.path.exists(filepath) and (not isCompressible(filepath)):
+            self.log.debug(f'"getCompressionCodec": File ({filepath}) is not compressible.')
+            return None
+        return codec
+
+    def uploadCompressed(self, filepath: str) -> Optional[Union[bool, None]]:
+        '''Upload file through streaming compression.
+
+        Args:
+            filepath (str): file path to upload.
+
+        Returns:
+            Optional[Union[bool, None]]: True or False, None if file must be uploaded without compression.
+        '''
+        codec = self.getCompressionCodec(filepath)
+        if codec is None:
+            return None
+        chan = self.connection.openChannel()
+        if chan is None:
+            return None
+        remote_path = shlex.quote(self.getRemotePath(filepath))
+        temp_path = shlex.quote(f'{self.META_PATH}/{self.getTempFileName()}')
+        raw = wire = 0
+        cpu = 0.0
+        try:
+            chan.exec_command(
+                f'mkdir -p {shlex.quote(self.META_PATH)} && '
+                f'{codec.decompress_command} > {temp_path} && mv -f {temp_path} {remote_path}')
+            compressor = codec.compressor()
+            with open(filepath, 'rb') as f:
+                while True:
+                    chunk = f.read(self.getOption('hash_chunk_size'))
+                    started = time.thread_time()
+                    data = compressor.compress(chunk) if chunk else compressor.flush()
+                    cpu += time.thread_time() - started
+                    raw += len(chunk)
+                    wire += len(data)
+                    if data:
+                        chan.sendall(data)
+                    if not chunk:
+                        break
+            chan.shutdown_write()
+            status = chan.recv_exit_status()
+            stderr = chan.makefile_stderr('rb').read().decode(errors='replace')
+        except Exception as e:
+            self.log.error(f'"uploadCompressed": Upload of file ({filepath}) failed: {str(e)}')
+            return False
+        finally:
+            chan.close()
+        if status != 0:
+            self.log.error(f'"uploadCompressed": Remote decompression failed: {stderr}')
+            return False
+        self.compression_stats.record(filepath, raw, wire, cpu)
+        self.log.info(
+            f'"uploadCompressed": File ({filepath}) is uploaded with {codec.name}: '
+            f'{wire} of {raw} bytes sent, {cpu * 1000:.1f} ms CPU.')
+        return True
+
+    def downloadCompressed(self, filepath: str) -> Optional[Union[bool, None]]:
+        '''Download file through streaming compression.
+
+        File is written to temp file near filepath and renamed into place.
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            Optional[Union[bool, None]]: True or False, None if file must be downloaded without compression.
+        '''
+        codec = self.getCompressionCodec(filepath)
+        if codec is None or (not self.hasRemoteCommand(codec.compress_command.split()[0])):
+            return None
+        chan = self.connection.openChannel()
+        if chan is None:
+            return None
+        temp_path = f'{filepath}.{self.getTempFileName()}'
+        raw = wire = 0
+        cpu = 0.0
+        try:
+            chan.exec_command(f'{codec.compress_command} < {shlex.quote(self.getRemotePath(filepath))}')
+            decompressor = codec.decompressor()
+            with open(temp_path, 'wb') as f:
+                while True:
+                    data = chan.recv(256 * 1024)
+                    if not data:
+                        break
+                    started = time.thread_time()
+                    chunk = decompressor.decompress(data)
+                    cpu += time.thread_time() - started
+                    wire += len(data)
+                    raw += len(chunk)
+                    f.write(chunk)
+            status = chan.recv_exit_status()
+            stderr = chan.makefile_stderr('rb').read().decode(errors='replace')
+            if status != 0:
+                raise IOError(f'remote compression failed: {stderr}')
+            os.replace(temp_path, filepath)
+        except Exception as e:
+            self.log.error(f'"downloadCompressed": Download of file ({filepath}) failed: {str(e)}')
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+        finally:
+            chan.close()
+        self.compression_stats.record(filepath, raw, wire, cpu)
+        self.log.info(
+            f'"downloadCompressed": File ({filepath}) is downloaded with {codec.name}: '
+            f'{wire} of {raw} bytes received, {cpu * 1000:.1f} ms CPU.')
+        return True
+
+    def getPartialRemotePath(self, remote_path: str) -> str:
+        '''Returns remote path of partially uploaded file.
+
+        Args:
+            remote_path (str): remote file path.
+
+        Returns:
+            str: path in remote meta folder.
+        '''
+        return f'{self.META_PATH}/partial/{hashlib.md5(remote_path.encode()).hexdigest()}'
+
+    def runResumable(self, name: str, func, *args) -> bool:
+        '''Run chunked transfer, retrying after failures with backoff.
+
+        Every retry resumes from last verified chunk, connection is
+        reopened by ConnectionManager when it's needed.
+
+        Args:
+            name (str): method name for logs.
+            func (Callable[..., bool]): chunked transfer function.
+
+        Returns:
+            bool: True or False.
+        '''
+        retries = self.getOption('resume_retries')
+        for attempt in range(retries + 1):
+            if func(*args):
+                return True
+            if attempt < retries:
+                delay = min(2 ** attempt, 30)
+                self.log.warning(f'"{name}": Transfer interrupted, resuming in {delay}s...')
+                time.sleep(delay)
+        return False
+
+    def uploadResumable(self, filepath: str) -> Optional[Union[bool, None]]:
+        '''Upload large file by verified chunks.
+
+        Chunks are appended to partial file in remote meta folder, every
+        chunk is checked by MD5 on remote host and verified offset is
+        saved in state ("transfers" section). After disconnect upload is
+        resumed from the last verified chunk, also in next sync cycle.
+        Partial file is moved into place only after full hash is verified.
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            Optional[Union[bool, None]]: True or False, None if file is smaller than "resume_min_size".
+        '''
+        min_size = self.getOption('resume_min_size')
+        st = os.stat(filepath)
+        if (not min_size) or st.st_size < min_size:
+            return None
+        remote_path = self.getRemotePath(filepath)
+        partial = self.getPartialRemotePath(remote_path)
+        key = f'upload:{remote_path}'
+        checkpoint = self.state.get('transfers', key)
+        if checkpoint and checkpoint['size'] == st.st_size and checkpoint['mtime_ns'] == st.st_mtime_ns:
+            self.log.info(f'"uploadResumable": Resuming upload of file ({filepath}) from {checkpoint["offset"]} bytes.')
+        else:
+            checkpoint = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'offset': 0}
+        if (not self.runResumable('uploadResumable', self._uploadChunks, filepath, partial, key, checkpoint)):
+            self.log.error(f'"uploadResumable": Upload of file ({filepath}) failed at {checkpoint["offset"]} bytes.')
+            return False
+        algorithm = self.getRemoteHashAlgorithm()
+        res = self.connection.execCommand(
+            f'{REMOTE_HASH_COMMANDS[algorithm]} {shlex.quote(partial)}')
+        if res is None or res[2] != 0 or (not res[0].split()):
+            self.log.error(f'"uploadResumable": Can\'t check uploaded file ({filepath}).')
+            return False
+        self.state.delete('transfers', key)
+        if formatDigest(algorithm, res[0].split()[0].decode()) != self.getHash(filepath, algorithm):
+            self.log.error(f'"uploadResumable": Uploaded file ({filepath}) hash verification is failed.')
+            self.connection.execCommand(f'rm -f {shlex.quote(partial)}')
+            return False
+        res = self.connection.execCommand(f'mv -f {shlex.quote(partial)} {shlex.quote(remote_path)}')
+        if res is None or res[2] != 0:
+            self.log.error(f'"uploadResumable": Can\'t move uploaded file ({filepath}) into place.')
+            return False
+        self.log.info(f'"uploadResumable": File ({filepath}) is uploaded.')
+        return True
+
+    def _uploadChunks(self, filepath: str, partial: str, key: str, checkpoint: dict) -> bool:
+        '''Send chunks of file from checkpoint offset over one channel.
+
+        Remote command cuts partial file to checkpoint offset (shorter
+        file is kept), prints offset it resumes from, then appends chunks
+        from stdin and prints MD5 of every chunk read back from partial
+        file. Chunks are streamed without waiting for digests, checkpoint
+        is moved when digest of chunk arrives, so resuming costs one round
+        trip, not one per chunk.
+        '''
+        size = checkpoint['size']
+        chunk_size = self.getOption('resume_chunk_size')
+        quoted = shlex.quote(partial)
+        chan = self.connection.openChannel()
+        if chan is None:
+            return False
+        pending = collections.deque()
+        try:
+            chan.exec_command(
+                f'mkdir -p {shlex.quote(partial.rsplit("/", 1)[0])} || exit 1; '
+                f'offset=$(stat -c %s {quoted} 2>/dev/null || echo 0); '
+                f'[ "$offset" -gt {int(checkpoint["offset"])} ] && offset={int(checkpoint["offset"])}; '
+                f'truncate -s "$offset" {quoted} && echo "$offset" || exit 1; '
+                f'while [ "$offset" -lt {int(size)} ]; do '
+                f'n=$(({int(size)} - offset)); [ "$n" -gt {int(chunk_size)} ] && n={int(chunk_size)}; '
+                f'head -c "$n" >> {quoted} && tail -c +$((offset + 1)) {quoted} | md5sum || exit 1; '
+                f'offset=$((offset + n)); done')
+            out = chan.makefile('rb')
+            line = out.readline().strip()
+            if (not line.isdigit()):
+                return False
+            offset = checkpoint['offset'] = int(line)
+            with open(filepath, 'rb') as f:
+                f.seek(offset)
+                while offset < size:
+                    length = min(chunk_size, size - offset)
+                    hasher = hashlib.md5()
+                    left = length
+                    while left > 0:
+                        data = f.read(min(left, 256 * 1024))
+                        if (not data):
+                            self.log.error(f'"uploadResumable": File ({filepath}) is truncated while uploading.')
+                            return False
+                        hasher.update(data)
+                        chan.sendall(data)
+                        left -= len(data)
+                    pending.append((length, hasher.hexdigest()))
+                    offset += length
+                    while pending and chan.recv_ready():
+                        if (not self._confirmChunk(filepath, out.readline(), pending, key, checkpoint)):
+                            return False
+            chan.shutdown_write()
+            while pending:
+                if (not self._confirmChunk(filepath, out.readline(), pending, key, checkpoint)):
                     return False
+            return chan.recv_exit_status() == 0
+        except Exception as e:
+            self.log.warning(f'"uploadResumable": Upload of file ({filepath}) is interrupted: {str(e)}')
+            return False
+        finally:
+            chan.close()
+
+    def _confirmChunk(self, filepath: str, line: bytes, pending: collections.deque, key: str, checkpoint: dict) -> bool:
+        '''Check digest line of the oldest sent chunk and move checkpoint after it.
+        '''
+        length, expected = pending.popleft()
+        if line.split()[:1] != [expected.encode()]:
+            self.log.warning(f'"uploadResumable": Chunk at {checkpoint["offset"]} of file ({filepath}) is not verified.')
+            return False
+        checkpoint['offset'] += length
+        self.state.set('transfers', key, dict(checkpoint))
+        return True
+
+    def downloadResumable(self, filepath: str) -> Optional[Union[bool, None]]:
+        '''Download large file by verified chunks.
+
+        Chunks are written to "<filepath>.filesync-part", every chunk is
+        checked by MD5 calculated on remote host while sending it and
+        verified offset is saved in state ("transfers" section). After
+        disconnect download is resumed from the last verified chunk, also
+        in next sync cycle. Partial file is renamed into place only after
+        full hash is verified.
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            Optional[Union[bool, None]]: True or False, None if file is smaller than "resume_min_size".
+        '''
+        min_size = self.getOption('resume_min_size')
+        if (not min_size):
+            return None
+        remote_path = self.getRemotePath(filepath)
+        algorithm = self.getRemoteHashAlgorithm()
+        entry = (self.remote_manifest or {}).get(remote_path)
+        if entry is not None and entry['hash'] and self.remote_manifest_algorithm == algorithm:
+            size, hash = entry['size'], entry['hash']
+        else:
+            # Remote file is hashed only if it is big enough for resumable download.
+            res = self.connection.execCommand(
+                f'size=$(stat -c %s {shlex.quote(remote_path)}) && echo "$size" && '
+                f'if [ "$size" -ge {int(min_size)} ]; then {REMOTE_HASH_COMMANDS[algorithm]} {shlex.quote(remote_path)}; fi')
+            if res is None or res[2] != 0:
+                return None
+            fields = res[0].split()
+            if len(fields) < 2:
+                return None
+            size, hash = int(fields[0]), formatDigest(algorithm, fields[1].decode())
+        if size < min_size:
+            return None
+        partial = f'{filepath}{PARTIAL_SUFFIX}'
+        key = f'download:{filepath}'
+        checkpoint = self.state.get('transfers', key)
+        if checkpoint and checkpoint['size'] == size and checkpoint['hash'] == hash and os.path.exists(partial):
+            self.log.info(f'"downloadResumable": Resuming download of file ({filepath}) from {checkpoint["offset"]} bytes.')
+        else:
+            checkpoint = {'size': size, 'hash': hash, 'offset': 0}
+        if (not self.runResumable('downloadResumable', self._downloadChunks, remote_path, partial, key, checkpoint)):
+            self.log.error(f'"downloadResumable": Download of file ({filepath}) failed at {checkpoint["offset"]} bytes.')
+            return False
+        self.state.delete('transfers', key)
+        if formatDigest(algorithm, self.hashFile(partial, algorithm, size)) != hash:
+            self.log.error(f'"downloadResumable": Downloaded file ({filepath}) hash verification is failed.')
+            os.remove(partial)
+            return False
+        os.replace(partial, filepath)
+        self.log.info(f'"downloadResumable": File ({filepath}) is downloaded.')
+        return True
+
+    def _downloadChunks(self, remote_path: str, partial: str, key: str, checkpoint: dict) -> bool:
+        '''Receive chunks of remote file from checkpoint offset over one channel.
+
+        Remote command sends the rest of file to stdout chunk by chunk and
+        prints MD5 of every chunk to stderr. Chunk is written to partial
+        file while it's received and checkpoint is moved when its digest
+        matches, so resuming costs one round trip, not one per chunk.
+        '''
+        size = checkpoint['size']
+        chunk_size = self.getOption('resume_chunk_size')
+        fd = os.open(partial, os.O_RDWR | os.O_CREAT, 0o644)
+        with open(fd, 'r+b') as f:
+            offset = checkpoint['offset'] = min(checkpoint['offset'], os.fstat(fd).st_size)
+            f.truncate(offset)
+            f.seek(offset)
+            chan = self.connection.openChannel()
+            if chan is None:
+                return False
+            try:
+                chan.exec_command(
+                    f'offset={int(offset)}; while [ "$offset" -lt {int(size)} ]; do '
+                    f'n=$(({int(size)} - offset)); [ "$n" -gt {int(chunk_size)} ] && n={int(chunk_size)}; '
+                    f'{{ tail -c +$((offset + 1)) {shlex.quote(remote_path)} | head -c "$n" | '
+                    f'tee /dev/fd/3 | md5sum >&2; }} 3>&1 || exit 1; '
+                    f'offset=$((offset + n)); done')
+                out = chan.makefile('rb')
+                err = chan.makefile_stderr('rb')
+                while offset < size:
+                    length = min(chunk_size, size - offset)
+                    hasher = hashlib.md5()
+                    left = length
+                    while left > 0:
+                        data = out.read(min(left, 256 * 1024))
+                        if (not data):
+                            self.log.warning(f'"downloadResumable": Chunk at {offset} of file ({remote_path}) is truncated.')
+                            return False
+                        hasher.update(data)
+                        f.write(data)
+                        left -= len(data)
+                    if err.readline().split()[:1] != [hasher.hexdigest().encode()]:
+                        self.log.warning(f'"downloadResumable": Chunk at {offset} of file ({remote_path}) is corrupted.')
+                        return False
+                    f.flush()
+                    os.fsync(f.fileno())
+                    offset += length
+                    checkpoint['offset'] = offset
+                    self.state.set('transfers', key, dict(checkpoint))
+                return chan.recv_exit_status() == 0
+            except Exception as e:
+                self.log.warning(f'"downloadResumable": Download of file ({remote_path}) is interrupted: {str(e)}')
+                return False
+            finally:
+                chan.close()
+
+    def uploadCAS(self, filepath: str) -> Optional[Union[bool, None]]:
+        '''Upload file to content-addressed chunk store.
+
+        File is split into content-defined chunks, only chunks which are
+        not in remote store index are sent, then remote file is assembled
+        from them and chunks of stored objects. Same chunks of other files
+        and older versions are not sent again, same content is kept on
+        remote host once (see cas.py). If indexed chunks are gone from
+        store, upload is retried once with them sent too.
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            Optional[Union[bool, None]]: True or False, None if chunk store can't be used.
+        '''
+        import cas
+
+        helper = self.deployRemoteHelper('cas.py')
+        if helper is None:
+            return None
+        chunks = cas.chunkFile(filepath, self.getOption('cas_chunk_size'))
+        digests = list(dict.fromkeys(digest for digest, _, _ in chunks))
+        store = shlex.quote(self.CAS_PATH)
+        res = self.connection.execCommand(
+            f'python3 {shlex.quote(helper)} missing {store}', ''.join(f'{digest}\n' for digest in digests).encode())
+        if res is None or res[2] != 0:
+            self.log.error(f'"uploadCAS": Can\'t query chunk store for file ({filepath}).')
+            return False
+        missing = set(res[0].decode().split())
+        for attempt in range(2):
+            res = self._putCAS(filepath, helper, chunks, missing)
+            if res is None:
+                return False
+            stdout, stderr, status, sent = res
+            if status == cas.MISSING_STATUS and attempt == 0:
+                self.log.warning(f'"uploadCAS": Stored chunks of file ({filepath}) are gone, sending them.')
+                missing.update(stdout.decode().split())
+                continue
+            break
+        if status != 0:
+            self.log.error(f'"uploadCAS": Remote chunk store failed: {stderr}')
+            return False
+        total = sum(size for _, _, size in chunks)
+        self.metrics.inc('cas_bytes_sent', sent)
+        self.metrics.inc('cas_bytes_deduplicated', total - sent)
+        self.log.info(
+            f'"uploadCAS": File ({filepath}) is uploaded to chunk store: '
+            f'{sent} of {total} bytes sent, {len(chunks)} chunks.')
+        return True
+
+    def _putCAS(self, filepath: str, helper: str, chunks: list, missing: set) -> Optional[Union[tuple, None]]:
+        '''Send missing chunks and manifest of file to remote store.
+
+        Returns:
+            Optional[Union[tuple, None]]: stdout, stderr, exit status and sent bytes or None.
+        '''
+        import cas
+
+        chan = self.connection.openChannel()
+        if chan is None:
+            return None
+        sent = 0
+        unsent = set(missing)
+        try:
+            chan.exec_command(
+                f'python3 {shlex.quote(helper)} put {shlex.quote(self.CAS_PATH)} '
+                f'{shlex.quote(self.getRemotePath(filepath))}')
+            out = chan.makefile('wb')
+            with open(filepath, 'rb') as f:
+                for digest, offset, size in chunks:
+                    if digest in unsent:
+                        unsent.discard(digest)
+                        f.seek(offset)
+                        cas.writeFrame(out, digest, f.read(size))
+                        sent += size
+            cas.writeEnd(out)
+            out.write(cas.makeManifest(chunks, self.getOption('cas_chunk_size')))
+            out.flush()
+            chan.shutdown_write()
+            stdout = chan.makefile('rb').read()
+            status = chan.recv_exit_status()
+            stderr = chan.makefile_stderr('rb').read().decode(errors='replace')
+        except Exception as e:
+            self.log.error(f'"uploadCAS": Upload of file ({filepath}) failed: {str(e)}')
+            return None
+        finally:
+            chan.close()
+        return stdout, stderr, status, sent
+
+    def downloadCAS(self, filepath: str) -> Optional[Union[bool, None]]:
+        '''Download file from content-addressed chunk store.
+
+        Chunks which are in current local copy of file are taken from it,
+        only other chunks are received. Every chunk is checked by its
+        digest, file is written to temp file and renamed into place.
+        Remote file changed without chunk store is chunked on remote host.
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            Optional[Union[bool, None]]: True or False, None if chunk store can't be used.
+        '''
+        import cas
+
+        helper = self.deployRemoteHelper('cas.py')
+        if helper is None:
+            return None
+        have = {}
+        if os.path.isfile(filepath):
+            for digest, offset, _ in cas.chunkFile(filepath, self.getOption('cas_chunk_size')):
+                have.setdefault(digest, offset)
+        chan = self.connection.openChannel()
+        if chan is None:
+            return False
+        temp_path = f'{filepath}.{self.getTempFileName()}'
+        received = reused = 0
+        try:
+            chan.exec_command(
+                f'python3 {shlex.quote(helper)} get {shlex.quote(self.CAS_PATH)} '
+                f'{shlex.quote(self.getRemotePath(filepath))} {self.getOption("cas_chunk_size")}')
+            chan.sendall(''.join(f'{digest}\n' for digest in have).encode())
+            chan.shutdown_write()
+            src = chan.makefile('rb')
+            header = json.loads(src.readline() or b'null')
+            if header is None:
+                raise IOError(chan.makefile_stderr('rb').read().decode(errors='replace'))
+            with open(temp_path, 'w+b') as f:
+                received, reused = self._receiveChunks(filepath, header['manifest'], have, src, f)
+            status = chan.recv_exit_status()
+            if status != 0:
+                raise IOError(chan.makefile_stderr('rb').read().decode(errors='replace'))
+            os.replace(temp_path, filepath)
+        except Exception as e:
+            self.log.error(f'"downloadCAS": Download of file ({filepath}) failed: {str(e)}')
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+        finally:
+            chan.close()
+        self.metrics.inc('cas_bytes_received', received)
+        self.metrics.inc('cas_bytes_reused', reused)
+        self.log.info(
+            f'"downloadCAS": File ({filepath}) is downloaded: {received} bytes received, {reused} bytes reused.')
+        return True
+
+    def _receiveChunks(self, filepath: str, manifest: dict, have: dict, src, f) -> tuple:
+        '''Assemble file from manifest: local chunks, received frames and
+        chunks already written to f.
+
+        Returns:
+            tuple: received and reused bytes.
+        '''
+        import cas
+
+        frames = cas.iterFrames(src)
+        written = {}
+        received = reused = 0
+        old = open(filepath, 'rb') if have else None
+        try:
+            for digest, size in manifest['chunks']:
+                if digest in written:
+                    position = f.tell()
+                    f.seek(written[digest])
+                    data = f.read(size)
+                    f.seek(position)
+                elif digest in have:
+                    old.seek(have[digest])
+                    data = old.read(size)
+                    reused += size
+                else:
+                    frame_digest, data = next(frames)
+                    if frame_digest != digest:
+                        raise IOError(f'unexpected chunk {frame_digest}')
+                    received += size
+                if hashlib.sha256(data).hexdigest() != digest:
+                    raise IOError(f'chunk {digest} is corrupted')
+                written.setdefault(digest, f.tell())
+                f.write(data)
+        finally:
+            if old is not None:
+                old.close()
+        if f.tell() != manifest['size']:
+            raise IOError(f'file size {f.tell()} differs from manifest size {manifest["size"]}')
+        return received, reused
+
+    def sweepCAS(self) -> bool:
+        '''Remove manifests of deleted or changed remote files and unused objects from chunk store.
+
+        Runs at most once per "cas_sweep_interval" seconds, leftovers of
+        interrupted uploads are removed too.
+
+        Returns:
+            bool: True if sweep is done or not due, False on error.
+        '''
+        interval = self.getOption('cas_sweep_interval')
+        if (not interval) or time.monotonic() < self.next_cas_sweep:
+            return True
+        helper = self.deployRemoteHelper('cas.py')
+        if helper is None:
+            return False
+        self.next_cas_sweep = time.monotonic() + interval
+        res = self.connection.execCommand(f'python3 {shlex.quote(helper)} sweep {shlex.quote(self.CAS_PATH)}')
+        if res is None or res[2] != 0:
+            self.log.error(f'"sweepCAS": Chunk store sweep failed: {res[1].decode(errors="replace") if res else ""}')
+            return False
+        result = json.loads(res[0])
+        self.metrics.inc('cas_bytes_swept', result['freed'])
+        self.log.info(
+            f'"sweepCAS": {result["removed"]} unused files ({result["freed"]} bytes) removed, '
+            f'{result["manifests"]} files in store.')
+        return True
+
+    def getBatchCommand(self, command: str) -> Optional[Union[str, None]]:
+        '''Returns remote command of batch helper, deploying it if needed.
+
+        Args:
+            command (str): "extract" or "create".
+
+        Returns:
+            Optional[Union[str, None]]: shell command or None if helper can't be deployed.
+        '''
+        for filename in ('hashing.py', 'batch.py'):
+            if self.deployRemoteHelper(filename) is None:
+                return None
+        meta = self.META_PATH[len(self.REMOTE_PATH) + 1:]
+        return (
+            f'cd {shlex.quote(self.REMOTE_PATH)} && python3 {shlex.quote(meta)}/batch.py {command} '
+            f'--algorithm {self.getRemoteHashAlgorithm()} --temp {shlex.quote(meta)}/incoming .'
+        )
+
+    def setBatchResult(self, file: str, local_digest: str, entry: dict) -> None:
+        '''Save hashes of file transferred in batch or stream.
+
+        Args:
+            file (str): local file path.
+            local_digest (str): local hash in config format.
+            entry (dict): remote manifest entry.
+        '''
+        remote_path = self.getRemotePath(file)
+        self.setLocalHash(file, local_digest)
+        self.setRemoteManifestEntry(remote_path, entry)
+        self.setRemoteHash(remote_path, entry['hash'])
+
+    def uploadBatch(self, files: list) -> dict:
+        '''Upload small files as one tar stream.
+
+        Files are hashed while they are sent, remote helper hashes them
+        while they are written, so hashes are verified without reading
+        files again.
+
+        Args:
+            files (list): local file paths.
+
+        Returns:
+            dict: {file: True} for uploaded and verified files.
+        '''
+        import batch
+
+        command = self.getBatchCommand('extract')
+        if command is None:
+            return {}
+        chan = self.connection.openChannel()
+        if chan is None:
+            return {}
+        local_algorithm = self.getOption('hash_algorithm')
+        remote_algorithm = self.getRemoteHashAlgorithm()
+        names = {}
+        sent = {}
+        try:
+            chan.exec_command(command)
+            out = chan.makefile('wb')
+            with tarfile.open(fileobj=out, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                for file in files:
+                    name = self.getRemotePath(file)[len(self.REMOTE_PATH) + 1:]
+                    res = batch.addFile(tar, file, name, {local_algorithm, remote_algorithm})
+                    if res is None:
+                        self.log.warning(f'"uploadBatch": Can\'t read file ({file}).')
+                        continue
+                    names[name] = file
+                    sent[file] = res[0]
+            out.flush()
+            chan.shutdown_write()
+            lines = chan.makefile('rb').read().splitlines()
+            status = chan.recv_exit_status()
+            stderr = chan.makefile_stderr('rb').read().decode(errors='replace')
+        except Exception as e:
+            self.log.error(f'"uploadBatch": Batch upload failed: {str(e)}')
+            return {}
+        finally:
+            chan.close()
+        if status != 0:
+            self.log.error(f'"uploadBatch": Remote extraction failed: {stderr}')
+        results = {}
+        for line in lines:
+            event = json.loads(line)
+            file = names.get(event['path'])
+            if file is None:
+                continue
+            if (not secure_compare(event['hash'], sent[file][remote_algorithm])):
+                self.log.error(f'"uploadBatch": File ({file}) hash mismatch after upload.')
+                continue
+            entry = {
+                'hash': formatDigest(remote_algorithm, event['hash']),
+                'size': event['size'],
+                'mtime': event['mtime']
+            }
+            self.setBatchResult(file, formatDigest(local_algorithm, sent[file][local_algorithm]), entry)
+            results[file] = True
+        self.log.info(f'"uploadBatch": {len(results)} of {len(files)} files are uploaded in batch.')
+        return results
+
+    def downloadBatch(self, files: list) -> dict:
+        '''Download small files as one tar stream.
+
+        Files are hashed while they are received and checked with hashes
+        from remote helper, verified files are renamed into place.
+
+        Args:
+            files (list): local file paths.
+
+        Returns:
+            dict: {file: True} for downloaded and verified files.
+        '''
+        import batch
+
+        command = self.getBatchCommand('create')
+        if command is None:
+            return {}
+        chan = self.connection.openChannel()
+        if chan is None:
+            return {}
+        local_algorithm = self.getOption('hash_algorithm')
+        remote_algorithm = self.getRemoteHashAlgorithm()
+        names = {self.getRemotePath(file)[len(self.REMOTE_PATH) + 1:]: file for file in files}
+        received = {}
+        entries = {}
+        try:
+            chan.exec_command(command)
+            chan.sendall(''.join(f'{name}\n' for name in names).encode())
+            chan.shutdown_write()
+            with tarfile.open(fileobj=chan.makefile('rb'), mode='r|') as tar:
+                for member in tar:
+                    if member.name == batch.MANIFEST_NAME:
+                        entries = json.loads(tar.extractfile(member).read())
+                        continue
+                    file = names.get(member.name)
+                    if file is None or (not member.isfile()):
+                        raise IOError(f'unexpected member: {member.name}')
+                    if os.path.dirname(file):
+                        os.makedirs(os.path.dirname(file), exist_ok=True)
+                    temp_path = f'{file}.{self.getTempFileName()}'
+                    # Registered before extraction, so partial file is removed on failure.
+                    received[file] = (temp_path, {})
+                    received[file] = (temp_path, batch.extractFile(
+                        tar, member, temp_path, {local_algorithm, remote_algorithm}))
+            status = chan.recv_exit_status()
+            if status != 0:
+                raise IOError(chan.makefile_stderr('rb').read().decode(errors='replace'))
+        except Exception as e:
+            self.log.error(f'"downloadBatch": Batch download failed: {str(e)}')
+            entries = {}
+        finally:
+            chan.close()
+        results = {}
+        for name, file in names.items():
+            if file not in received:
+                continue
+            temp_path, digests = received[file]
+            event = entries.get(name)
+            if event is None or (not secure_compare(event['hash'], digests[remote_algorithm])):
+                if entries:
+                    self.log.error(f'"downloadBatch": File ({file}) hash mismatch after download.')
+                os.remove(temp_path)
+                continue
+            os.replace(temp_path, file)
+            entry = {
+                'hash': formatDigest(remote_algorithm, event['hash']),
+                'size': event['size'],
+                'mtime': event['mtime']
+            }
+            self.setBatchResult(file, formatDigest(local_algorithm, digests[local_algorithm]), entry)
+            results[file] = True
+        self.log.info(f'"downloadBatch": {len(results)} of {len(files)} files are downloaded in batch.')
+        return results
+
+    def queueBatch(self, direction: str, file: str) -> bool:
+        '''Add small file to batch of current sync cycle.
+
+        Args:
+            direction (str): "upload" or "download".
+            file (str): local file path.
+
+        Returns:
+            bool: True if file is queued, it's transferred when batch is flushed.
+        '''
+        max_size = self.getOption('batch_max_size')
+        if (not max_size) or self.getOption('storage') == 'cas':
+            return False
+        if direction == 'upload':
+            size = os.path.getsize(file)
         else:
-            self.log.critical('"download": Can\'t take SCPClient.')
+            entry = (self.remote_manifest or {}).get(self.getRemotePath(file))
+            size = entry['size'] if entry else None
+        if size is None or size > max_size:
+            return False
+        with self._batch_lock:
+            if self.batch is None:
+                return False
+            self.batch[direction].append(file)
+        self.log.debug(f'"queueBatch": File ({file}) is queued for batch {direction}.')
+        return True
+
+    def flushBatches(self) -> dict:
+        '''Transfer files queued in sync cycle, one batch per direction.
+
+        Files which are not transferred in batch (too few files, helper
+        is not available, failed verification) are transferred one by one.
+
+        Returns:
+            dict: {file: transferred}.
+        '''
+        with self._batch_lock:
+            pending, self.batch = self.batch, None
+        results = {}
+        for direction, files in (pending or {}).items():
+            if (not files):
+                continue
+            done = {}
+            if len(files) >= self.getOption('batch_min_files'):
+                started = time.monotonic()
+                with self.metrics.timer(f'batch_{direction}'):
+                    done = self.uploadBatch(files) if direction == 'upload' else self.downloadBatch(files)
+                elapsed = time.monotonic() - started
+                for file in done:
+                    self.engine.record(os.path.getsize(file), elapsed / len(done))
+                self.metrics.inc(f'{direction}s_batch', len(done))
+            results.update(done)
+            rest = [file for file in files if file not in done]
+            job = self.pushFile if direction == 'upload' else self.pullFile
+            results.update(zip(rest, self.engine.run(job, rest)))
+        return results
+
+    def uploadStream(self, filepath: str) -> Optional[Union[bool, None]]:
+        '''Upload file in one remote command, verifying hashes in the same pass.
+
+        Local file is hashed while it's sent, remote hash command reads
+        the same stream through tee while it's written to temp file in
+        remote meta folder, so hashes are saved (also in fingerprint cache)
+        without reading file again. Temp file is renamed into place only
+        if its size is the size of sent data.
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            Optional[Union[bool, None]]: True or False, None if stream transfer is off or channel can't be opened.
+        '''
+        if self.getOption('storage') == 'cas' or (not self.isStreamVerify()):
+            return None
+        local_algorithm = self.getOption('hash_algorithm')
+        hashers = {algorithm: newHasher(algorithm) for algorithm in {local_algorithm, self.getRemoteHashAlgorithm()}}
+        chan = None
+        try:
+            with open(filepath, 'rb') as f:
+                st = os.fstat(f.fileno())
+                chan = self.openUploadStream(filepath, st.st_size, True)
+                if chan is None:
+                    return None
+                left = st.st_size
+                while left > 0:
+                    data = f.read(min(left, 256 * 1024))
+                    if not data:
+                        break
+                    for hasher in hashers.values():
+                        hasher.update(data)
+                    chan.sendall(data)
+                    left -= len(data)
+            if (not self.finishUploadStream(filepath, chan, hashers, st)):
+                return False
+        except Exception as e:
+            self.log.error(f'"uploadStream": Upload of file ({filepath}) failed: {str(e)}')
+            return False
+        finally:
+            if chan is not None:
+                chan.close()
+        with self._verified_lock:
+            self.stream_verified.add(filepath)
+        return True
+
+    def openUploadStream(self, filepath: str, size: int, verify: bool) -> Optional[Union['Channel', None]]:
+        '''Open channel writing file sent to it into its remote path.
+
+        Data is written to temp file in remote meta folder, renamed into
+        place if its size is the size of file. With verify remote hash
+        command reads the same stream through tee and hash, size and mtime
+        of written file are sent back (needs GNU stat and find, see
+        isStreamVerify), see finishUploadStream. Used by uploadStream and
+        by FanOut, which sends file read once to channels of all remotes.
+
+        Args:
+            filepath (str): local file path.
+            size (int): file size.
+            verify (bool): hash written file on remote host.
+
+        Returns:
+            Optional[Union[Channel, None]]: channel or None if it can't be opened.
+        '''
+        remote_path = shlex.quote(self.getRemotePath(filepath))
+        temp_path = shlex.quote(f'{self.META_PATH}/{self.getTempFileName()}')
+        chan = self.connection.openChannel()
+        if chan is None:
+            return None
+        if verify:
+            chan.exec_command(
+                f'mkdir -p {shlex.quote(self.META_PATH)} && {{ tee {temp_path} | {REMOTE_HASH_COMMANDS[self.getRemoteHashAlgorithm()]}; }} && '
+                f'[ "$(stat -c %s {temp_path})" = {size} ] && mv {temp_path} {remote_path} && '
+                f'find {remote_path} -printf \'%s %T@\\n\' || {{ rm -f {temp_path}; exit 1; }}')
+        else:
+            chan.exec_command(
+                f'mkdir -p {shlex.quote(self.META_PATH)} && cat > {temp_path} && '
+                f'[ "$(wc -c < {temp_path})" -eq {size} ] && mv {temp_path} {remote_path} || {{ rm -f {temp_path}; exit 1; }}')
+        return chan
+
+    def finishUploadStream(self, filepath: str, chan: 'Channel', hashers: dict,
+                           st: Optional[os.stat_result] = None) -> bool:
+        '''Wait for upload opened by openUploadStream and save hashes.
+
+        Verified upload saves hashes from hashers (hash algorithm and
+        remote hash algorithm) and remote output, without rereading file,
+        other hashes are taken by updateLocalHash and updateRemoteHash.
+
+        Args:
+            filepath (str): local file path.
+            chan (Channel): channel with all data sent.
+            hashers (dict): {algorithm: hasher} fed with sent data, empty if upload isn't verified.
+            st (Optional[os.stat_result]): stat of file when it was opened, hash is cached for it.
+
+        Raises:
+            IOError: remote command failed.
+
+        Returns:
+            bool: True or False if hash of written file differs.
+        '''
+        chan.shutdown_write()
+        out = chan.makefile('rb').read().split()
+        status = chan.recv_exit_status()
+        if status != 0 or (hashers and len(out) != 4):
+            raise IOError(chan.makefile_stderr('rb').read().decode(errors='replace') or f'exit status {status}')
+        if (not hashers):
+            self.updateLocalHash(filepath)
+            self.updateRemoteHash(filepath)
+            self.log.info(f'"finishUploadStream": File ({filepath}) is uploaded.')
+            return True
+        local_algorithm = self.getOption('hash_algorithm')
+        remote_algorithm = self.getRemoteHashAlgorithm()
+        digest, remote_size, mtime = out[0].decode(), int(out[2]), out[3].decode()
+        if (not secure_compare(digest, hashers[remote_algorithm].hexdigest())):
+            self.log.error(f'"finishUploadStream": File ({filepath}) hash mismatch after upload.')
+            return False
+        entry = {'hash': formatDigest(remote_algorithm, digest), 'size': remote_size, 'mtime': mtime}
+        self.setBatchResult(filepath, formatDigest(local_algorithm, hashers[local_algorithm].hexdigest()), entry)
+        if st is not None:
+            self.cacheHash(filepath, local_algorithm, hashers[local_algorithm].hexdigest(), st)
+        self.log.info(f'"finishUploadStream": File ({filepath}) is uploaded and verified.')
+        return True
+
+    def downloadStream(self, filepath: str) -> Optional[Union[bool, None]]:
+        '''Download file in one remote command, verifying hashes in the same pass.
+
+        Remote file is sent through tee to remote hash command, its size,
+        mtime and hash are sent to stderr. File is written to temp file
+        near filepath while it's hashed, and renamed into place if hashes
+        are equal. Downloaded file gets mtime of remote file, so its hash
+        is saved in fingerprint cache and next check doesn't reread it.
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            Optional[Union[bool, None]]: True or False, None if stream transfer is off or channel can't be opened.
+        '''
+        if self.getOption('storage') == 'cas' or (not self.isStreamVerify()):
+            return None
+        local_algorithm = self.getOption('hash_algorithm')
+        remote_algorithm = self.getRemoteHashAlgorithm()
+        remote_path = shlex.quote(self.getRemotePath(filepath))
+        chan = self.connection.openChannel()
+        if chan is None:
+            return None
+        temp_path = f'{filepath}.{self.getTempFileName()}'
+        hashers = {algorithm: newHasher(algorithm) for algorithm in {local_algorithm, remote_algorithm}}
+        received = 0
+        try:
+            chan.exec_command(
+                f'find {remote_path} -printf \'%s %T@\\n\' >&2 && '
+                f'{{ tee /dev/fd/3 < {remote_path} | {REMOTE_HASH_COMMANDS[remote_algorithm]} >&2; }} 3>&1')
+            with open(temp_path, 'wb') as f:
+                while True:
+                    data = chan.recv(256 * 1024)
+                    if not data:
+                        break
+                    for hasher in hashers.values():
+                        hasher.update(data)
+                    f.write(data)
+                    received += len(data)
+            status = chan.recv_exit_status()
+            err = chan.makefile_stderr('rb').read().split()
+            if status != 0 or len(err) != 4:
+                raise IOError(b' '.join(err).decode(errors='replace') or f'exit status {status}')
+            size, mtime, digest = int(err[0]), err[1].decode(), err[2].decode()
+            if size != received or (not secure_compare(digest, hashers[remote_algorithm].hexdigest())):
+                raise IOError('hash mismatch after download')
+            os.utime(temp_path, ns=(time.time_ns(), parseMTime(mtime)))
+            os.replace(temp_path, filepath)
+            st = os.stat(filepath)
+        except Exception as e:
+            self.log.error(f'"downloadStream": Download of file ({filepath}) failed: {str(e)}')
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+        finally:
+            chan.close()
+        entry = {'hash': formatDigest(remote_algorithm, digest), 'size': size, 'mtime': mtime}
+        self.setBatchResult(filepath, formatDigest(local_algorithm, hashers[local_algorithm].hexdigest()), entry)
+        self.cacheHash(filepath, local_algorithm, hashers[local_algorithm].hexdigest(), st)
+        with self._verified_lock:
+            self.stream_verified.add(filepath)
+        self.log.info(f'"downloadStream": File ({filepath}) is downloaded and verified.')
+        return True
+
+    def takeStreamVerified(self, filepath: str) -> bool:
+        '''Check that hashes of file are saved by its transfer (see uploadStream).
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            bool: True if hashes are saved, mark is removed.
+        '''
+        with self._verified_lock:
+            if filepath in self.stream_verified:
+                self.stream_verified.remove(filepath)
+                return True
+            return False
+
+    def getBackend(self) -> TransferBackend:
+        '''Returns whole-file transfer backend from "transfer_backend" option.
+
+        With "auto" backend and channel window (if "ssh_window_size" is
+        not set) are taken from throughput probe of remote host.
+
+        Returns:
+            TransferBackend: backend.
+        '''
+        with self._backend_lock:
+            if self.backend is None:
+                name = self.getOption('transfer_backend')
+                if name == 'auto':
+                    probe = self.probeTransfer()
+                    name = probe['backend']
+                    self.connection.setWindowSize(self.getOption('ssh_window_size') or probe['window_size'])
+                if name == 'sftp':
+                    self.connection.execCommand(f'mkdir -p {shlex.quote(self.META_PATH)}')
+                self.backend = createBackend(
+                    name,
+                    self.connection,
+                    self.getOption('sftp_prefetch_requests'),
+                    self.META_PATH
+                )
+                self.log.info(f'"getBackend": Using {self.backend.name} transfer backend.')
+            return self.backend
+
+    def probeTransfer(self) -> dict:
+        '''Returns the fastest backend and channel window for remote host.
+
+        Probe file of "probe_size" random bytes is uploaded and downloaded
+        by every candidate once per host, result is saved in state
+        ("probe" section).
+
+        Returns:
+            dict: {"backend", "window_size", "rates"}.
+        '''
+        key = f'{self.config["hostname"]}:{self.config["port"]}'
+        probe = self.state.get('probe', key)
+        if probe:
+            return probe
+        remote_path = f'{self.META_PATH}/probe'
+        fd, local_path = tempfile.mkstemp(prefix='sunc_temp_', dir=self.TEMP_PATH)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(os.urandom(self.getOption('probe_size')))
+            self.connection.execCommand(f'mkdir -p {shlex.quote(self.META_PATH)}')
+            probe = probeThroughput(
+                self.connection,
+                local_path,
+                remote_path,
+                self.getOption('ssh_window_size'),
+                self.META_PATH
+            )
+        finally:
+            os.remove(local_path)
+            self.connection.execCommand(f'rm -f {shlex.quote(remote_path)}')
+        self.log.info(
+            f'"probeTransfer": {probe["backend"]} with {probe["window_size"]} bytes window is the fastest for {key}, '
+            f'rates: { {name: formatRate(rate, 1) for name, rate in probe["rates"].items()} }')
+        if probe['rates']:
+            self.state.set('probe', key, probe)
+        return probe
+
+    def ensureRemoteDir(self, remote_path: str) -> bool:
+        '''Create parent folder of remote file if needed.
+
+        Args:
+            remote_path (str): remote file path.
+
+        Returns:
+            bool: True or False.
+        '''
+        directory = remote_path.rsplit('/', 1)[0]
+        if directory == self.REMOTE_PATH or directory in self.remote_dirs:
+            return True
+        res = self.connection.execCommand(f'mkdir -p {shlex.quote(directory)}')
+        if res is None or res[2] != 0:
+            self.log.error(f'"ensureRemoteDir": Can\'t create folder ({directory}) on remote host.')
+            return False
+        self.remote_dirs.add(directory)
+        return True
+
+    def isPlainUpload(self, filepath: str) -> bool:
+        '''Check that file is uploaded as it is: not by CAS, delta, resumable or compressed upload.
+
+        Such files are uploaded to all FanOut remotes by one read, see
+        FanOut.uploadFile.
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            bool: True or False.
+        '''
+        if self.getOption('storage') == 'cas' or self.getOption('transfer_mode') == 'delta':
+            return False
+        min_size = self.getOption('resume_min_size')
+        if min_size and os.path.getsize(filepath) >= min_size:
+            return False
+        return self.getCompressionCodec(filepath) is None
+
+    def upload(self, filepath: str) -> bool:
+        '''Upload filepath to remote.
+
+        Args:
+            filepath (str): file path to upload.
+        
+        Returns:
+            bool: True or False.
+        '''
+        if (not self.ensureRemoteDir(self.getRemotePath(filepath))):
+            return False
+        if self.getOption('storage') == 'cas':
+            res = self.uploadCAS(filepath)
+            if res is not None:
+                self.metrics.inc('uploads_cas')
+                return res
+        if self.getOption('transfer_mode') == 'delta':
+            res = self.uploadDelta(filepath)
+            if res is not None:
+                self.metrics.inc('uploads_delta')
+                return res
+        res = self.uploadResumable(filepath)
+        if res is not None:
+            self.metrics.inc('uploads_resumable')
+            return res
+        res = self.uploadCompressed(filepath)
+        if res is not None:
+            self.metrics.inc('uploads_compressed')
+            return res
+        res = self.uploadStream(filepath)
+        if res is not None:
+            self.metrics.inc('uploads_stream')
+            return res
+        backend = self.getBackend()
+        self.metrics.inc(f'uploads_{backend.name}')
+        try:
+            backend.put(filepath, self.getRemotePath(filepath))
+        except Exception as e:
+            self.log.error(f'"upload": Upload of file ({filepath}) by {backend.name} failed: {str(e)}')
+            return False
+        self.log.info(f'"upload": File ({str(filepath)}) is uploaded.')
+        return True
+
+    def download(self, filepath: str) -> bool:
+        '''Download file to LOCAL_PATH.
+
+        Args:
+            filepath (str): file path.
+
+        Returns:
+            bool: True or False.
+        '''
+        if os.path.dirname(filepath):
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        if self.getOption('storage') == 'cas':
+            res = self.downloadCAS(filepath)
+            if res is not None:
+                self.metrics.inc('downloads_cas')
+                return res
+        if self.getOption('transfer_mode') == 'delta':
+            res = self.downloadDelta(filepath)
+            if res is not None:
+                self.metrics.inc('downloads_delta')
+                return res
+        res = self.downloadResumable(filepath)
+        if res is not None:
+            self.metrics.inc('downloads_resumable')
+            return res
+        res = self.downloadCompressed(filepath)
+        if res is not None:
+            self.metrics.inc('downloads_compressed')
+            return res
+        res = self.downloadStream(filepath)
+        if res is not None:
+            self.metrics.inc('downloads_stream')
+            return res
+        backend = self.getBackend()
+        self.metrics.inc(f'downloads_{backend.name}')
+        remote_filepath = self.getRemotePath(filepath)
+        temp_path = f'{filepath}.{self.getTempFileName()}'
+        try:
+            backend.get(remote_filepath, temp_path)
+            os.replace(temp_path, filepath)
+        except Exception as e:
+            self.log.error(f'"download": Can\'t get file ({remote_filepath}) by {backend.name}: {str(e)}.')
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
             return False
+        else:
+            if os.path.exists(filepath):
+                self.log.info(
+                    f'"download": File ({filepath}) is downloaded!')
+                return True
+            else:
+                self.log.error(
+                    f'"download": Can\'t found downloaded file: {filepath}.')
+                return False
 
     def checkRemoteFile(self, filepath: str) -> bool:
         '''Check hash for remote file.
@@ -346,31 +2555,39 @@ class FileSync:
         Returns:
             bool: True or False.
         '''
-        ssh = self.getSSHClient()
-        if ssh:
-            remote_path = f'{self.REMOTE_PATH}/{filepath.split(os.path.sep)[::-1][0]}'
-            _, stdout, stderr = ssh.exec_command(f'md5sum {remote_path}')
-            ssh.close()
-            stdout = stdout.read().decode()
-            stderr = stderr.read().decode()
+        remote_path = self.getRemotePath(filepath)
+        stored_hash = self.state.get('remote_hashes', remote_path)
+        algorithm = parseDigest(stored_hash)[0] if stored_hash else self.getRemoteHashAlgorithm()
+        if self.remote_manifest is not None and self.remote_manifest_algorithm == algorithm:
+            entry = self.remote_manifest.get(remote_path)
+            if entry is None:
+                self.log.error(f'"checkRemoteFile": File ({remote_path}) not found on remote host.')
+                return False
+            res = (f'{parseDigest(entry["hash"])[1]}  {remote_path}'.encode(), b'', 0)
+        else:
+            with self.metrics.timer('remote_hash'):
+                res = self.connection.execCommand(f'{REMOTE_HASH_COMMANDS.get(algorithm, "md5sum")} {shlex.quote(remote_path)}')
+        if res:
+            stdout = res[0].decode()
+            stderr = res[1].decode()
             if stderr:
                 self.log.error(f'"checkRemoteFile": File check error: {str(stderr)}')
                 return False
             if stdout:
-                hash = stdout.split()[0]
-                if self.config['remote_hashes'] and self.config["remote_hashes"][remote_path]:
+                hash = formatDigest(algorithm, stdout.split()[0])
+                if stored_hash:
                     self.log.debug(
-                        f'"checkRemoteFile": File ({filepath}) MD5 hash: {self.getMD5(filepath)}')
+                        f'"checkRemoteFile": File ({filepath}) remote hash: {hash}')
                     self.log.debug(
-                        f'"checkRemoteFile": File ({filepath}) Local MD5 hash: {self.config["remote_hashes"][remote_path]}')
-                    if secure_compare(hash, self.config['remote_hashes'][remote_path]):
+                        f'"checkRemoteFile": File ({filepath}) stored remote hash: {stored_hash}')
+                    if secure_compare(hash, stored_hash):
                         self.log.info(f'"checkRemoteFile": File ({filepath}) hash is verified.')
                         return True
                     else:
                         self.log.warning(f'"checkRemoteFile": File ({filepath}) hash verification is failed.')
                         return False
                 else:
-                    self.log.error(f'"checkRemoteFile": File ({filepath}) check failed: Hash not found in config file.')
+                    self.log.error(f'"checkRemoteFile": File ({filepath}) check failed: Hash not found in state.')
                     return False
         else:
             self.log.error('"checkRemoteFile": Can\'t take SSHClient.')
@@ -386,24 +2603,27 @@ class FileSync:
             bool: True or False.
         '''
         if os.path.exists(filepath):
-            if self.config['local_hashes']:
-                if filepath in self.config['local_hashes']:
-                    self.log.debug(f'"checkLocalFile": File ({filepath}) MD5 hash: {self.getMD5(filepath)}')
-                    self.log.debug(f'"checkLocalFile": File ({filepath}) Local MD5 hash: {self.config["local_hashes"][filepath]}')
-                    if secure_compare(self.getMD5(filepath), self.config['local_hashes'][filepath]):
-                        self.log.info(f'"checkLocalFile": File ({filepath}) hash is verified.')
-                        return True
-                    else:
-                        self.log.warning(f'"checkLocalFile": File ({filepath}) hash verification is failed.')
-                        return False
-            self.log.error(f'"checkLocalFile": File ({filepath}) check failed: Hash not found in config file.')
+            stored_hash = self.getStoredLocalHash(filepath)
+            if stored_hash:
+                hash = self.getHash(filepath, parseDigest(stored_hash)[0])
+                self.log.debug(f'"checkLocalFile": File ({filepath}) hash: {hash}')
+                self.log.debug(f'"checkLocalFile": File ({filepath}) stored hash: {stored_hash}')
+                if secure_compare(hash, stored_hash):
+                    self.log.info(f'"checkLocalFile": File ({filepath}) hash is verified.')
+                    return True
+                else:
+                    self.log.warning(f'"checkLocalFile": File ({filepath}) hash verification is failed.')
+                    return False
+            self.log.error(f'"checkLocalFile": File ({filepath}) check failed: Hash not found in state.')
             return False
         else:
             self.log.error(f'"checkLocalFile": File ({filepath}) not found.')
             return False
 
     def updateConfig(self, key: str, value: Optional[Union[str, dict]]) -> bool:
-        '''Update key:value pair in config file.
+        '''Update key:value pair in config file and loaded config.
+
+        Sync state (hashes) is not stored in config file, see StateStore.
 
         Args:
             key (str): key for change.
@@ -412,6 +2632,13 @@ class FileSync:
         Returns:
             bool: True or False.
         '''
+        with self._config_lock:
+            self.metrics.inc('config_writes')
+            return self._updateConfig(key, value)
+
+    def _updateConfig(self, key: str, value: Optional[Union[str, dict]]) -> bool:
+        '''updateConfig without lock.
+        '''
         if os.path.exists('config.json'):
             try:
                 with open('config.json', 'r') as f:
@@ -426,13 +2653,11 @@ class FileSync:
                     self.log.critical(f'"updateConfig": JSON error: {str(e)}')
                     sys.exit(1)
                 else:
-                    if key in config:
-                        if config[key] and type(value) is dict:
-                            config[key] = config[key].update(value)
-                        else:
-                            config[key] = value
+                    if key in config and config[key] and type(value) is dict:
+                        config[key].update(value)
                     else:
                         config[key] = value
+                    self.config[key] = config[key]
                     try:
                         with open('config.json', 'w') as f:
                             f.write(json.dumps(config))
@@ -445,7 +2670,7 @@ class FileSync:
         else:
             self.log.critical('"updateConfig": Can\'t found config file.')
             sys.exit(1)
-                        
+
     def updateRemoteHash(self, filepath: str) -> bool:
         '''Update hash info for remote file.
 
@@ -455,24 +2680,383 @@ class FileSync:
         Returns:
             bool: True or False.
         '''
-        ssh = self.getSSHClient()
-        if ssh:
-            remote_path = f'{self.REMOTE_PATH}/{filepath.split(os.path.sep)[::-1][0]}'
-            _, stdout, stderr = ssh.exec_command(f'md5sum {remote_path}')
-            ssh.close()
-            stdout = stdout.read().decode()
-            stderr = stderr.read().decode()
-            if stderr:
-                self.log.error(
-                    f'"updateRemoteHash": File check error: {str(stderr)}')
-                return False
-            if stdout:
-                hash = stdout.split()[0]
-                self.updateConfig('remote_hashes', {remote_path: hash})
-                return True
-        else:
+        remote_path = self.getRemotePath(filepath)
+        manifest = self.queryRemoteManifest([remote_path])
+        if manifest is None:
             self.log.error('"updateRemoteHash": Can\'t take SSHClient.')
             return False
+        entry = manifest.get(remote_path)
+        if entry and entry['hash']:
+            self.setRemoteManifestEntry(remote_path, entry)
+            self.setRemoteHash(remote_path, entry['hash'])
+            return True
+        self.log.error(f'"updateRemoteHash": Can\'t hash remote file ({remote_path}).')
+        return False
+
+    def getRemoteManifestCommand(self, algorithm: str, paths: Optional[list] = None) -> str:
+        '''Returns shell command for listing and hashing remote files.
+
+        Command reads "<size> <mtime> <path>" lines of already hashed files
+        from stdin, prints the same lines for all files to stdout and hashes
+        of new or changed files only to stderr. Output grows with number of
+        listed files, so tracked directories are listed this way only when
+        remote tree can't be used (see refreshRemoteTrees).
+
+        Args:
+            algorithm (str): hash algorithm.
+            paths (Optional[list]): remote paths, all files in remote folder by default.
+
+        Returns:
+            str: shell command.
+        '''
+        if paths:
+            targets = ' '.join(
+                shlex.quote('./' + path[len(self.REMOTE_PATH) + 1:]) for path in paths)
+        else:
+            targets = f'. -path ./{self.META_PATH[len(self.REMOTE_PATH) + 1:]} -prune -o'
+        hasher = f'xargs -r -d "\\n" {REMOTE_HASH_COMMANDS[algorithm]} -- >&2'
+        return (
+            f'cd {shlex.quote(self.REMOTE_PATH)} || exit 1; '
+            f'{{ cat; echo; find {targets} -type f -printf \'%s %T@ %p\\n\' 2>/dev/null; }} | '
+            f'awk -v hasher={shlex.quote(hasher)} \''
+            'listing == 0 { if ($0 == "") listing = 1; else known[$0] = 1; next } '
+            '{ print; if (!($0 in known)) print substr($0, length($1) + length($2) + 3) | hasher } '
+            'END { close(hasher) }\''
+        )
+
+    def queryRemoteManifest(self, paths: Optional[list] = None) -> Optional[Union[dict, None]]:
+        '''Returns hash, size and mtime of remote files in one round trip.
+
+        Files which size and mtime are not changed since last query
+        are not rehashed on remote host.
+
+        Args:
+            paths (Optional[list]): remote paths, all files in remote folder by default.
+
+        Returns:
+            Optional[Union[dict, None]]: {remote_path: {"hash", "size", "mtime"}} or None.
+        '''
+        algorithm = self.getRemoteHashAlgorithm()
+        known = {}
+        targets = set(paths or ())
+        if self.remote_manifest is not None and self.remote_manifest_algorithm == algorithm:
+            for remote_path, entry in list(self.remote_manifest.items()):
+                if paths and (not self.isUnderPaths(remote_path, targets)):
+                    continue
+                if entry['hash']:
+                    known[f'{entry["size"]} {entry["mtime"]} ./{remote_path[len(self.REMOTE_PATH) + 1:]}'] = entry
+        with self.metrics.timer('remote_manifest'):
+            res = self.connection.execCommand(
+                self.getRemoteManifestCommand(algorithm, paths),
+                ''.join(f'{line}\n' for line in known).encode()
+            )
+        if res is None:
+            return None
+        stdout, stderr, status = res
+        if status != 0:
+            self.log.error(f'"queryRemoteManifest": Remote command failed: {stderr.decode(errors="replace")}')
+            return None
+        hashes = {}
+        for line in stderr.decode(errors='replace').splitlines():
+            digest, _, name = line.partition('  ')
+            if name.startswith('./') and (not digest.startswith('\\')):
+                hashes[name[2:]] = digest
+            elif line:
+                self.log.warning(f'"queryRemoteManifest": {line}')
+        manifest = {}
+        for line in stdout.decode(errors='replace').splitlines():
+            size, mtime, name = line.split(' ', 2)
+            if self.isTempFile(name):
+                continue
+            remote_path = f'{self.REMOTE_PATH}/{name[2:]}'
+            if line in known:
+                manifest[remote_path] = known[line]
+            else:
+                digest = hashes.get(name[2:])
+                manifest[remote_path] = {
+                    'hash': formatDigest(algorithm, digest) if digest else None,
+                    'size': int(size),
+                    'mtime': mtime
+                }
+        self.log.debug(
+            f'"queryRemoteManifest": {len(manifest)} files listed, {len(hashes)} hashed on remote host.')
+        return manifest
+
+    @staticmethod
+    def isUnderPaths(remote_path: str, paths: set) -> bool:
+        '''Check that remote path is one of paths or inside one of them.
+
+        Args:
+            remote_path (str): remote file path.
+            paths (set): remote paths.
+
+        Returns:
+            bool: True or False.
+        '''
+        while remote_path:
+            if remote_path in paths:
+                return True
+            remote_path = remote_path.rpartition('/')[0]
+        return False
+
+    def mergeRemoteManifest(self, paths: list, manifest: dict) -> None:
+        '''Apply result of remote manifest query for some paths to remote manifest.
+
+        Args:
+            paths (list): queried remote paths.
+            manifest (dict): query result.
+        '''
+        targets = set(paths)
+        with self._trees_lock:
+            for remote_path in [path for path in self.remote_manifest if self.isUnderPaths(path, targets)]:
+                if remote_path not in manifest:
+                    self.setRemoteManifestEntry(remote_path, None)
+            for remote_path, entry in manifest.items():
+                if self.remote_manifest.get(remote_path) != entry:
+                    self.setRemoteManifestEntry(remote_path, entry)
+
+    def refreshRemoteManifest(self) -> bool:
+        '''Update remote files manifest for current sync cycle.
+
+        Without remote agent tracked directories are compared with remote
+        tree (see refreshRemoteTrees) and tracked files are listed. If
+        python3 is missing on remote host whole remote folder is listed
+        (remote hashing is limited to changed files, see
+        getRemoteManifestCommand) and every entry is compared with
+        previous manifest. Manifest kept by remote agent is used as is.
+
+        Returns:
+            bool: True or False.
+        '''
+        if self.agent_ready:
+            return True
+        algorithm = self.getRemoteHashAlgorithm()
+        if self.directories and self.getTreeCommand() is not None:
+            from merkle import MerkleTree
+
+            with self._trees_lock:
+                if self.remote_manifest is None or self.remote_manifest_algorithm != algorithm:
+                    self.remote_manifest = {}
+                    self.remote_manifest_algorithm = algorithm
+                    for root in self.directories:
+                        self.remote_trees[root] = MerkleTree()
+            if (not self.refreshRemoteTrees(self.directories)):
+                self.remote_manifest = None
+                return False
+            paths = [self.getRemotePath(file) for file in self.files]
+            manifest = self.queryRemoteManifest(paths) if paths else {}
+            if manifest is None:
+                self.remote_manifest = None
+                return False
+            self.mergeRemoteManifest(paths, manifest)
+            return True
+        manifest = self.queryRemoteManifest()
+        if manifest is None:
+            self.remote_manifest = None
+            return False
+        previous = self.remote_manifest if self.remote_manifest_algorithm == algorithm else None
+        self.remote_manifest = manifest
+        self.remote_manifest_algorithm = algorithm
+        if self.directories:
+            self.updateRemoteTrees(previous or {}, manifest)
+        return True
+
+    def getTreeCommand(self) -> Optional[Union[str, None]]:
+        '''Returns command starting remote agent in tree mode or None if agent can't be deployed.
+
+        Returns:
+            Optional[Union[str, None]]: shell command or None.
+        '''
+        for filename in ('hashing.py', 'watcher.py', 'merkle.py', 'agent.py'):
+            if self.deployRemoteHelper(filename) is None:
+                return None
+        meta = self.META_PATH[len(self.REMOTE_PATH) + 1:]
+        algorithm = self.getRemoteHashAlgorithm()
+        return (
+            f'cd {shlex.quote(self.REMOTE_PATH)} && exec python3 {shlex.quote(meta)}/agent.py '
+            f'--tree {shlex.quote(meta)}/tree-{algorithm}.json --algorithm {algorithm} '
+            f'--exclude {shlex.quote(meta)} .'
+        )
+
+    def refreshRemoteTrees(self, roots: list) -> bool:
+        '''Update remote trees of tracked directories from Merkle tree kept on remote host.
+
+        Remote agent in tree mode is started once (see openRemoteTree) and
+        keeps hashes of all remote directories up to date from its watcher.
+        Hashes of roots are compared with local copies of remote trees,
+        then only directories which hashes differ are listed, level by
+        level. Files uploaded since previous check are sent to be rehashed
+        at once. So traffic and work on both sides depend on number of
+        changed files, not on tree size.
+
+        Args:
+            roots (list): tracked directories.
+
+        Returns:
+            bool: True or False.
+        '''
+        command = self.getTreeCommand()
+        if command is None:
+            return False
+        with self._trees_lock:
+            written, self.remote_written = self.remote_written, set()
+        listed = 0
+        try:
+            with self.metrics.timer('remote_tree'):
+                if self.tree_command != command:
+                    self.closeRemoteTree()
+                if self.tree_channel is None:
+                    self.openRemoteTree(command)
+                request = {
+                    'update': sorted(written),
+                    'hash': [self.getRemoteTrackedPath(root)[len(self.REMOTE_PATH) + 1:] for root in roots]
+                }
+                while request:
+                    self.tree_channel.sendall((json.dumps(request) + '\n').encode())
+                    request = self.applyRemoteTree(json.loads(self.tree_reader.readline()))
+                    listed += len(request.get('list', ())) if request else 0
+        except Exception as e:
+            self.log.error(f'"refreshRemoteTrees": Can\'t compare remote tree: {str(e)}')
+            self.closeRemoteTree()
+            return False
+        self.log.debug(f'"refreshRemoteTrees": {listed} remote directories listed.')
+        return True
+
+    def openRemoteTree(self, command: str) -> None:
+        '''Start remote agent in tree mode and wait until its tree is built.
+
+        Args:
+            command (str): agent command, see getTreeCommand.
+
+        Raises:
+            OSError: channel can't be opened.
+            ValueError: agent failed to start.
+        '''
+        chan = self.connection.openChannel()
+        if chan is None:
+            raise OSError('channel is not opened')
+        try:
+            chan.exec_command(command)
+            reader = chan.makefile('rb')
+            event = json.loads(reader.readline())
+            if event.get('event') != 'ready':
+                raise ValueError('agent is not ready')
+        except Exception:
+            chan.close()
+            raise
+        self.log.info(f'"openRemoteTree": Remote tree agent is ready, {event.get("files")} files listed.')
+        self.tree_channel = chan
+        self.tree_reader = reader
+        self.tree_command = command
+
+    def closeRemoteTree(self) -> None:
+        '''Stop remote agent in tree mode, it's started again by next check.
+        '''
+        chan = self.tree_channel
+        self.tree_channel = None
+        self.tree_reader = None
+        self.tree_command = None
+        if chan is not None:
+            chan.close()
+
+    def applyRemoteTree(self, reply: dict) -> Optional[Union[dict, None]]:
+        '''Apply remote tree reply to remote trees and manifest.
+
+        Args:
+            reply (dict): "tree" event of remote agent.
+
+        Returns:
+            Optional[Union[dict, None]]: next request (directories to list) or None.
+        '''
+        from merkle import Node
+
+        listing_paths = []
+        with self._trees_lock:
+            for path, digest in reply['hash'].items():
+                root, _ = self.getRemoteRoot(f'{self.REMOTE_PATH}/{path}/')
+                if digest is None:
+                    self.removeRemoteTree(root, '')
+                elif digest != self.remote_trees[root].getHash():
+                    listing_paths.append(path)
+            for path, listing in reply['list'].items():
+                root, relpath = self.getRemoteRoot(f'{self.REMOTE_PATH}/{path}/')
+                relpath = relpath.rstrip('/')
+                if listing is None:
+                    self.removeRemoteTree(root, relpath)
+                    continue
+                tree = self.remote_trees[root]
+                node = tree.getNode(relpath)
+                known = dict(node.children) if node is not None else {}
+                prefix = f'{relpath}/' if relpath else ''
+                remote_prefix = f'{self.getRemoteTrackedPath(root)}/{prefix}'
+                for name, item in listing.items():
+                    child = known.pop(name, None)
+                    if 'dir' in item:
+                        if isinstance(child, str):
+                            self.setRemoteManifestEntry(remote_prefix + name, None)
+                        if (not isinstance(child, Node)) or tree.getHash(child) != item['dir']:
+                            listing_paths.append(f'{path}/{name}')
+                    else:
+                        if isinstance(child, Node):
+                            self.removeRemoteTree(root, prefix + name)
+                        if child != item['hash']:
+                            self.setRemoteManifestEntry(remote_prefix + name, item)
+                for name, child in known.items():
+                    if isinstance(child, Node):
+                        self.removeRemoteTree(root, prefix + name)
+                    else:
+                        self.setRemoteManifestEntry(remote_prefix + name, None)
+        return {'list': listing_paths} if listing_paths else None
+
+    def removeRemoteTree(self, root: str, relpath: str) -> None:
+        '''Remove remote directory files from remote tree and manifest.
+
+        Args:
+            root (str): tracked directory.
+            relpath (str): relative directory path, whole tracked directory if empty.
+        '''
+        tree = self.remote_trees[root]
+        node = tree.getNode(relpath)
+        if node is None:
+            return
+        remote_prefix = f'{self.getRemoteTrackedPath(root)}/{relpath}/' if relpath else f'{self.getRemoteTrackedPath(root)}/'
+        for path, _ in list(tree.items(node)):
+            self.setRemoteManifestEntry(remote_prefix + path, None)
+
+    def updateRemoteTrees(self, previous: dict, manifest: dict) -> None:
+        '''Apply difference between two remote manifests to remote directory trees.
+
+        Args:
+            previous (dict): previous manifest.
+            manifest (dict): new manifest.
+        '''
+        from merkle import MerkleTree
+
+        with self._trees_lock:
+            if (not previous):
+                for root in self.directories:
+                    self.remote_trees[root] = MerkleTree()
+            for remote_path, entry in manifest.items():
+                old = previous.get(remote_path)
+                if old is None or old['hash'] != entry['hash']:
+                    root, relpath = self.getRemoteRoot(remote_path)
+                    if root:
+                        self.remote_trees[root].set(relpath, entry['hash'] or '')
+            for remote_path in previous.keys() - manifest.keys():
+                root, relpath = self.getRemoteRoot(remote_path)
+                if root:
+                    self.remote_trees[root].remove(relpath)
+
+    def isRemoteMissing(self, filepath: str) -> bool:
+        '''Check that fresh remote manifest has no copy of file.
+
+        Args:
+            filepath (str): local file path.
+
+        Returns:
+            bool: True or False.
+        '''
+        return self.remote_manifest is not None and self.getRemotePath(filepath) not in self.remote_manifest
 
     def updateLocalHash(self, filepath: str) -> bool:
         '''Updates hash info for local file.
@@ -484,76 +3068,538 @@ class FileSync:
             bool: True or False.
         '''
         if os.path.exists(filepath):
-            hash = self.getMD5(filepath)
-            self.updateConfig('local_hashes', {filepath: hash})
+            hash = self.getHash(filepath)
+            self.setLocalHash(filepath, hash)
             return True
         else:
             self.log.error(f'"updateLocalHash": File ({filepath}) not found.')
             return False
 
-    def sync(self) -> None:
+    def pushFile(self, file: str) -> bool:
+        '''Upload changed local file and update hashes.
+
+        Args:
+            file (str): local file path.
+
+        Returns:
+            bool: True or False.
+        '''
+        if self.queueBatch('upload', file):
+            return True
+        self.log.info(f'"sync": Local copy of file ({file}) is changed. Upload to server...')
+        started = time.monotonic()
+        with self.metrics.timer('upload'):
+            uploaded = self.upload(file)
+        if (not uploaded):
+            self.metrics.inc('upload_errors')
+            return False
+        self.engine.record(os.path.getsize(file), time.monotonic() - started)
+        if (not self.takeStreamVerified(file)):
+            self.updateLocalHash(file)
+            self.updateRemoteHash(file)
+        self.log.info(f'"sync": Remote copy of file ({file}) is updated.')
+        return True
+
+    def pullFile(self, file: str) -> bool:
+        '''Download changed remote file and update hashes.
+
+        Args:
+            file (str): local file path.
+
+        Returns:
+            bool: True or False.
+        '''
+        if self.queueBatch('download', file):
+            return True
+        self.log.info(f'"sync": Remote copy of file ({file}) is changed. Download...')
+        started = time.monotonic()
+        with self.metrics.timer('download'):
+            downloaded = self.download(file)
+        if (not downloaded):
+            self.metrics.inc('download_errors')
+            return False
+        self.engine.record(os.path.getsize(file), time.monotonic() - started)
+        if (not self.takeStreamVerified(file)):
+            self.updateRemoteHash(file)
+            self.updateLocalHash(file)
+        self.log.info(f'"sync": Local copy of file ({file}) is updated.')
+        return True
+
+    def syncFile(self, file: str) -> bool:
+        '''Sync one file with remote copy.
+
+        Args:
+            file (str): local file path.
+
+        Returns:
+            bool: True if file was transferred.
+        '''
+        with self.engine.acquire(file) as locked:
+            if (not locked):
+                self.log.debug(f'"sync": File ({file}) is already syncing. Skipping.')
+                return False
+            return self._syncFile(file)
+
+    def _syncFile(self, file: str) -> bool:
+        '''syncFile without path lock.
+        '''
+        if os.path.exists(file):
+            if (not self.checkLocalFile(file)):
+                if self.getStoredLocalHash(file):
+                    return self.pushFile(file)
+                else:
+                    self.log.warning(f'"sync": Local hash for file ({file}) not found in state. Creating and check with remote copy.')
+                    self.updateLocalHash(file)
+                    if (not self.checkLocalFile(file)):
+                        return self.pushFile(file)
+            if (not self.checkRemoteFile(file)):
+                if self.isRemoteMissing(file):
+                    self.log.info(f'"sync": Remote copy of file ({file}) not found.')
+                    return self.pushFile(file)
+                elif self.state.get('remote_hashes', self.getRemotePath(file)):
+                    return self.pullFile(file)
+                else:
+                    self.log.warning(
+                        f'"sync": Remote hash for file ({file}) not found in state. Creating and check with local copy.')
+                    if (not self.updateRemoteHash(file)):
+                        self.log.info(f'"sync": Remote copy of file ({file}) not found.')
+                        return self.pushFile(file)
+                    if (not self.checkLocalFile(file)):
+                        return self.pullFile(file)
+            else:
+                self.log.info(f'"sync" File ({file}) is already up-to-date.')
+            return False
+        else:
+            self.log.info(f'"sync": Local copy of file ({file}) not found. Try to download...')
+            if self.queueBatch('download', file):
+                return True
+            if self.download(file):
+                if (not self.takeStreamVerified(file)):
+                    self.updateLocalHash(file)
+                    self.updateRemoteHash(file)
+                self.log.info(f'"sync": File copied. No actions required.')
+                return True
+            else:
+                self.log.error(f'"sync": File ({file}) not found in remote and local. Skipping.')
+                return False
+
+    def syncCycle(self, files: Optional[list] = None) -> list:
+        '''Check all files (or only given files) once.
+
+        Args:
+            files (Optional[list]): local file paths, all tracked files by default.
+
+        Returns:
+            list: checked files which were transferred.
+        '''
+        with self.metrics.profile(self.getOption('profile_file')):
+            with self.metrics.timer('cycle'):
+                transferred = self._syncCycle(files)
+        self.metrics.inc('cycles')
+        if self.getOption('metrics_file'):
+            self.metrics.writeJSON(self.getOption('metrics_file'))
+        return transferred
+
+    def _syncCycle(self, files: Optional[list] = None) -> list:
+        '''syncCycle without profiling and metrics export.
+        '''
+        self.log.info('"sync": Start checking files...')
+        full = files is None
+        if full:
+            with self.metrics.timer('cycle_manifest'):
+                if (not self.refreshRemoteManifest()):
+                    self.log.warning('"sync": Can\'t take remote files manifest. Checking files one by one.')
+            with self.metrics.timer('cycle_scan'):
+                if self.fanout is None:
+                    # Local trees of FanOut remotes are rescanned by FanOut once for all.
+                    for root in self.directories:
+                        self.scanLocalTree(root)
+                files = self.files + self.getChangedDirectoryFiles()
+        with self.metrics.timer('cycle_hash'):
+            self.prehashLocalFiles([file for file in files if os.path.exists(file)])
+        started = time.monotonic()
+        before = self.engine.stats
+        with self._batch_lock:
+            self.batch = {'upload': [], 'download': []}
+        with self.metrics.timer('cycle_sync'):
+            results = self.engine.run(self.syncFile, files)
+            batched = self.flushBatches()
+        results = [batched.get(file, result) for file, result in zip(files, results)]
+        elapsed = time.monotonic() - started
+        transferred = self.engine.stats['bytes'] - before['bytes']
+        if any(results):
+            self.log.info(
+                f'"sync": {sum(results)} of {len(results)} files transferred, {transferred} bytes '
+                f'in {elapsed:.2f}s ({formatRate(transferred, elapsed)}).')
+        self.log.debug(f'"sync": Connection stats: {self.connection.stats}')
+        if self.compression_stats is not None:
+            self.log.debug(f'"sync": Compression stats: {self.compression_stats.totals()}')
+        if self.fingerprints:
+            self.log.debug(
+                f'"sync": Fingerprint cache hits: {self.fingerprints.hits}, misses: {self.fingerprints.misses}')
+        if full and self.getOption('storage') == 'cas':
+            self.sweepCAS()
+        return [file for file, result in zip(files, results) if result]
+
+    def syncRemoteChanges(self) -> None:
+        '''Sync files changed on remote host only, using remote manifest.
+        '''
+        if (not self.refreshRemoteManifest()):
+            self.log.warning('"syncRemoteChanges": Can\'t take remote files manifest.')
+            return
+        changed = self.getRemoteChangedFiles()
+        if changed:
+            self.syncCycle(changed)
+
+    def getScheduleItem(self, file: str) -> str:
+        '''Returns scheduler item of file: tracked directory or file itself.
+
+        Args:
+            file (str): local file path.
+
+        Returns:
+            str: tracked directory or file path.
+        '''
+        return self.getDirectoryRoot(file) or file
+
+    def syncDue(self) -> None:
+        '''Check files and tracked directories which next check time is reached.
+
+        Remote state of due files is taken in one round trip, due
+        directories are compared with remote tree (see refreshRemoteTrees).
+        Without watcher due directories are rescanned locally. Number of
+        checks is limited by "check_rate" option.
+        '''
+        limit = None
+        if self.check_budget is not None:
+            limit = self.check_budget.available()
+            if (not limit):
+                return
+        items = self.scheduler.popDue(time.monotonic(), limit)
+        if (not items):
+            return
+        if self.check_budget is not None:
+            self.check_budget.take(len(items))
+        roots = [item for item in items if item in self.directories]
+        files = [item for item in items if item not in roots]
+        if (not self.agent_ready) and self.remote_manifest is not None:
+            paths = [self.getRemotePath(file) for file in files]
+            if roots and (not self.refreshRemoteTrees(roots)):
+                paths.extend(self.getRemoteTrackedPath(root) for root in roots)
+            manifest = self.queryRemoteManifest(paths) if paths else None
+            if manifest is not None:
+                self.mergeRemoteManifest(paths, manifest)
+        if (not self.watching) and self.fanout is None:
+            for root in roots:
+                self.scanLocalTree(root)
+        files.extend(file for file in self.getChangedDirectoryFiles() if self.getDirectoryRoot(file) in roots)
+        transferred = {self.getScheduleItem(file) for file in self.syncCycle(files)} if files else set()
+        now = time.monotonic()
+        for item in items:
+            interval = self.scheduler.record(item, item in transferred, now)
+            self.log.debug(f'"syncDue": Next check of ({item}) in {interval:.1f}s.')
+
+    def getCheckTimeout(self) -> float:
+        '''Returns seconds until next scheduled check can be done.
+
+        Returns:
+            float: seconds.
+        '''
+        next_time = self.scheduler.nextTime()
+        if next_time is None:
+            return self.getOption('check_interval_max')
+        timeout = next_time - time.monotonic()
+        if self.check_budget is not None:
+            timeout = max(timeout, self.check_budget.delay())
+        return max(0.0, timeout)
+
+    def getChangedTrackedFiles(self, changed: set) -> list:
+        '''Returns tracked files for changed paths from watcher or agent.
+
+        Local trees of FanOut remotes are updated by FanOut, not here.
+
+        Args:
+            changed (set): absolute paths.
+
+        Returns:
+            list: local file paths.
+        '''
+        tracked = [file for file in self.files if os.path.abspath(file) in changed]
+        for path in changed:
+            if self.fanout is None and self.getDirectoryRoot(path):
+                self.updateLocalTreeFile(path)
+        tracked.extend(file for file in self.getChangedDirectoryFiles() if file not in tracked)
+        return tracked
+
+    def syncAdaptive(self) -> None:
+        '''Sync loop with own check interval for every file.
+
+        Files and tracked directories are checked by CheckScheduler:
+        changed ones are checked every "check_interval_min" seconds,
+        interval of unchanged ones grows up to "check_interval_max".
+        Changes reported by watcher or remote agent are synced at once.
+        With watcher all files are rescanned every "full_scan_interval"
+        seconds only.
+        '''
+        self.syncCycle()
+        self.log.info('"sync": All files checked. Checking files by schedule...')
+        now = time.monotonic()
+        for item in self.files + self.directories:
+            self.scheduler.add(item, now)
+        full_scan_interval = self.getOption('full_scan_interval')
+        next_full_scan = now + full_scan_interval
+        while True:
+            timeout = self.getCheckTimeout()
+            if self.watching:
+                timeout = min(timeout, max(0.0, next_full_scan - time.monotonic()))
+            changed = self.changes.wait(timeout, self.getOption('watch_debounce'))
+            if self.changes.takeFullScan():
+                self.log.warning('"sync": Local changes are lost by watcher. Checking all files...')
+                self.syncCycle()
+                next_full_scan = time.monotonic() + full_scan_interval
+                continue
+            if self.watching and time.monotonic() >= next_full_scan:
+                self.syncCycle()
+                self.log.info('"sync": All files checked. Checking files by schedule...')
+                next_full_scan = time.monotonic() + full_scan_interval
+                continue
+            if changed:
+                tracked = self.getChangedTrackedFiles(changed)
+                self.log.debug(f'"sync": Changed files: {tracked}')
+                if tracked:
+                    self.syncCycle(tracked)
+                    for item in {self.getScheduleItem(file) for file in tracked}:
+                        self.scheduler.touch(item)
+            self.syncDue()
+
+    def startRemoteAgent(self) -> Optional[Union['AgentClient', None]]:
+        '''Start remote changes agent, if it's deployed.
+
+        Returns:
+            Optional[Union[AgentClient, None]]: started agent client or None.
+        '''
+        if self.agent_command is None:
+            return None
+        from agent import AgentClient
+
+        self.agent_algorithm = self.getRemoteHashAlgorithm()
+        self.agent = AgentClient(
+            self.connection.openChannel,
+            self.agent_command,
+            self.handleAgentEvent,
+            self.getOption('agent_ping_interval')
+        )
+        self.agent.start()
+        self.log.info('"startRemoteAgent": Watching remote changes with agent.')
+        return self.agent
+
+    def handleAgentEvent(self, event: dict) -> None:
+        '''Apply remote agent event to remote manifest and queue changed files.
+
+        Agent sends full snapshot after start, it replaces remote manifest
+        when it's complete. Later events update manifest one file at time.
+
+        Args:
+            event (dict): agent event.
+        '''
+        kind = event.get('event')
+        if kind in ('file', 'deleted'):
+            remote_path = f'{self.REMOTE_PATH}/{event["path"]}'
+            entry = None
+            if kind == 'file':
+                entry = {
+                    'hash': formatDigest(self.agent_algorithm, event['hash']),
+                    'size': event['size'],
+                    'mtime': event['mtime']
+                }
+            if (not self.agent_ready):
+                if entry is not None:
+                    self.agent_manifest[remote_path] = entry
+                return
+            self.setRemoteManifestEntry(remote_path, entry)
+            self.log.debug(f'"handleAgentEvent": Remote file ({remote_path}) is changed.')
+            for file in self.getLocalPaths(remote_path):
+                self.changes.push(os.path.abspath(file))
+        elif kind == 'ready':
+            with self._trees_lock:
+                previous = self.remote_manifest if self.remote_manifest_algorithm == self.agent_algorithm else None
+                self.remote_manifest = self.agent_manifest
+                self.remote_manifest_algorithm = self.agent_algorithm
+                self.agent_manifest = {}
+                if self.directories:
+                    self.updateRemoteTrees(previous or {}, self.remote_manifest)
+                self.agent_ready = True
+            self.log.info(f'"handleAgentEvent": Remote agent is ready, {len(self.remote_manifest)} files listed.')
+            for file in self.getRemoteChangedFiles():
+                self.changes.push(os.path.abspath(file))
+        elif kind == 'disconnected':
+            self.agent_ready = False
+            self.agent_manifest = {}
+            self.log.warning('"handleAgentEvent": Remote agent is disconnected. Polling remote files.')
+
+    def getLocalPaths(self, remote_path: str) -> list:
+        '''Returns tracked local paths of remote file.
+
+        Args:
+            remote_path (str): remote file path.
+
+        Returns:
+            list: local file paths.
+        '''
+        root, relpath = self.getRemoteRoot(remote_path)
+        if root:
+            return [os.path.join(root, *relpath.split('/'))]
+        return [file for file in self.files if self.getRemotePath(file) == remote_path]
+
+    def getRemoteChangedFiles(self) -> list:
+        '''Returns tracked files which remote manifest entry differs from stored remote hash.
+
+        Returns:
+            list: local file paths.
+        '''
+        changed = self.getChangedDirectoryFiles()
+        manifest = self.remote_manifest or {}
+        for file in self.files:
+            entry = manifest.get(self.getRemotePath(file))
+            stored_hash = self.state.get('remote_hashes', self.getRemotePath(file))
+            if entry is None or stored_hash is None or entry['hash'] != stored_hash:
+                changed.append(file)
+        return changed
+
+    def startMetrics(self, metrics: Optional[Union[Metrics, 'MetricsGroup']] = None) -> None:
+        '''Start metrics HTTP server if "metrics_port" is set.
+
+        SIGUSR1 (or POST /profile to metrics server) enables cProfile
+        for next sync cycle.
+
+        Args:
+            metrics (Optional[Union[Metrics, MetricsGroup]]): served metrics, own metrics by default (see FanOut).
+        '''
+        from metrics import startMetricsServer
+
+        if self.getOption('metrics_port') and self.metrics_server is None:
+            self.metrics_server = startMetricsServer(metrics or self.metrics, self.getOption('metrics_port'))
+        if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.metrics.requestProfile())
+
+    def startWatcher(self) -> Optional[Union[Watcher, None]]:
+        '''Start local changes watcher for tracked files.
+
+        Returns:
+            Optional[Union[Watcher, None]]: started watcher or None.
+        '''
+        watcher = createWatcher(
+            self.getOption('watch_backend'),
+            self.config['local_files'],
+            self.changes,
+            self.getOption('watch_poll_interval')
+        )
+        if watcher:
+            watcher.start()
+            self.log.info(f'"startWatcher": Watching local changes with {watcher.NAME}.')
+        return watcher
+
+    def sync(self, watcher: Optional[Watcher] = None) -> None:
         '''Syncing files.
+
+        With watcher, changed local files are synced as soon as they are
+        changed, remote files are checked every "sync_interval" seconds
+        and all files are rescanned every "full_scan_interval" seconds.
+        With remote agent, remote changes are synced as soon as agent
+        reports them and remote files are not polled.
+        Without both all files are checked every "sync_interval" seconds.
+        With "schedule" option set to "adaptive" every file is checked
+        on its own interval, see syncAdaptive.
+
+        Metrics server and signal handlers are started here, in calling
+        thread, see syncLoop for sync loop only.
+
+        Args:
+            watcher (Optional[Watcher]): started watcher feeding self.changes, own watcher is started if None.
         '''
         self.log.info('"sunc": Starting syncing files...')
+        self.startMetrics()
+        if watcher is None:
+            watcher = self.startWatcher()
+        return self.syncLoop(watcher)
+
+    def syncLoop(self, watcher: Optional[Watcher] = None) -> None:
+        '''Sync loop, see sync.
+
+        Starts remote agent and syncs files until error. Used by FanOut
+        to run and restart sync of every remote in its own thread.
+
+        Args:
+            watcher (Optional[Watcher]): started watcher feeding self.changes (see FanOut) or None.
+        '''
+        agent = self.startRemoteAgent()
+        self.watching = watcher is not None
+        if self.getOption('schedule') == 'adaptive':
+            return self.syncAdaptive()
+        interval = self.getOption('sync_interval')
+        full_scan_interval = self.getOption('full_scan_interval') if watcher else interval
+        if watcher is None and agent is None:
+            while True:
+                self.syncCycle()
+                self.log.info('"sync": All files checked. Sleeping...')
+                time.sleep(interval)
+        next_full_scan = 0
+        next_remote_check = 0
         while True:
-            self.log.info('"sync": Start checking files...')
-            for file in self.config['local_files']:
-                if os.path.exists(file):
-                    if (not self.checkLocalFile(file)):
-                        if self.config['local_hashes'] and file in self.config['local_hashes']:
-                            self.log.info(f'"sync": Local copy of file ({file}) is changed. Upload to server...')
-                            self.upload(file)
-                            self.updateLocalHash(file)
-                            self.updateRemoteHash(file)
-                            self.log.info(f'"sync": Remote copy of file ({file}) is updated.')
-                        else:
-                            self.log.warning(f'"sync": Local hash for file ({file}) not found in config. Creating and check with remote copy.')
-                            self.updateLocalHash(file)
-                            if (not self.checkLocalFile(file)):
-                                self.log.info(
-                                    f'"sync": Local copy of file ({file}) is changed. Upload to server...')
-                                self.upload(file)
-                                self.updateLocalHash(file)
-                                self.updateRemoteHash(file)
-                                self.log.info(f'"sync": Remote copy of file ({file}) is updated.')
-                    elif (not self.checkRemoteFile(file)):
-                        if self.config['remote_hashes'] and file in self.config['remote_hashes']:
-                            self.log.info(f'"sync": Remote copy of file ({file}) is changed. Download...')
-                            self.download(file)
-                            self.updateRemoteHash(file)
-                            self.updateLocalHash(file)
-                            self.log.info(f'"sync": Local copy of file ({file}) is updated.')
-                        else:
-                            self.log.warning(
-                                f'"sync": Remote hash for file ({file}) not found in config. Creating and check with local copy.')
-                            self.updateRemoteHash(file)
-                            if (not self.checkLocalFile(file)):
-                                self.log.info(
-                                    f'"sync": Remote copy of file ({file}) is changed. Download...')
-                                self.download(file)
-                                self.updateRemoteHash(file)
-                                self.updateLocalHash(file)
-                                self.log.info(
-                                    f'"sync": Local copy of file ({file}) is updated.')
-                    else:
-                        self.log.info(f'"sync" File ({file}) is already up-to-date.')
-                        continue
-                else:
-                    self.log.info(f'"sync": Local copy of file ({file}) not found. Try to download...')
-                    if self.download(file):
-                        self.updateLocalHash(file)
-                        self.updateRemoteHash(file)
-                        self.log.info(f'"sync": File copied. No actions required.')
-                        continue
-                    else:
-                        self.log.error(f'"sync": File ({file}) not found in remote and local. Skipping.')
-            self.log.info('"sync": All files checked. Sleeping...')
-            time.sleep(10)
+            now = time.monotonic()
+            if now >= next_full_scan:
+                self.syncCycle()
+                self.log.info('"sync": All files checked. Waiting for changes...')
+                next_full_scan = now + full_scan_interval
+                next_remote_check = now + interval
+            elif now >= next_remote_check:
+                if (not self.agent_ready):
+                    self.syncRemoteChanges()
+                next_remote_check = now + interval
+            changed = self.changes.wait(
+                min(next_full_scan, next_remote_check) - time.monotonic(),
+                self.getOption('watch_debounce')
+            )
+            if self.changes.takeFullScan():
+                self.log.warning('"sync": Local changes are lost by watcher. Checking all files...')
+                next_full_scan = 0
+                continue
+            if changed:
+                tracked = self.getChangedTrackedFiles(changed)
+                self.log.debug(f'"sync": Changed files: {tracked}')
+                self.syncCycle(tracked)
+
+
+def parseArgs(argv: Optional[list] = None) -> argparse.Namespace:
+    '''Returns command line arguments.
+
+    Args:
+        argv (Optional[list]): arguments, sys.argv[1:] by default.
+
+    Returns:
+        argparse.Namespace: arguments.
+    '''
+    parser = argparse.ArgumentParser(description='FileSync - sync files with remote host by scp.')
+    parser.add_argument(
+        '-o', '--option', action='append', default=[], metavar='OPTION=VALUE',
+        help='config option, overrides config file and FILESYNC_<OPTION> environment variable')
+    parser.add_argument(
+        '--headless', action='store_true',
+        help='never ask for config values (also FILESYNC_HEADLESS variable or stdin is not a terminal)')
+    return parser.parse_args(argv)
 
 
 if __name__ == '__main__':
-    fs = FileSync()
-    if fs.initLocal():
-        if fs.initRemote():
-            fs.sync()
+    args = parseArgs()
+    headless = args.headless or 'FILESYNC_HEADLESS' in os.environ or (not sys.stdin.isatty())
+    fs = FileSync(options=args.option, interactive=(not headless))
+    try:
+        if fs.initLocal():
+            fs.scanLocal()
+            if fs.getOption('remotes'):
+                FanOut(fs).sync()
+            elif fs.initRemote():
+                fs.sync()
+    finally:
+        fs.state.close()
     sys.exit(1)
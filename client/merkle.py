@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Merkle tree manifest.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import hashlib
+from typing import Iterator, List, Optional, Tuple, Union
+
+
+class Node:
+    '''Directory node: children are Node (subdirectory) or str (file digest).
+    '''
+    __slots__ = ('children', 'hash')
+
+    def __init__(self):
+        self.children = {}
+        self.hash = None
+
+
+class MerkleTree:
+    '''Tree of file digests with cached per-directory hashes.
+
+    Paths are relative, separated by "/". Changing a file marks only its
+    ancestors dirty, so updating N files costs O(N * depth). Comparing
+    two trees skips subtrees with equal hashes, so diff cost depends on
+    the number of changed files, not on the tree size.
+    '''
+    def __init__(self):
+        self.root = Node()
+        self.size = 0
+
+    @classmethod
+    def fromItems(cls, items: Iterator[Tuple[str, str]]) -> 'MerkleTree':
+        '''Returns tree built from (path, digest) pairs.
+
+        Args:
+            items (Iterator[Tuple[str, str]]): relative paths and digests.
+
+        Returns:
+            MerkleTree: new tree.
+        '''
+        tree = cls()
+        for path, digest in items:
+            tree.set(path, digest)
+        return tree
+
+    def _walk(self, path: str, create: bool = False) -> Tuple[List[Node], str]:
+        '''Returns nodes from root to parent directory of path and file name.
+        '''
+        parts = path.split('/')
+        nodes = [self.root]
+        for part in parts[:-1]:
+            child = nodes[-1].children.get(part)
+            if not isinstance(child, Node):
+                if not create:
+                    return [], parts[-1]
+                child = Node()
+                nodes[-1].children[part] = child
+            nodes.append(child)
+        return nodes, parts[-1]
+
+    def getNode(self, path: str = '') -> Optional[Union[Node, None]]:
+        '''Returns directory node.
+
+        Args:
+            path (str): relative directory path, root if empty.
+
+        Returns:
+            Optional[Union[Node, None]]: node or None if there is no such directory.
+        '''
+        node = self.root
+        for part in (path.split('/') if path else ()):
+            node = node.children.get(part)
+            if not isinstance(node, Node):
+                return None
+        return node
+
+    def get(self, path: str) -> Optional[Union[str, None]]:
+        '''Returns file digest.
+
+        Args:
+            path (str): relative path.
+
+        Returns:
+            Optional[Union[str, None]]: digest or None.
+        '''
+        nodes, name = self._walk(path)
+        if not nodes:
+            return None
+        child = nodes[-1].children.get(name)
+        return child if isinstance(child, str) else None
+
+    def set(self, path: str, digest: str) -> None:
+        '''Set file digest.
+
+        Args:
+            path (str): relative path.
+            digest (str): file digest.
+        '''
+        nodes, name = self._walk(path, create=True)
+        if nodes[-1].children.get(name) == digest:
+            return
+        if not isinstance(nodes[-1].children.get(name), str):
+            self.size += 1
+        nodes[-1].children[name] = digest
+        for node in nodes:
+            node.hash = None
+
+    def remove(self, path: str) -> None:
+        '''Remove file, empty directories are removed too.
+
+        Args:
+            path (str): relative path.
+        '''
+        nodes, name = self._walk(path)
+        if (not nodes) or (not isinstance(nodes[-1].children.get(name), str)):
+            return
+        del nodes[-1].children[name]
+        self.size -= 1
+        for node in nodes:
+            node.hash = None
+        parts = path.split('/')[:-1]
+        for depth in range(len(nodes) - 1, 0, -1):
+            if nodes[depth].children:
+                break
+            del nodes[depth - 1].children[parts[depth - 1]]
+
+    def removeTree(self, path: str) -> List[str]:
+        '''Remove all files of directory.
+
+        Args:
+            path (str): relative directory path.
+
+        Returns:
+            List[str]: relative paths of removed files.
+        '''
+        node = self.getNode(path)
+        if node is None or (not path):
+            return []
+        removed = [relpath for relpath, _ in self.items(node, f'{path}/')]
+        for relpath in removed:
+            self.remove(relpath)
+        return removed
+
+    def getHash(self, node: Optional[Node] = None) -> str:
+        '''Returns hash of directory, recomputing dirty subtrees only.
+
+        Args:
+            node (Optional[Node]): directory node, root by default.
+
+        Returns:
+            str: hex digest.
+        '''
+        if node is None:
+            node = self.root
+        if node.hash is None:
+            h = hashlib.blake2b(digest_size=20)
+            for name in sorted(node.children):
+                child = node.children[name]
+                if isinstance(child, Node):
+                    h.update(f'd\0{name}\0{self.getHash(child)}\n'.encode())
+                else:
+                    h.update(f'f\0{name}\0{child}\n'.encode())
+            node.hash = h.hexdigest()
+        return node.hash
+
+    def items(self, node: Optional[Node] = None, prefix: str = '') -> Iterator[Tuple[str, str]]:
+        '''Yields (path, digest) for all files.
+
+        Args:
+            node (Optional[Node]): directory node, root by default.
+            prefix (str): path prefix.
+
+        Yields:
+            Iterator[Tuple[str, str]]: relative paths and digests.
+        '''
+        if node is None:
+            node = self.root
+        for name, child in node.children.items():
+            if isinstance(child, Node):
+                yield from self.items(child, f'{prefix}{name}/')
+            else:
+                yield f'{prefix}{name}', child
+
+    def diff(self, other: 'MerkleTree') -> List[str]:
+        '''Returns paths of files which differ between trees.
+
+        Files present in only one tree are included.
+
+        Args:
+            other (MerkleTree): tree to compare with.
+
+        Returns:
+            List[str]: relative paths.
+        '''
+        changed = []
+        self._diff(self.root, other, other.root, '', changed)
+        return changed
+
+    def _diff(self, node: Optional[Node], other: 'MerkleTree', other_node: Optional[Node],
+              prefix: str, changed: List[str]) -> None:
+        if node is not None and other_node is not None and self.getHash(node) == other.getHash(other_node):
+            return
+        names = set(node.children if node else ()) | set(other_node.children if other_node else ())
+        for name in names:
+            child = node.children.get(name) if node else None
+            other_child = other_node.children.get(name) if other_node else None
+            if isinstance(child, Node) or isinstance(other_child, Node):
+                self._diff(
+                    child if isinstance(child, Node) else None,
+                    other,
+                    other_child if isinstance(other_child, Node) else None,
+                    f'{prefix}{name}/',
+                    changed
+                )
+                if isinstance(child, str) or isinstance(other_child, str):
+                    changed.append(f'{prefix}{name}')
+            elif child != other_child:
+                changed.append(f'{prefix}{name}')
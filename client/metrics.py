@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Metrics.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import io
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+
+PROMETHEUS_PREFIX = 'filesync'
+
+
+class Metrics:
+    '''Counters, timers and gauges of sync process.
+
+    Counters and timers are updated on hot paths, gauges are taken from
+    collectors (functions returning {name: value}) only when metrics are
+    exported, so components keep their own stats without knowing about
+    Metrics. Labels (like {"remote": <name>}) are added to every exported
+    Prometheus sample, see MetricsGroup.
+    '''
+    def __init__(self, labels: Optional[dict] = None):
+        self.NAME = self.__class__.__name__
+        self.log = logging.getLogger(self.NAME)
+        self.labels = dict(labels or {})
+        self._counters = {}
+        self._timers = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+        self._profile_requested = threading.Event()
+
+    def inc(self, name: str, value: float = 1) -> None:
+        '''Increase counter.
+
+        Args:
+            name (str): counter name.
+            value (float): increment.
+        '''
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        '''Add duration to timer.
+
+        Args:
+            name (str): timer name.
+            seconds (float): duration.
+        '''
+        with self._lock:
+            timer = self._timers.setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0})
+            timer['count'] += 1
+            timer['sum'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        '''Measure duration of "with" block.
+
+        Args:
+            name (str): timer name.
+        '''
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def addCollector(self, name: str, collector: Callable[[], dict]) -> None:
+        '''Add gauges source, its values are exported as "<name>_<key>".
+
+        Args:
+            name (str): collector name.
+            collector (Callable[[], dict]): function returning {key: number}.
+        '''
+        with self._lock:
+            self._collectors[name] = collector
+
+    def snapshot(self) -> dict:
+        '''Returns all metrics.
+
+        Returns:
+            dict: counters, timers and gauges.
+        '''
+        with self._lock:
+            counters = dict(self._counters)
+            timers = {name: dict(timer) for name, timer in self._timers.items()}
+            collectors = dict(self._collectors)
+        gauges = {}
+        for prefix, collector in collectors.items():
+            try:
+                values = collector()
+            except Exception as e:
+                self.log.warning(f'"snapshot": Collector "{prefix}" failed: {str(e)}')
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and (not isinstance(value, bool)):
+                    gauges[f'{prefix}_{key}'] = value
+        return {'time': time.time(), 'counters': counters, 'timers': timers, 'gauges': gauges}
+
+    def toPrometheus(self) -> str:
+        '''Returns metrics in Prometheus text format.
+
+        Returns:
+            str: exposition text.
+        '''
+        return formatPrometheus([self])
+
+    def writeJSON(self, path: str) -> bool:
+        '''Save metrics to JSON file, replacing it atomically.
+
+        Args:
+            path (str): file path.
+
+        Returns:
+            bool: True or False.
+        '''
+        temp_path = f'{path}.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(self.snapshot(), f, indent=2)
+            os.replace(temp_path, path)
+        except OSError as e:
+            self.log.error(f'"writeJSON": Can\'t save metrics file: {str(e)}')
+            return False
+        return True
+
+    def requestProfile(self) -> None:
+        '''Profile next sync cycle.
+        '''
+        self._profile_requested.set()
+
+    @contextmanager
+    def profile(self, path: str) -> Iterator[bool]:
+        '''Run "with" block under cProfile if profiling was requested.
+
+        Profile is saved to path (for pstats or snakeviz), top functions
+        are written to debug log.
+
+        Args:
+            path (str): profile file path.
+
+        Yields:
+            Iterator[bool]: True if block is profiled.
+        '''
+        if (not self._profile_requested.is_set()):
+            yield False
+            return
+        import cProfile
+        import pstats
+
+        self._profile_requested.clear()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield True
+        finally:
+            profiler.disable()
+            try:
+                profiler.dump_stats(path)
+            except OSError as e:
+                self.log.error(f'"profile": Can\'t save profile: {str(e)}')
+            else:
+                self.log.info(f'"profile": Profile is saved to {path}.')
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(20)
+            self.log.debug(f'"profile": {out.getvalue()}')
+
+
+def formatLabels(labels: dict) -> str:
+    '''Returns Prometheus labels string, like {remote="host:22"}.
+    '''
+    if (not labels):
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in sorted(labels.items())
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def formatPrometheus(sources: Iterable[Metrics]) -> str:
+    '''Returns metrics of several sources in Prometheus text format.
+
+    Samples of the same metric from all sources are grouped under one
+    TYPE line and told apart by labels of sources.
+
+    Args:
+        sources (Iterable[Metrics]): metrics with different labels.
+
+    Returns:
+        str: exposition text.
+    '''
+    families = {}
+
+    def add(name: str, kind: str, sample: str, labels: str, value) -> None:
+        families.setdefault(name, (kind, []))[1].append(f'{sample}{labels} {value}')
+
+    for metrics in sources:
+        snapshot = metrics.snapshot()
+        labels = formatLabels(metrics.labels)
+        for name, value in sorted(snapshot['counters'].items()):
+            add(f'{PROMETHEUS_PREFIX}_{name}_total', 'counter', f'{PROMETHEUS_PREFIX}_{name}_total', labels, value)
+        for name, timer in sorted(snapshot['timers'].items()):
+            family = f'{PROMETHEUS_PREFIX}_{name}_seconds'
+            add(family, 'summary', f'{family}_count', labels, timer['count'])
+            add(family, 'summary', f'{family}_sum', labels, f'{timer["sum"]:.6f}')
+            add(f'{family}_max', 'gauge', f'{family}_max', labels, f'{timer["max"]:.6f}')
+        for name, value in sorted(snapshot['gauges'].items()):
+            add(f'{PROMETHEUS_PREFIX}_{name}', 'gauge', f'{PROMETHEUS_PREFIX}_{name}', labels, value)
+    lines = []
+    for name, (kind, samples) in families.items():
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsGroup:
+    '''Metrics of several remotes exported together, see FanOut.
+
+    Every member must have own "remote" label. Profiling is requested
+    for the first member only, as with SIGUSR1.
+    '''
+    def __init__(self, members: Iterable[Metrics] = ()):
+        self.members = list(members)
+        self._lock = threading.Lock()
+
+    def add(self, metrics: Metrics) -> None:
+        with self._lock:
+            self.members.append(metrics)
+
+    def getMembers(self) -> list:
+        with self._lock:
+            return list(self.members)
+
+    def snapshot(self) -> dict:
+        '''Returns metrics of all members.
+
+        Returns:
+            dict: {"time", "remotes": {remote label: snapshot}}.
+        '''
+        return {
+            'time': time.time(),
+            'remotes': {metrics.labels.get('remote', ''): metrics.snapshot() for metrics in self.getMembers()}
+        }
+
+    def toPrometheus(self) -> str:
+        return formatPrometheus(self.getMembers())
+
+    def requestProfile(self) -> None:
+        members = self.getMembers()
+        if members:
+            members[0].requestProfile()
+
+
+class MetricsServer(threading.Thread):
+    '''HTTP server exporting metrics.
+
+    GET /metrics returns Prometheus text, GET /stats returns JSON,
+    POST /profile enables cProfile for next sync cycle.
+    '''
+    def __init__(self, metrics: Union[Metrics, MetricsGroup], port: int, host: str = '127.0.0.1'):
+        super().__init__(name='MetricsServer', daemon=True)
+        self.NAME = self.__class__.__name__
+        self.log = logging.getLogger(self.NAME)
+        self.metrics = metrics
+        from http.server import ThreadingHTTPServer
+
+        self.httpd = ThreadingHTTPServer((host, port), self.createHandler())
+
+    def createHandler(self) -> type:
+        from http.server import BaseHTTPRequestHandler
+
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    self.reply(200, metrics.toPrometheus(), 'text/plain; version=0.0.4')
+                elif self.path == '/stats':
+                    self.reply(200, json.dumps(metrics.snapshot()), 'application/json')
+                else:
+                    self.reply(404, 'Not found\n', 'text/plain')
+
+            def do_POST(self):
+                if self.path == '/profile':
+                    metrics.requestProfile()
+                    self.reply(202, 'Next sync cycle will be profiled.\n', 'text/plain')
+                else:
+                    self.reply(404, 'Not found\n', 'text/plain')
+
+            def reply(self, code: int, body: str, content_type: str):
+                data = body.encode()
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def run(self) -> None:
+        self.log.info(f'"run": Serving metrics on http://{self.httpd.server_address[0]}:{self.port}/metrics')
+        self.httpd.serve_forever()
+
+    def stop(self) -> None:
+        '''Stop server.
+        '''
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def startMetricsServer(metrics: Union[Metrics, MetricsGroup], port: int) -> Optional[Union[MetricsServer, None]]:
+    '''Returns started metrics server or None if port can't be used.
+
+    Args:
+        metrics (Union[Metrics, MetricsGroup]): metrics.
+        port (int): local TCP port.
+
+    Returns:
+        Optional[Union[MetricsServer, None]]: server or None.
+    '''
+    try:
+        server = MetricsServer(metrics, port)
+    except OSError as e:
+        logging.getLogger('startMetricsServer').error(
+            f'"startMetricsServer": Can\'t listen on port {port}: {str(e)}')
+        return None
+    server.start()
+    return server
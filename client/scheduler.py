@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Adaptive check scheduler.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import time
+import heapq
+import threading
+from typing import Hashable, List, Optional, Union
+
+
+class CheckScheduler:
+    '''Priority queue of next check times with per-item intervals.
+
+    Item which is changed is checked again after min_interval, every
+    check without changes multiplies its interval by backoff, up to
+    max_interval. Heap entries are not removed on reschedule, outdated
+    entries are skipped when popped.
+    '''
+    def __init__(self, min_interval: float = 2, max_interval: float = 600, backoff: float = 2):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self._heap = []
+        self._items = {}
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _push(self, item: Hashable, due: float, interval: float) -> None:
+        self._counter += 1
+        self._items[item] = (due, interval, self._counter)
+        heapq.heappush(self._heap, (due, self._counter, item))
+
+    def add(self, item: Hashable, now: Optional[float] = None) -> None:
+        '''Schedule item with min_interval, if it's not scheduled yet.
+
+        Args:
+            item (Hashable): item, like file path.
+            now (Optional[float]): current time.monotonic().
+        '''
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if item not in self._items:
+                self._push(item, now + self.min_interval, self.min_interval)
+
+    def remove(self, item: Hashable) -> None:
+        '''Stop scheduling item.
+
+        Args:
+            item (Hashable): item.
+        '''
+        with self._lock:
+            self._items.pop(item, None)
+
+    def record(self, item: Hashable, changed: bool, now: Optional[float] = None) -> float:
+        '''Reschedule checked item.
+
+        Args:
+            item (Hashable): item.
+            changed (bool): item was changed since previous check.
+            now (Optional[float]): current time.monotonic().
+
+        Returns:
+            float: new interval.
+        '''
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            interval = self._items.get(item, (0, self.min_interval, 0))[1]
+            if changed:
+                interval = self.min_interval
+            else:
+                interval = min(interval * self.backoff, self.max_interval)
+            self._push(item, now + interval, interval)
+            return interval
+
+    def touch(self, item: Hashable, now: Optional[float] = None) -> None:
+        '''Mark item as changed, without checking it: next check is after min_interval.
+
+        Args:
+            item (Hashable): item.
+            now (Optional[float]): current time.monotonic().
+        '''
+        self.record(item, True, now)
+
+    def popDue(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[Hashable]:
+        '''Returns items which check time is reached, earliest first.
+
+        Returned items are not scheduled until record is called for them.
+
+        Args:
+            now (Optional[float]): current time.monotonic().
+            limit (Optional[int]): maximum number of items.
+
+        Returns:
+            List[Hashable]: due items.
+        '''
+        now = time.monotonic() if now is None else now
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+                _, counter, item = heapq.heappop(self._heap)
+                entry = self._items.get(item)
+                if entry is None or entry[2] != counter:
+                    continue
+                self._items[item] = (float('inf'), entry[1], -1)
+                due.append(item)
+        return due
+
+    def nextTime(self) -> Optional[Union[float, None]]:
+        '''Returns time of the earliest scheduled check.
+
+        Returns:
+            Optional[Union[float, None]]: time.monotonic() value or None.
+        '''
+        with self._lock:
+            while self._heap:
+                due, counter, item = self._heap[0]
+                entry = self._items.get(item)
+                if entry is not None and entry[2] == counter:
+                    return due
+                heapq.heappop(self._heap)
+            return None
+
+    def getInterval(self, item: Hashable) -> Optional[Union[float, None]]:
+        '''Returns current check interval of item.
+
+        Args:
+            item (Hashable): item.
+
+        Returns:
+            Optional[Union[float, None]]: interval or None.
+        '''
+        with self._lock:
+            entry = self._items.get(item)
+            return entry[1] if entry else None
+
+
+class TokenBucket:
+    '''Rate limiter: rate tokens per second, up to burst tokens saved.
+    '''
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = max(1.0, burst if burst is not None else rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> int:
+        '''Returns number of whole tokens available now.
+
+        Returns:
+            int: tokens.
+        '''
+        with self._lock:
+            self._refill()
+            return int(self._tokens)
+
+    def take(self, count: int = 1) -> bool:
+        '''Take tokens without waiting.
+
+        Args:
+            count (int): number of tokens.
+
+        Returns:
+            bool: True if tokens are taken.
+        '''
+        with self._lock:
+            self._refill()
+            if self._tokens >= count:
+                self._tokens -= count
+                return True
+            return False
+
+    def acquire(self) -> None:
+        '''Take one token, waiting for it if needed.
+        '''
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def delay(self) -> float:
+        '''Returns seconds until next token is available.
+
+        Returns:
+            float: seconds.
+        '''
+        with self._lock:
+            self._refill()
+            return max(0.0, (1 - self._tokens) / self.rate)
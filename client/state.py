@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Sync state store.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import os
+import json
+import logging
+import threading
+from typing import Any
+
+
+# Journal is compacted into snapshot when it has more entries than
+# max(COMPACT_MIN_ENTRIES, number of keys in state).
+COMPACT_MIN_ENTRIES = 1000
+
+
+class StateStore:
+    '''In-memory sync state, persisted as snapshot plus append-only journal.
+
+    State is a dict of sections ("local_hashes", "remote_hashes", ...),
+    each section is a dict. Changes are kept in memory and appended to
+    the journal by flush, so one change costs the same regardless of
+    state size. When the journal grows, it is compacted into new
+    snapshot, written to temp file and renamed over old one.
+    '''
+    def __init__(self, path: str = 'state.json', flush_interval: float = 1.0):
+        self.NAME = self.__class__.__name__
+        self.log = logging.getLogger(self.NAME)
+        self.path = path
+        self.journal_path = f'{path}.journal'
+        self.flush_interval = flush_interval
+        self.writes = 0
+        self._data = {}
+        self._pending = []
+        self._journal_entries = 0
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.load()
+
+    def exists(self) -> bool:
+        '''Check that state was saved before.
+
+        Returns:
+            bool: True or False.
+        '''
+        return os.path.exists(self.path) or os.path.exists(self.journal_path)
+
+    def load(self) -> None:
+        '''Load snapshot and replay journal.
+
+        Broken journal lines are skipped. Unfinished last line (interrupted
+        write) is cut off, so next flush doesn't append to it.
+        '''
+        with self._lock:
+            self._data = {}
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    self._data = json.load(f)
+            self._journal_entries = 0
+            if os.path.exists(self.journal_path):
+                complete = 0
+                with open(self.journal_path, 'rb') as f:
+                    for line in f:
+                        if (not line.endswith(b'\n')):
+                            break
+                        complete += len(line)
+                        try:
+                            section, key, value = json.loads(line)
+                        except ValueError:
+                            self.log.warning('"load": Skipping broken journal entry.')
+                            continue
+                        self._apply(section, key, value)
+                        self._journal_entries += 1
+                if complete < os.path.getsize(self.journal_path):
+                    self.log.warning('"load": Cutting off unfinished journal entry.')
+                    os.truncate(self.journal_path, complete)
+
+    def _apply(self, section: str, key: str, value: Any) -> None:
+        '''Apply change to in-memory state, None value deletes key.
+        '''
+        if value is None:
+            self._data.get(section, {}).pop(key, None)
+        else:
+            self._data.setdefault(section, {})[key] = value
+
+    def get(self, section: str, key: str, default: Any = None) -> Any:
+        '''Returns value from state.
+
+        Args:
+            section (str): section name.
+            key (str): key.
+            default (Any): value if key not found.
+
+        Returns:
+            Any: value.
+        '''
+        with self._lock:
+            return self._data.get(section, {}).get(key, default)
+
+    def section(self, section: str) -> dict:
+        '''Returns copy of section.
+
+        Args:
+            section (str): section name.
+
+        Returns:
+            dict: section data.
+        '''
+        with self._lock:
+            return dict(self._data.get(section, {}))
+
+    def set(self, section: str, key: str, value: Any) -> None:
+        '''Set value in state. Saved on next flush.
+
+        Args:
+            section (str): section name.
+            key (str): key.
+            value (Any): JSON serializable value, None deletes key.
+        '''
+        with self._lock:
+            self._apply(section, key, value)
+            self._pending.append((section, key, value))
+
+    def delete(self, section: str, key: str) -> None:
+        '''Delete key from state. Saved on next flush.
+
+        Args:
+            section (str): section name.
+            key (str): key.
+        '''
+        self.set(section, key, None)
+
+    def flush(self) -> bool:
+        '''Append pending changes to journal, compact journal if it's too long.
+
+        Returns:
+            bool: True or False.
+        '''
+        with self._lock:
+            if not self._pending:
+                return True
+            try:
+                with open(self.journal_path, 'a') as f:
+                    f.write(''.join(json.dumps(entry) + '\n' for entry in self._pending))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                self.log.error(f'"flush": Can\'t write state journal: {str(e)}')
+                return False
+            self.writes += 1
+            self._journal_entries += len(self._pending)
+            self._pending = []
+            keys = sum(len(section) for section in self._data.values())
+            if self._journal_entries > max(COMPACT_MIN_ENTRIES, keys):
+                return self.compact()
+            return True
+
+    def compact(self) -> bool:
+        '''Write full snapshot atomically and clear journal.
+
+        Returns:
+            bool: True or False.
+        '''
+        with self._lock:
+            temp_path = f'{self.path}.tmp'
+            try:
+                with open(temp_path, 'w') as f:
+                    json.dump(self._data, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+                with open(self.journal_path, 'w'):
+                    pass
+            except OSError as e:
+                self.log.error(f'"compact": Can\'t write state snapshot: {str(e)}')
+                return False
+            self.writes += 1
+            self._journal_entries = 0
+            self.log.debug('"compact": State snapshot is saved.')
+            return True
+
+    def start(self) -> None:
+        '''Start background thread flushing changes every flush_interval seconds.
+        '''
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='StateStoreFlusher', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        '''Stop background thread and flush pending changes.
+        '''
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Tests setup.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import os
+import sys
+
+
+# Modules of client are imported by name, as main.py and remote helpers do.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
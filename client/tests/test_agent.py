@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Remote changes agent tests.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import io
+import os
+import json
+
+from agent import Agent
+from merkle import MerkleTree
+
+
+def serve(root: str, state: str, requests: list) -> list:
+    out = io.StringIO()
+    Agent(root, 'sha256', ('.meta',), out=out).serveTree(
+        state, io.StringIO(''.join(json.dumps(request) + '\n' for request in requests)))
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_tree_mode_lists_changed_directories_only(tmp_path):
+    for relpath in ('docs/a.txt', 'docs/sub/b.txt', 'other/c.txt', '.meta/state.json'):
+        path = tmp_path / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(relpath)
+        # Recently changed files are not cached, see FingerprintCache.
+        os.utime(path, (1000000000, 1000000000))
+    ready, reply = serve(str(tmp_path), str(tmp_path / '.meta' / 'tree.json'), [
+        {'hash': ['docs', 'missing'], 'list': ['docs', 'docs/sub']}
+    ])
+    assert ready == {'event': 'ready', 'files': 3}
+    assert reply['hash']['missing'] is None
+    listing = reply['list']['docs']
+    assert listing['a.txt']['hash'].startswith('sha256:') and listing['a.txt']['size'] == 10
+    # Client builds the same hashes from listed entries.
+    local = MerkleTree.fromItems([
+        ('a.txt', listing['a.txt']['hash']),
+        ('sub/b.txt', reply['list']['docs/sub']['b.txt']['hash'])
+    ])
+    assert local.getHash(local.getNode('sub')) == listing['sub']['dir']
+    assert local.getHash() == reply['hash']['docs']
+    (tmp_path / 'docs' / 'sub' / 'b.txt').unlink()
+    _, reply = serve(str(tmp_path), str(tmp_path / '.meta' / 'tree.json'), [{'list': ['docs']}])
+    assert sorted(reply['list']['docs']) == ['a.txt']
+    with open(tmp_path / '.meta' / 'tree.json') as f:
+        assert sorted(json.load(f)) == [str(tmp_path / 'docs' / 'a.txt'), str(tmp_path / 'other' / 'c.txt')]
+
+
+def test_tree_mode_applies_changes_between_requests(tmp_path):
+    (tmp_path / 'docs').mkdir()
+    (tmp_path / 'docs' / 'a.txt').write_text('a')
+    out = io.StringIO()
+
+    def requests():
+        yield json.dumps({'hash': ['docs']}) + '\n'
+        (tmp_path / 'docs' / 'b.txt').write_text('b')
+        yield json.dumps({'update': ['docs/b.txt'], 'list': ['docs']}) + '\n'
+        (tmp_path / 'docs' / 'a.txt').unlink()
+        yield json.dumps({'update': ['docs/a.txt'], 'list': ['docs']}) + '\n'
+
+    Agent(str(tmp_path), 'md5', ('.meta',), out=out).serveTree(str(tmp_path / 'tree.json'), requests(), 'polling')
+    _, first, second, third = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert first['hash']['docs']
+    assert sorted(second['list']['docs']) == ['a.txt', 'b.txt']
+    assert sorted(third['list']['docs']) == ['b.txt']
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Content-addressed chunk store tests.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import io
+import os
+import json
+import random
+
+import pytest
+
+import cas
+
+
+def upload(store: str, path: str, data: bytes) -> None:
+    source = path + '.src'
+    with open(source, 'wb') as f:
+        f.write(data)
+    chunks = cas.chunkFile(source, 4096)
+    missing = set(cas.missing(store, [digest for digest, _, _ in chunks]))
+    out = io.BytesIO()
+    for digest, offset, size in chunks:
+        if digest in missing:
+            missing.discard(digest)
+            cas.writeFrame(out, digest, data[offset:offset + size])
+    cas.writeEnd(out)
+    out.write(cas.makeManifest(chunks, 4096))
+    os.unlink(source)
+    cas.put(store, path, io.BytesIO(out.getvalue()))
+
+
+def test_put_writes_file_content(tmp_path):
+    store, path = str(tmp_path / 'store'), str(tmp_path / 'file')
+    data = random.Random(1).randbytes(100000)
+    upload(store, path, data)
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert cas.loadManifest(store, path)['size'] == len(data)
+
+
+def test_get_chunks_changed_file(tmp_path):
+    store, path = str(tmp_path / 'store'), str(tmp_path / 'file')
+    upload(store, path, random.Random(1).randbytes(100000))
+    data = random.Random(2).randbytes(50000)
+    with open(path, 'wb') as f:
+        f.write(data)
+    assert cas.loadManifest(store, path) is None
+    out = io.BytesIO()
+    cas.get(store, path, 4096, set(), out)
+    out.seek(0)
+    manifest = json.loads(out.readline())['manifest']
+    assert manifest['size'] == len(data)
+    assert b''.join(chunk for _, chunk in cas.iterFrames(out)) == data
+
+
+def getStoredSize(path: str) -> int:
+    '''Returns size of files in folder, hard links of one file are counted once.
+    '''
+    inodes = {}
+    for dirpath, _, files in os.walk(path):
+        for name in files:
+            st = os.stat(os.path.join(dirpath, name))
+            inodes[(st.st_dev, st.st_ino)] = st.st_size
+    return sum(inodes.values())
+
+
+def forbidClone(*args):
+    raise OSError('clone is not supported')
+
+
+def test_identical_content_is_stored_once(tmp_path, monkeypatch):
+    # Without reflinks files are hard links of stored object.
+    monkeypatch.setattr(cas, 'cloneFile', forbidClone)
+    store, first, second = str(tmp_path / 'store'), str(tmp_path / 'first'), str(tmp_path / 'second')
+    data = random.Random(1).randbytes(1000000)
+    upload(store, first, data)
+    upload(store, second, data)
+    with open(second, 'rb') as f:
+        assert f.read() == data
+    assert os.path.samefile(first, second)
+    # One copy of content, manifests and index; second copy would double it.
+    assert getStoredSize(str(tmp_path)) < len(data) * 1.5
+    assert (not os.listdir(os.path.join(store, 'incoming')))
+
+
+def test_put_reports_gone_chunks(tmp_path):
+    store, first, second = str(tmp_path / 'store'), str(tmp_path / 'first'), str(tmp_path / 'second')
+    shared = random.Random(1).randbytes(100000)
+    upload(store, first, shared)
+    chunks = cas.chunkFile(first, 4096)
+    digests = [digest for digest, _, _ in chunks]
+    assert (not cas.missing(store, digests))
+    for dirpath, _, files in os.walk(os.path.join(store, 'objects')):
+        for name in files:
+            os.unlink(os.path.join(dirpath, name))
+    out = io.BytesIO()
+    cas.writeEnd(out)
+    out.write(cas.makeManifest(chunks, 4096))
+    with pytest.raises(cas.MissingChunks) as error:
+        cas.put(store, second, io.BytesIO(out.getvalue()))
+    assert sorted(error.value.digests) == sorted(set(digests))
+    assert sorted(cas.missing(store, digests)) == sorted(digests)
+    # Client retries with gone chunks sent as literals.
+    upload(store, second, shared)
+    with open(second, 'rb') as f:
+        assert f.read() == shared
+
+
+def test_sweep_removes_stale_manifests_and_objects(tmp_path, monkeypatch):
+    monkeypatch.setattr(cas, 'cloneFile', forbidClone)
+    store = str(tmp_path / 'store')
+    first, second = str(tmp_path / 'first'), str(tmp_path / 'second')
+    shared = random.Random(1).randbytes(100000)
+    upload(store, first, shared)
+    upload(store, second, shared + random.Random(2).randbytes(100000))
+    os.unlink(second)
+    legacy = os.path.join(store, 'chunks', 'ab')
+    os.makedirs(legacy)
+    with open(os.path.join(legacy, 'ab' * 32), 'wb') as f:
+        f.write(b'old chunk')
+    result = cas.sweep(store, 0)
+    assert result == {'removed': 2, 'freed': 200009, 'manifests': 1}
+    assert (not os.path.exists(os.path.join(store, 'chunks')))
+    digests = [digest for digest, _, _ in cas.chunkFile(first, 4096)]
+    assert (not cas.missing(store, digests))
+    os.unlink(first)
+    cas.sweep(store, 0)
+    assert (not os.listdir(os.path.join(store, 'manifests')))
+    assert sorted(cas.missing(store, digests)) == sorted(digests)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Delta transfer tests.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import io
+import os
+import random
+import hashlib
+
+import pytest
+
+import delta
+
+
+def makeDelta(base: bytes, new: bytes, tmp_path, max_literal: float = 0) -> bytes:
+    signature = io.BytesIO()
+    delta.writeSignature(io.BytesIO(base), signature, delta.getBlockSize(len(base)))
+    signature.seek(0)
+    path = tmp_path / 'new'
+    path.write_bytes(new)
+    out = io.BytesIO()
+    with open(path, 'rb') as f:
+        delta.writeDelta(f, signature, out, max_literal)
+    return out.getvalue()
+
+
+def roundTrip(base: bytes, new: bytes, tmp_path) -> bytes:
+    data = makeDelta(base, new, tmp_path)
+    out = io.BytesIO()
+    digest = delta.applyDelta(io.BytesIO(base), io.BytesIO(data), out)
+    assert out.getvalue() == new
+    assert digest == hashlib.md5(new).hexdigest()
+    return data
+
+
+@pytest.fixture
+def base() -> bytes:
+    return random.Random(1).randbytes(300 * 1024 + 123)
+
+
+def test_weak_checksum_rolls(base):
+    block_size = 2048
+    a, b = delta.weakChecksum(base[:block_size])
+    for pos in range(1000):
+        out_byte, in_byte = base[pos], base[pos + block_size]
+        a = (a - out_byte + in_byte) % delta.MOD
+        b = (b - block_size * out_byte + a - 1) % delta.MOD
+        assert (a, b) == delta.weakChecksum(base[pos + 1:pos + 1 + block_size])
+
+
+def test_unchanged(base, tmp_path):
+    data = roundTrip(base, base, tmp_path)
+    assert len(data) < 100
+
+
+def test_edit_in_place(base, tmp_path):
+    new = bytearray(base)
+    new[5000:5100] = bytes(100)
+    data = roundTrip(base, bytes(new), tmp_path)
+    assert len(data) < delta.getBlockSize(len(base)) + 100
+
+
+def test_insert_and_delete(base, tmp_path):
+    new = base[:10000] + b'inserted' + base[10000:200000] + base[210000:]
+    data = roundTrip(base, new, tmp_path)
+    assert len(data) < 3 * delta.getBlockSize(len(base))
+
+
+def test_append_and_truncate(base, tmp_path):
+    roundTrip(base, base + b'tail', tmp_path)
+    roundTrip(base, base[:-1000], tmp_path)
+    roundTrip(base, b'', tmp_path)
+    roundTrip(b'', base[:5000], tmp_path)
+
+
+def test_rewritten_file_stops_delta(base, tmp_path):
+    new = random.Random(2).randbytes(4 * 1024 * 1024)
+    with pytest.raises(delta.DeltaTooLarge):
+        makeDelta(base, new, tmp_path, 0.5)
+
+
+def test_limit_keeps_small_edits(tmp_path):
+    base = random.Random(3).randbytes(3 * delta.LITERAL_CHECK_SIZE)
+    new = bytearray(base)
+    for offset in range(0, len(new), 100 * 1024):
+        new[offset:offset + 1000] = bytes(1000)
+    data = makeDelta(base, bytes(new), tmp_path, 0.5)
+    out = io.BytesIO()
+    delta.applyDelta(io.BytesIO(base), io.BytesIO(data), out)
+    assert out.getvalue() == bytes(new)
+    assert len(data) < len(base) // 10
+
+
+def test_truncated_delta(base, tmp_path):
+    data = makeDelta(base, base[::-1], tmp_path)
+    with pytest.raises(ValueError):
+        delta.applyDelta(io.BytesIO(base), io.BytesIO(data[:len(data) // 2]), io.BytesIO())
+
+
+def test_rebuild_file_keeps_base_on_error(base, tmp_path):
+    path = tmp_path / 'base'
+    path.write_bytes(base)
+    data = makeDelta(base, base[::-1], tmp_path)
+    with pytest.raises(ValueError):
+        delta.patchFile(str(path), io.BytesIO(data[:-1]))
+    assert path.read_bytes() == base
+    assert sorted(os.listdir(tmp_path)) == ['base', 'new']
+    delta.patchFile(str(path), io.BytesIO(data))
+    assert path.read_bytes() == base[::-1]
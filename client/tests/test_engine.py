@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Sync engine tests.
+#  Created by LulzLoL231 at 16/10/2026
+#
+from engine import SyncEngine
+
+
+def test_acquire_busy_path():
+    engine = SyncEngine(workers=1)
+    with engine.acquire('a') as locked:
+        assert locked
+        with engine.acquire('a') as again:
+            assert (not again)
+        with engine.acquire('b') as other:
+            assert other
+    with engine.acquire('a') as locked:
+        assert locked
+
+
+def test_acquire_releases_paths():
+    engine = SyncEngine(workers=1)
+    for i in range(100):
+        with engine.acquire(f'f{i}'):
+            pass
+    assert (not engine._busy)
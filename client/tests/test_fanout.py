@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Fan-out tests.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import io
+import hashlib
+import logging
+
+from engine import SyncEngine
+from fanout import FanOut
+from metrics import Metrics
+
+
+class FakeChannel:
+    def __init__(self, fail: bool = False):
+        self.data = io.BytesIO()
+        self.fail = fail
+        self.closed = False
+
+    def sendall(self, data: bytes) -> None:
+        if self.fail:
+            raise OSError('channel is closed')
+        self.data.write(data)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeRemote:
+    '''FileSync part used by FanOut.uploadFile.
+    '''
+    def __init__(self, name: str, fail: bool = False):
+        self.log = logging.getLogger(name)
+        self.config = {'hostname': name}
+        self.metrics = Metrics({'remote': name})
+        self.engine = SyncEngine(workers=1)
+        self.chan = FakeChannel(fail)
+        self.fanout = None
+        self.finished = None
+
+    def getOption(self, key: str):
+        return {'storage': 'plain', 'hash_algorithm': 'md5'}[key]
+
+    def isStreamVerify(self) -> bool:
+        return True
+
+    def getRemoteHashAlgorithm(self) -> str:
+        return 'md5'
+
+    def getRemotePath(self, filepath: str) -> str:
+        return '.FileSync/file'
+
+    def ensureRemoteDir(self, remote_path: str) -> bool:
+        return True
+
+    def openUploadStream(self, filepath: str, size: int, verify: bool) -> FakeChannel:
+        return self.chan
+
+    def finishUploadStream(self, filepath: str, chan: FakeChannel, hashers: dict, st) -> bool:
+        self.finished = hashers['md5'].hexdigest()
+        return hashlib.md5(chan.data.getvalue()).hexdigest() == self.finished
+
+
+def test_file_is_sent_to_all_remotes(tmp_path, monkeypatch):
+    path = tmp_path / 'file'
+    data = bytes(range(256)) * 4096
+    path.write_bytes(data)
+    reads = []
+    real_open = open
+
+    def countingOpen(file, *args, **kwargs):
+        reads.append(file)
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr('builtins.open', countingOpen)
+    first, second, broken = FakeRemote('first'), FakeRemote('second'), FakeRemote('broken', fail=True)
+    fanout = FanOut(first)
+    assert fanout.uploadFile(str(path), [first, broken, second]) == [first, second]
+    assert reads == [str(path)]
+    assert first.chan.data.getvalue() == second.chan.data.getvalue() == data
+    assert first.finished == second.finished == hashlib.md5(data).hexdigest()
+    assert broken.chan.closed and broken.finished is None
+    assert first.metrics.snapshot()['counters']['uploads_fanout'] == 1
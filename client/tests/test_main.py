@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Main module tests.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import os
+
+from main import getRemoteNames
+
+
+def makePath(*parts: str) -> str:
+    return os.path.join(os.path.abspath(os.sep), *parts)
+
+
+def test_unique_names_are_base_names():
+    paths = [makePath('home', 'a', 'notes.txt'), makePath('srv', 'project')]
+    assert getRemoteNames(paths) == {paths[0]: 'notes.txt', paths[1]: 'project'}
+
+
+def test_same_base_names_are_kept_apart():
+    first, second = makePath('home', 'a', 'conf.ini'), makePath('home', 'b', 'conf.ini')
+    third = makePath('etc', 'b', 'conf.ini')
+    names = getRemoteNames([first, second, third])
+    assert names == {first: 'a/conf.ini', second: 'home/b/conf.ini', third: 'etc/b/conf.ini'}
+
+
+def test_name_is_not_inside_another_name():
+    directory, file = makePath('srv', 'a'), makePath('home', 'a', 'f')
+    names = getRemoteNames([directory, file, makePath('home', 'x', 'f')])
+    assert (not names[file].startswith(names[directory] + '/'))
+    assert len(set(names.values())) == 3
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Merkle tree tests.
+#  Created by LulzLoL231 at 16/10/2026
+#
+from merkle import MerkleTree
+
+
+def makeTree() -> MerkleTree:
+    return MerkleTree.fromItems([
+        ('a.txt', '1'),
+        ('dir/b.txt', '2'),
+        ('dir/sub/c.txt', '3'),
+        ('same/deep/d.txt', '4'),
+        ('same/deep/e.txt', '5')
+    ])
+
+
+def test_equal_trees():
+    tree = makeTree()
+    assert tree.diff(makeTree()) == []
+    assert tree.getHash() == makeTree().getHash()
+
+
+def test_added_removed_changed():
+    tree = makeTree()
+    other = makeTree()
+    tree.set('dir/new.txt', '6')
+    tree.remove('dir/sub/c.txt')
+    tree.set('a.txt', 'changed')
+    assert sorted(tree.diff(other)) == ['a.txt', 'dir/new.txt', 'dir/sub/c.txt']
+    assert sorted(other.diff(tree)) == ['a.txt', 'dir/new.txt', 'dir/sub/c.txt']
+
+
+def test_file_replaced_by_directory():
+    tree = makeTree()
+    other = makeTree()
+    tree.remove('a.txt')
+    tree.set('a.txt/f.txt', '7')
+    assert sorted(tree.diff(other)) == ['a.txt', 'a.txt/f.txt']
+
+
+def test_removed_directory_is_pruned():
+    tree = makeTree()
+    tree.remove('dir/sub/c.txt')
+    assert 'sub' not in tree.root.children['dir'].children
+    assert tree.size == 4
+    assert tree.get('dir/sub/c.txt') is None
+
+
+def test_identical_subtrees_are_skipped(monkeypatch):
+    tree = makeTree()
+    other = makeTree()
+    tree.set('dir/b.txt', 'changed')
+    visited = []
+    original = MerkleTree._diff
+
+    def recordingDiff(self, node, other_tree, other_node, prefix, changed):
+        visited.append(prefix)
+        return original(self, node, other_tree, other_node, prefix, changed)
+
+    monkeypatch.setattr(MerkleTree, '_diff', recordingDiff)
+    assert tree.diff(other) == ['dir/b.txt']
+    assert 'same/' in visited
+    assert 'same/deep/' not in visited
+    assert 'dir/sub/' in visited
+
+
+def test_hash_is_updated_after_change():
+    tree = makeTree()
+    before = tree.getHash()
+    tree.set('same/deep/d.txt', 'changed')
+    assert tree.getHash() != before
+    tree.set('same/deep/d.txt', '4')
+    assert tree.getHash() == before
+
+
+def test_get_node_and_remove_tree():
+    tree = makeTree()
+    assert tree.getNode('') is tree.root
+    assert tree.getHash(tree.getNode('same')) == makeTree().getHash(makeTree().getNode('same'))
+    assert tree.getNode('a.txt') is None and tree.getNode('missing') is None
+    assert sorted(tree.removeTree('same')) == ['same/deep/d.txt', 'same/deep/e.txt']
+    assert tree.getNode('same') is None
+    assert tree.size == 3
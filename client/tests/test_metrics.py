@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Metrics tests.
+#  Created by LulzLoL231 at 16/10/2026
+#
+from metrics import Metrics, MetricsGroup
+
+
+def test_group_labels_remotes():
+    first, second = Metrics({'remote': 'first:22'}), Metrics({'remote': 'second:22'})
+    group = MetricsGroup([first])
+    group.add(second)
+    first.inc('uploads')
+    second.inc('uploads', 2)
+    second.observe('cycle', 0.5)
+    lines = group.toPrometheus().splitlines()
+    assert lines.count('# TYPE filesync_uploads_total counter') == 1
+    assert 'filesync_uploads_total{remote="first:22"} 1' in lines
+    assert 'filesync_uploads_total{remote="second:22"} 2' in lines
+    assert 'filesync_cycle_seconds_count{remote="second:22"} 1' in lines
+    assert set(group.snapshot()['remotes']) == {'first:22', 'second:22'}
+
+
+def test_no_labels():
+    metrics = Metrics()
+    metrics.inc('uploads')
+    assert 'filesync_uploads_total 1' in metrics.toPrometheus().splitlines()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Sync state store tests.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import json
+
+import state
+from state import StateStore
+
+
+def test_journal_replay(tmp_path):
+    path = str(tmp_path / 'state.json')
+    store = StateStore(path)
+    store.set('local_hashes', 'a', '1')
+    store.set('local_hashes', 'b', '2')
+    store.set('remote_hashes', 'a', {'hash': '3'})
+    store.delete('local_hashes', 'b')
+    assert store.flush()
+    assert (not (tmp_path / 'state.json').exists())
+    loaded = StateStore(path)
+    assert loaded.section('local_hashes') == {'a': '1'}
+    assert loaded.get('remote_hashes', 'a') == {'hash': '3'}
+    assert loaded.get('local_hashes', 'b') is None
+
+
+def test_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(state, 'COMPACT_MIN_ENTRIES', 5)
+    path = str(tmp_path / 'state.json')
+    store = StateStore(path)
+    for i in range(10):
+        store.set('local_hashes', 'a', str(i))
+        assert store.flush()
+    assert json.loads((tmp_path / 'state.json').read_text()) == {'local_hashes': {'a': '5'}}
+    assert len((tmp_path / 'state.json.journal').read_text().splitlines()) == 4
+    store.set('local_hashes', 'b', 'new')
+    assert store.flush()
+    loaded = StateStore(path)
+    assert loaded.section('local_hashes') == {'a': '9', 'b': 'new'}
+
+
+def test_unfinished_journal_entry(tmp_path):
+    path = str(tmp_path / 'state.json')
+    store = StateStore(path)
+    store.set('local_hashes', 'a', '1')
+    assert store.flush()
+    with open(f'{path}.journal', 'a') as f:
+        f.write('["local_hashes", "b", "tor')
+    reopened = StateStore(path)
+    assert reopened.section('local_hashes') == {'a': '1'}
+    reopened.set('local_hashes', 'c', '3')
+    assert reopened.flush()
+    loaded = StateStore(path)
+    assert loaded.section('local_hashes') == {'a': '1', 'c': '3'}
+
+
+def test_broken_journal_line_is_skipped(tmp_path):
+    path = str(tmp_path / 'state.json')
+    with open(f'{path}.journal', 'w') as f:
+        f.write('["local_hashes", "a", "1"]\n{broken\n["local_hashes", "b", "2"]\n')
+    loaded = StateStore(path)
+    assert loaded.section('local_hashes') == {'a': '1', 'b': '2'}
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Whole-file transfer backends.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import os
+import time
+import secrets
+import logging
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Optional, Union, Tuple
+
+if TYPE_CHECKING:
+    from paramiko import SFTPClient
+
+
+# Ciphers tried first when "ssh_ciphers" option is empty: AES-GCM is
+# authenticated encryption (no separate MAC), AES-CTR is accelerated by
+# AES-NI. Other ciphers of paramiko stay allowed after them.
+FAST_CIPHERS = (
+    'aes128-gcm@openssh.com',
+    'aes256-gcm@openssh.com',
+    'aes128-ctr',
+    'aes256-ctr'
+)
+# Channel window sizes compared by throughput probe, the first one is
+# paramiko default.
+PROBE_WINDOW_SIZES = (2 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024)
+PROBE_MARGIN = 1.05
+
+
+def getCipherPreference(ciphers: tuple, available: tuple) -> tuple:
+    '''Returns cipher list with preferred ciphers first.
+
+    Args:
+        ciphers (tuple): preferred ciphers, FAST_CIPHERS if empty.
+        available (tuple): ciphers supported by paramiko, in its order.
+
+    Returns:
+        tuple: available ciphers, preferred first.
+    '''
+    preferred = tuple(cipher for cipher in (ciphers or FAST_CIPHERS) if cipher in available)
+    return preferred + tuple(cipher for cipher in available if cipher not in preferred)
+
+
+class TransferBackend(ABC):
+    '''Base of whole-file transfer backends.
+
+    put and get raise exceptions on failure, callers handle them.
+    '''
+    name = ''
+
+    def __init__(self, connection):
+        self.NAME = self.__class__.__name__
+        self.log = logging.getLogger(self.NAME)
+        self.connection = connection
+
+    @abstractmethod
+    def put(self, local_path: str, remote_path: str) -> None:
+        '''Upload file.
+
+        Args:
+            local_path (str): local file path.
+            remote_path (str): remote file path.
+        '''
+
+    @abstractmethod
+    def get(self, remote_path: str, local_path: str) -> None:
+        '''Download file.
+
+        Args:
+            remote_path (str): remote file path.
+            local_path (str): local file path.
+        '''
+
+
+class SCPBackend(TransferBackend):
+    '''Transfers by scp.SCPClient.
+    '''
+    name = 'scp'
+
+    def getSCPClient(self):
+        from scp import SCPException
+
+        scp = self.connection.getSCPClient()
+        if scp is None:
+            raise SCPException('Can\'t take SCPClient.')
+        return scp
+
+    def put(self, local_path: str, remote_path: str) -> None:
+        scp = self.getSCPClient()
+        try:
+            scp.put(local_path, remote_path)
+        finally:
+            scp.close()
+
+    def get(self, remote_path: str, local_path: str) -> None:
+        scp = self.getSCPClient()
+        try:
+            scp.get(remote_path, local_path)
+        finally:
+            scp.close()
+
+
+class SFTPBackend(TransferBackend):
+    '''Transfers by SFTP with pipelined writes and prefetched reads.
+
+    Many read or write requests are in flight at once, so throughput is
+    limited by channel window (see ConnectionManager.setWindowSize)
+    instead of round trip time. Uploads are
+    written to temp file (in temp_dir or near remote file) and renamed
+    into place.
+    '''
+    name = 'sftp'
+
+    def __init__(self, connection, prefetch_requests: int = 0, temp_dir: str = ''):
+        super().__init__(connection)
+        self.prefetch_requests = prefetch_requests
+        self.temp_dir = temp_dir
+
+    def openSFTP(self) -> 'SFTPClient':
+        '''Returns SFTP client on new channel of shared transport.
+
+        Raises:
+            IOError: channel can't be opened.
+        '''
+        from paramiko import SFTPClient
+
+        chan = self.connection.openChannel()
+        if chan is None:
+            raise IOError('Can\'t open SFTP channel.')
+        chan.invoke_subsystem('sftp')
+        return SFTPClient(chan)
+
+    def put(self, local_path: str, remote_path: str) -> None:
+        temp_dir = self.temp_dir or os.path.dirname(remote_path) or '.'
+        temp_path = f'{temp_dir}/.{os.path.basename(remote_path)}.{secrets.token_hex(4)}.new'
+        sftp = self.openSFTP()
+        try:
+            with open(local_path, 'rb') as f:
+                sftp.putfo(f, temp_path, os.fstat(f.fileno()).st_size, confirm=True)
+            try:
+                sftp.posix_rename(temp_path, remote_path)
+            except IOError:
+                sftp.remove(temp_path)
+                raise
+        finally:
+            sftp.close()
+
+    def get(self, remote_path: str, local_path: str) -> None:
+        sftp = self.openSFTP()
+        try:
+            with open(local_path, 'wb') as f:
+                size = sftp.getfo(
+                    remote_path, f, prefetch=True,
+                    max_concurrent_prefetch_requests=self.prefetch_requests or None
+                )
+            if size != os.path.getsize(local_path):
+                raise IOError(f'{os.path.getsize(local_path)} of {size} bytes received')
+        finally:
+            sftp.close()
+
+
+def createBackend(name: str, connection, prefetch_requests: int = 0, temp_dir: str = '') -> TransferBackend:
+    '''Returns transfer backend by name, SCP for unknown names.
+
+    Args:
+        name (str): "scp" or "sftp".
+        connection (ConnectionManager): connection.
+        prefetch_requests (int): max concurrent SFTP read requests, unlimited if 0.
+        temp_dir (str): remote folder for temp files of SFTP uploads.
+
+    Returns:
+        TransferBackend: backend.
+    '''
+    if name == 'sftp':
+        return SFTPBackend(connection, prefetch_requests, temp_dir)
+    return SCPBackend(connection)
+
+
+def measureBackend(backend: TransferBackend, local_path: str,
+                   remote_path: str) -> Optional[Union[Tuple[float, float], None]]:
+    '''Returns upload and download seconds of file, None if transfer failed.
+
+    Args:
+        backend (TransferBackend): backend.
+        local_path (str): probe file.
+        remote_path (str): remote path for probe file.
+
+    Returns:
+        Optional[Union[Tuple[float, float], None]]: upload and download seconds or None.
+    '''
+    try:
+        started = time.perf_counter()
+        backend.put(local_path, remote_path)
+        uploaded = time.perf_counter() - started
+        started = time.perf_counter()
+        backend.get(remote_path, f'{local_path}.get')
+        downloaded = time.perf_counter() - started
+    except Exception as e:
+        backend.log.warning(f'"measureBackend": Probe of {backend.name} failed: {str(e)}')
+        return None
+    finally:
+        if os.path.exists(f'{local_path}.get'):
+            os.remove(f'{local_path}.get')
+    return uploaded, downloaded
+
+
+def probeThroughput(connection, local_path: str, remote_path: str, window_size: int = 0,
+                    temp_dir: str = '') -> dict:
+    '''Measure throughput of backends with channel window sizes using probe file.
+
+    Window size of connection is set to the fastest one.
+
+    Args:
+        connection (ConnectionManager): connection.
+        local_path (str): probe file with random data.
+        remote_path (str): remote path for probe file.
+        window_size (int): channel window, compared sizes are PROBE_WINDOW_SIZES if 0.
+        temp_dir (str): remote folder for temp files of SFTP uploads.
+
+    Returns:
+        dict: {"backend", "window_size", "rates": {"<backend>:<window>": bytes per second}}.
+    '''
+    size = os.path.getsize(local_path)
+    rates = {}
+    best = {'backend': 'scp', 'window_size': window_size or PROBE_WINDOW_SIZES[0], 'rate': 0.0}
+    for window in ((window_size,) if window_size else PROBE_WINDOW_SIZES):
+        connection.setWindowSize(window)
+        for name in ('scp', 'sftp'):
+            seconds = measureBackend(createBackend(name, connection, temp_dir=temp_dir), local_path, remote_path)
+            if seconds is None:
+                continue
+            rate = 2 * size / max(sum(seconds), 1e-6)
+            rates[f'{name}:{window}'] = round(rate)
+            # Bigger window or other backend must be clearly faster, not within noise.
+            if rate > best['rate'] * PROBE_MARGIN:
+                best = {'backend': name, 'window_size': window, 'rate': rate}
+    connection.setWindowSize(best['window_size'])
+    return {'backend': best['backend'], 'window_size': best['window_size'], 'rates': rates}
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+#
+#  FileSync - Local changes watchers.
+#  Created by LulzLoL231 at 16/10/2026
+#
+import os
+import sys
+import time
+import errno
+import ctypes
+import select
+import struct
+import logging
+import threading
+import ctypes.util
+from typing import Optional, Union, Iterable, Set
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+# IN_MODIFY is needed for files kept open by writer (logs, databases):
+# they get no IN_CLOSE_WRITE. Bursts of it are merged by ChangeQueue.
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class ChangeQueue:
+    '''Thread-safe set of changed paths with debouncing.
+    '''
+    def __init__(self):
+        self._paths = set()
+        self._full_scan = False
+        self._last_push = 0
+        self._cond = threading.Condition()
+
+    def push(self, path: str) -> None:
+        '''Add changed path.
+
+        Args:
+            path (str): changed path.
+        '''
+        with self._cond:
+            self._paths.add(path)
+            self._last_push = time.monotonic()
+            self._cond.notify_all()
+
+    def requestFullScan(self) -> None:
+        '''Request rescan of all tracked files, when changed paths are lost (inotify queue overflow).
+        '''
+        with self._cond:
+            self._full_scan = True
+            self._last_push = time.monotonic()
+            self._cond.notify_all()
+
+    def takeFullScan(self) -> bool:
+        '''Check and reset full rescan request.
+
+        Returns:
+            bool: True if full rescan is requested.
+        '''
+        with self._cond:
+            requested, self._full_scan = self._full_scan, False
+            return requested
+
+    def wait(self, timeout: float, debounce: float = 0) -> Set[str]:
+        '''Wait for changes and return them.
+
+        After first change waits until no new changes arrive for debounce
+        seconds, but no longer than ten debounce intervals.
+
+        Args:
+            timeout (float): max seconds to wait for first change.
+            debounce (float): quiet period in seconds.
+
+        Also returns when full rescan is requested, see takeFullScan.
+
+        Returns:
+            Set[str]: changed paths, empty on timeout.
+        '''
+        with self._cond:
+            if (not self._paths) and (not self._full_scan):
+                self._cond.wait(max(timeout, 0))
+            if (not self._paths) and (not self._full_scan):
+                return set()
+            deadline = time.monotonic() + debounce * 10
+            while True:
+                quiet_until = min(self._last_push + debounce, deadline)
+                left = quiet_until - time.monotonic()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            paths = self._paths
+            self._paths = set()
+            return paths
+
+
+class Watcher(threading.Thread):
+    '''Base class for local changes watchers.
+
+    Watches files and directories (recursively) and pushes changed file
+    paths into ChangeQueue.
+    '''
+    def __init__(self, paths: Iterable[str], queue: ChangeQueue):
+        super().__init__(daemon=True)
+        self.NAME = self.__class__.__name__
+        self.log = logging.getLogger(self.NAME)
+        self.queue = queue
+        self.paths = set(os.path.abspath(path) for path in paths)
+        self._stop_event = threading.Event()
+
+    def isTracked(self, path: str) -> bool:
+        '''Check that path is tracked file or inside tracked directory.
+
+        Args:
+            path (str): absolute path.
+
+        Returns:
+            bool: True or False.
+        '''
+        if path in self.paths:
+            return True
+        parent = os.path.dirname(path)
+        while parent and parent != os.path.dirname(parent):
+            if parent in self.paths:
+                return True
+            parent = os.path.dirname(parent)
+        return False
+
+    def stop(self) -> None:
+        '''Stop watcher thread.
+        '''
+        self._stop_event.set()
+
+
+class PollingWatcher(Watcher):
+    '''Watcher which compares stat of files every interval.
+    '''
+    def __init__(self, paths: Iterable[str], queue: ChangeQueue, interval: float = 1):
+        super().__init__(paths, queue)
+        self.interval = interval
+        self._stats = {}
+
+    def scan(self) -> dict:
+        '''Returns stat fingerprints for all watched files.
+
+        Returns:
+            dict: {path: (size, mtime_ns, inode)}.
+        '''
+        stats = {}
+        for path in self.paths:
+            if os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    for name in files:
+                        self._statInto(stats, os.path.join(root, name))
+            else:
+                self._statInto(stats, path)
+        return stats
+
+    @staticmethod
+    def _statInto(stats: dict, path: str) -> None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        stats[path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def run(self) -> None:
+        self._stats = self.scan()
+        while not self._stop_event.wait(self.interval):
+            stats = self.scan()
+            for path in set(stats) | set(self._stats):
+                if stats.get(path) != self._stats.get(path):
+                    self.queue.push(path)
+            self._stats = stats
+
+
+class InotifyWatcher(Watcher):
+    '''Watcher based on Linux inotify, called through ctypes.
+
+    Parent directories of tracked files are watched, so files replaced
+    by rename (as editors do) are noticed too.
+    '''
+    def __init__(self, paths: Iterable[str], queue: ChangeQueue):
+        super().__init__(paths, queue)
+        self._libc = self.loadLibc()
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}
+        for path in self.paths:
+            if os.path.isdir(path):
+                self.addTree(path)
+            else:
+                self.addWatch(os.path.dirname(path))
+
+    @staticmethod
+    def loadLibc():
+        '''Returns libc with inotify functions.
+
+        Raises:
+            OSError: inotify is not supported.
+
+        Returns:
+            ctypes.CDLL: libc.
+        '''
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is supported on Linux only')
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+
+    def addWatch(self, directory: str) -> Optional[Union[int, None]]:
+        '''Add inotify watch for directory.
+
+        Args:
+            directory (str): directory path.
+
+        Returns:
+            Optional[Union[int, None]]: watch descriptor or None.
+        '''
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            self.log.warning(
+                f'"addWatch": Can\'t watch {directory}: {os.strerror(ctypes.get_errno())}')
+            return None
+        self._dirs[wd] = directory
+        return wd
+
+    def addTree(self, directory: str) -> None:
+        '''Add inotify watches for directory and all subdirectories.
+
+        Args:
+            directory (str): directory path.
+        '''
+        for root, _, _ in os.walk(directory):
+            self.addWatch(root)
+
+    def run(self) -> None:
+        try:
+            while not self._stop_event.is_set():
+                ready, _, _ = select.select([self._fd], [], [], 1)
+                if not ready:
+                    continue
+                try:
+                    data = os.read(self._fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                self.handleEvents(data)
+        finally:
+            os.close(self._fd)
+
+    def handleEvents(self, data: bytes) -> None:
+        '''Parse inotify events and push changed paths.
+
+        Args:
+            data (bytes): raw events from inotify descriptor.
+        '''
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.log.warning('"handleEvents": Events queue overflow. Requesting full rescan.')
+                self.queue.requestFullScan()
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.isTracked(path):
+                    self.addTree(path)
+                    for root, _, files in os.walk(path):
+                        for file in files:
+                            self.queue.push(os.path.join(root, file))
+                elif mask & (IN_MOVED_FROM | IN_DELETE) and self.isTracked(path):
+                    # Files of moved out directory get no own events.
+                    self.queue.push(path)
+                continue
+            if self.isTracked(path):
+                self.queue.push(path)
+
+
+def createWatcher(backend: str, paths: Iterable[str], queue: ChangeQueue,
+                  interval: float = 1) -> Optional[Union[Watcher, None]]:
+    '''Returns watcher for backend.
+
+    Args:
+        backend (str): "auto", "inotify", "polling" or "none".
+        paths (Iterable[str]): tracked files and directories.
+        queue (ChangeQueue): queue for changed paths.
+        interval (float): polling interval in seconds.
+
+    Returns:
+        Optional[Union[Watcher, None]]: watcher or None for "none" backend.
+    '''
+    log = logging.getLogger('createWatcher')
+    if backend in ('auto', 'inotify'):
+        try:
+            return InotifyWatcher(paths, queue)
+        except (OSError, AttributeError) as e:
+            log.warning(f'"createWatcher": inotify is not available: {str(e)}. Using polling.')
+            backend = 'polling'
+    if backend == 'polling':
+        return PollingWatcher(paths, queue, interval)
+    return None